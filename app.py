@@ -1,15 +1,26 @@
 from functools import partial
 from pathlib import Path
 
-from pandas import DataFrame, read_csv, read_excel
+from pandas import DataFrame, concat, read_csv, read_excel
 import streamlit as st
 from more_itertools import ichunked
 from stqdm import stqdm
 
-from onnx_model_utils import predict, predict_bulk, max_pred_bulk
+from batching_utils import batch_report
+from onnx_model_utils import pipeline, predict, predict_bulk
+from prediction_utils import Predictions, unique_codes
+from cleaning_utils import clean_series
 from download import download_link
 
-PRED_BATCH_SIZE = 4
+# Texts per call to `predict_bulk`, which batches them by length itself.
+# Only sets how often the progress bar moves.
+PRED_CHUNK_SIZE = 1024
+# Output choices of the bulk coder, as `Predictions.output_frame` modes
+OUTPUT_MODES = {
+    "Best category": "max",
+    "Top categories": "top_k",
+    "All category scores": "scores",
+}
 
 st.set_page_config(page_title="ROTA", initial_sidebar_state="collapsed")
 
@@ -39,8 +50,9 @@ st.markdown("---")
 st.markdown("## 📑 Bulk Coder")
 st.warning(
     "⚠️ *Note:* Your input data will be deduplicated"
-    " on the selected column to reduce computation requirements."
-    " You will need to re-join the results on your offense text column."
+    " on the selected column to reduce computation requirements,"
+    " unless you choose to keep every row."
+    " Otherwise you will need to re-join the results on your offense text column."
 )
 st.markdown("1️⃣ **Upload File**")
 uploaded_file = st.file_uploader("Bulk Upload", type=["xlsx", "csv"])
@@ -64,43 +76,72 @@ if uploaded_file is not None:
         options=list(string_columns),
         index=string_columns.index(longest_column),
     )
+    keep_rows = st.checkbox(
+        "Keep every row and all its columns (no need to re-join)", value=False
+    )
     original_length = len(df)
-    df_unique = df.drop_duplicates(subset=[selected_column]).copy()
+    if keep_rows:
+        df_unique = df
+        st.markdown(f"Uploaded Data Sample `(N Rows = {original_length})`")
+    else:
+        df_unique = df.drop_duplicates(subset=[selected_column]).copy()
+        st.markdown(
+            f"Uploaded Data Sample `(Deduplicated. N Rows = {len(df_unique)},"
+            f" Original N = {original_length})`"
+        )
     del df
-    st.markdown(
-        f"Uploaded Data Sample `(Deduplicated. N Rows = {len(df_unique)},"
-        f" Original N = {original_length})`"
-    )
     st.table(df_unique.head(20))
     st.write(f"3️⃣ **Predict Using Column: `{selected_column}`**")
 
     column = df_unique[selected_column].copy()
+    # The columns that go out with the predictions
+    out_df = df_unique if keep_rows else column.to_frame()
     del df_unique
+    output_mode = OUTPUT_MODES[st.radio("Output", list(OUTPUT_MODES))]
+    top_k = 3
+    if output_mode == "top_k":
+        top_k = int(st.number_input("Categories per offense", 2, 10, 3))
+    as_percent = st.checkbox("Scores as percentages (0-100)", value=True)
+    label_ids = st.checkbox(
+        "Category ids instead of names (with a lookup table)", value=False
+    )
     if st.button("Compute Predictions"):
-        input_texts = (value for _, value in column.items())
+        # Clean the whole column at once, each distinct value only once, and
+        # only predict each distinct cleaned text once: many raw variants
+        # clean to the same text
+        unique_texts, text_codes = unique_codes(clean_series(column))
+        st.markdown(
+            f"`{len(unique_texts)}` distinct cleaned texts" f" for `{len(column)}` rows"
+        )
 
-        n_batches = (len(column) // PRED_BATCH_SIZE) + 1
+        n_chunks = (len(unique_texts) // PRED_CHUNK_SIZE) + 1
 
-        bulk_preds = []
-        for batch in stqdm(
-            ichunked(input_texts, PRED_BATCH_SIZE),
-            total=n_batches,
+        chunk_preds = []
+        # The batches of this job only, the controller is shared by sessions
+        batch_records = []
+        for chunk in stqdm(
+            ichunked(unique_texts, PRED_CHUNK_SIZE),
+            total=n_chunks,
             desc="Bulk Predict Progress",
         ):
-            batch_preds = predict_bulk(batch)
-            bulk_preds.extend(batch_preds)
-
-        pred_df = column.to_frame()
-        max_preds = max_pred_bulk(bulk_preds)
-        pred_df["charge_category_pred"] = [p["label"] for p in max_preds]
-        pred_df["charge_category_pred_confidence"] = [
-            int(round(p["score"] * 100, 0)) for p in max_preds
-        ]
+            chunk_preds.append(predict_bulk(chunk, clean=False, records=batch_records))
+        # Back out to every row
+        # No chunks for a file with a header and no rows
+        bulk_preds = Predictions.concat(chunk_preds, pipeline.label_names)[text_codes]
+        del chunk_preds
+        del text_codes
+        with st.expander("Batch sizes (tokens per batch)"):
+            st.table(batch_report(batch_records))
+
+        output = bulk_preds.output_frame(
+            output_mode, top_k, as_percent, label_ids, index=column.index
+        )
+        label_table = bulk_preds.label_table()
+        pred_df = concat([out_df, output], axis=1)
         del column
+        del out_df
         del bulk_preds
-        del max_preds
-
-        # # TODO: Add all scores
+        del output
 
         st.write("**Sample Output**")
         st.table(pred_df.head(100))
@@ -111,3 +152,12 @@ if uploaded_file is not None:
             "⬇️ Download as CSV",
         )
         st.markdown(tmp_download_link, unsafe_allow_html=True)
+        if label_ids:
+            st.markdown(
+                download_link(
+                    label_table,
+                    f"{file_name}-ncrp-category-ids.csv",
+                    "⬇️ Download the category ids",
+                ),
+                unsafe_allow_html=True,
+            )
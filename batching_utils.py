@@ -0,0 +1,289 @@
+import os
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+)
+
+import pandas as pd
+from numpy import full, int64, ndarray
+
+
+def token_budget_batches(
+    lengths: Sequence[int], max_tokens: int, max_batch_size: Optional[int] = None
+) -> List[List[int]]:
+    """Group texts of similar length into batches of at most `max_tokens`
+
+    The texts are sorted by length, so that each batch pads to the length of
+    texts close to its own, and batches are filled while the padded size
+    (number of texts x longest text) stays within the budget. A text longer
+    than the budget gets a batch of its own.
+
+    Args:
+        lengths (Sequence[int]): Number of tokens of each text
+        max_tokens (int): Budget of padded tokens per batch
+        max_batch_size (int, optional): Most texts per batch. Defaults to None
+          (no limit beyond the budget).
+
+    Returns:
+        List[List[int]]: Positions of the texts in each batch, shortest
+          texts first
+    """
+    return list(iter_batches(lengths, lambda: max_tokens, max_batch_size))
+
+
+def iter_batches(
+    lengths: Sequence[int],
+    budget: Callable[[], int],
+    max_batch_size: Optional[int] = None,
+) -> Iterator[List[int]]:
+    """`token_budget_batches`, with the budget asked for before each batch
+
+    Args:
+        lengths (Sequence[int]): Number of tokens of each text
+        budget (Callable[[], int]): Gives the budget of the next batch, eg:
+          `lambda: controller.size` for a `BatchSizeController`
+        max_batch_size (int, optional): Most texts per batch
+
+    Yields:
+        List[int]: Positions of the texts in each batch, shortest texts first
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    start = 0
+    while start < len(order):
+        max_tokens = budget()
+        end = start + 1
+        # Sorted, so the new text is the longest of the batch
+        while (
+            end < len(order)
+            and (max_batch_size is None or end - start < max_batch_size)
+            and (end - start + 1) * lengths[order[end]] <= max_tokens
+        ):
+            end += 1
+        yield order[start:end]
+        start = end
+
+
+def pad_batch(
+    encodings: Mapping[str, Sequence[Sequence[int]]],
+    indices: Sequence[int],
+    pad_values: Optional[Mapping[str, int]] = None,
+    padding_side: str = "right",
+) -> Dict[str, ndarray]:
+    """Pad some of the tokenized texts into int64 arrays
+
+    Args:
+        encodings (Mapping[str, Sequence[Sequence[int]]]): Unpadded tokenizer
+          output, eg: {"input_ids": [[0, 5, 2], [0, 2]], "attention_mask": ...}
+        indices (Sequence[int]): The texts to put in the batch
+        pad_values (Mapping[str, int], optional): Padding value of each key,
+          0 for keys that are not given (eg: "attention_mask")
+        padding_side (str, optional): "right" or "left". Defaults to "right".
+
+    Returns:
+        Dict[str, ndarray]: A (len(indices), longest) array per key
+    """
+    pad_values = pad_values or {}
+    width = max(len(encodings["input_ids"][i]) for i in indices)
+    batch = {}
+    for key, rows in encodings.items():
+        array = full((len(indices), width), pad_values.get(key, 0), dtype=int64)
+        for row, i in enumerate(indices):
+            values = rows[i]
+            if padding_side == "left":
+                array[row, width - len(values) :] = values
+            else:
+                array[row, : len(values)] = values
+        batch[key] = array
+    return batch
+
+
+def padding_stats(lengths: Sequence[int], batches: List[List[int]]) -> Dict[str, float]:
+    """How many of the tokens sent to the model are padding
+
+    Returns:
+        Dict[str, float]: "batches", "tokens" (real ones), "padded_tokens"
+          (sent to the model) and "padding" (share of padded tokens that are
+          padding)
+    """
+    tokens = sum(lengths)
+    padded = sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+    return {
+        "batches": len(batches),
+        "tokens": tokens,
+        "padded_tokens": padded,
+        "padding": 1 - tokens / padded if padded else 0.0,
+    }
+
+
+# Batches kept in `BatchSizeController.history`
+HISTORY_SIZE = 1000
+
+
+@dataclass
+class BatchRecord:
+    """One batch run by the model"""
+
+    size: int  # token budget the batch was formed with
+    rows: int
+    tokens: int  # tokens of the texts, without padding
+    seconds: float
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else float("inf")
+
+
+@dataclass
+class BatchSizeController:
+    """Picks the token budget of each batch from the time previous ones took
+
+    Without a `target_latency`, the budget is tuned for throughput by hill
+    climbing: the tokens per second of each budget tried are averaged, the
+    budget moves by `factor` in the direction that helps and turns back when
+    it stops helping, so it keeps probing the neighbours of the best budget.
+    Tokens per second rather than rows per second, since texts are batched
+    from shortest to longest and rows per second falls along the way
+    whatever the budget.
+
+    With a `target_latency` (seconds per batch), the budget is scaled by
+    target / latency after each batch, by at most `factor` at a time, which
+    settles on the budget whose batches take about `target_latency`.
+
+    The budget stays within `min_size` and `max_size`; setting them equal
+    gives a fixed budget.
+
+    One controller can be shared by the threads of a server: `record` takes
+    a lock, and only the last `HISTORY_SIZE` batches are kept in `history`.
+    `throughput` has an entry per budget tried, of which there are few
+    since budgets move by `factor`. To report on one job, collect its
+    `BatchRecord`s (see `ONNXCPUClassificationPipeline.bulk`) and pass them
+    to `batch_report`.
+    """
+
+    size: int = 8192
+    min_size: int = 256
+    max_size: int = 65536
+    target_latency: Optional[float] = None
+    factor: float = 1.5
+    smoothing: float = 0.3  # weight of a new measure in the averages
+    history: Deque[BatchRecord] = field(
+        default_factory=lambda: deque(maxlen=HISTORY_SIZE)
+    )
+    throughput: Dict[int, float] = field(default_factory=dict)
+    direction: int = 1
+    lock: Lock = field(default_factory=Lock, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not 0 < self.min_size <= self.max_size:
+            raise ValueError("Need 0 < min_size <= max_size")
+        if self.factor <= 1:
+            raise ValueError("factor must be over 1")
+        self.size = self._clamp(self.size)
+
+    @classmethod
+    def from_env(cls, size: int = 8192) -> "BatchSizeController":
+        """The controller set with `ROTA_BATCH_MIN_TOKENS`,
+        `ROTA_BATCH_MAX_TOKENS` and `ROTA_BATCH_TARGET_LATENCY` (0 tunes for
+        throughput). `ROTA_ADAPTIVE_BATCHING=0` keeps the budget at `size`.
+        """
+        if os.environ.get("ROTA_ADAPTIVE_BATCHING", "1") == "0":
+            return cls(size, size, size)
+        defaults = cls()
+        target = float(os.environ.get("ROTA_BATCH_TARGET_LATENCY", 0))
+        return cls(
+            size,
+            int(os.environ.get("ROTA_BATCH_MIN_TOKENS", defaults.min_size)),
+            int(os.environ.get("ROTA_BATCH_MAX_TOKENS", defaults.max_size)),
+            target or None,
+        )
+
+    def _clamp(self, size: float) -> int:
+        return int(min(max(size, self.min_size), self.max_size))
+
+    def record(self, rows: int, tokens: int, seconds: float) -> int:
+        """Take the time of the batch just run and pick the next budget
+
+        Args:
+            rows (int): Texts in the batch
+            tokens (int): Their tokens, without padding
+            seconds (float): Time the model took
+
+        Returns:
+            int: The budget of the next batch
+        """
+        with self.lock:
+            return self._add(BatchRecord(self.size, rows, tokens, seconds))
+
+    def add(self, record: BatchRecord) -> int:
+        """`record` for a batch already made into a `BatchRecord`
+
+        The measure goes to `record.size`, the budget the batch was formed
+        with, which is not the current budget when other jobs sharing the
+        controller recorded batches in the meantime.
+        """
+        with self.lock:
+            return self._add(record)
+
+    def _add(self, record: BatchRecord) -> int:
+        self.history.append(record)
+        seconds = record.seconds
+        if self.target_latency is not None:
+            ratio = self.target_latency / seconds if seconds else self.factor
+            ratio = min(max(ratio, 1 / self.factor), self.factor)
+            self.size = self._clamp(record.size * ratio)
+            return self.size
+
+        previous = self.throughput.get(record.size)
+        if previous is None:
+            self.throughput[record.size] = record.tokens_per_second
+        else:
+            self.throughput[record.size] = (
+                1 - self.smoothing
+            ) * previous + self.smoothing * record.tokens_per_second
+        best = max(self.throughput, key=self.throughput.get)
+        if best != record.size:
+            # Moving this way did not help, go back and try the other way
+            self.direction = 1 if best > record.size else -1
+            self.size = self._clamp(best)
+            return self.size
+        size = self._clamp(record.size * self.factor**self.direction)
+        if size == record.size:
+            self.direction = -self.direction
+            size = self._clamp(record.size * self.factor**self.direction)
+        self.size = size
+        return self.size
+
+    def report(self) -> pd.DataFrame:
+        """`batch_report` of the last `HISTORY_SIZE` batches"""
+        with self.lock:
+            history = list(self.history)
+        return batch_report(history)
+
+
+def batch_report(records: Iterable[BatchRecord]) -> pd.DataFrame:
+    """The budgets used: "size", "batches", "rows", "tokens", "seconds",
+    "tokens_per_second" and "mean_seconds" per batch, largest budget first
+    """
+    history = pd.DataFrame(
+        [(r.size, r.rows, r.tokens, r.seconds) for r in records],
+        columns=["size", "rows", "tokens", "seconds"],
+    )
+    report = history.groupby("size").agg(
+        batches=("rows", "size"),
+        rows=("rows", "sum"),
+        tokens=("tokens", "sum"),
+        seconds=("seconds", "sum"),
+    )
+    report["tokens_per_second"] = report["tokens"] / report["seconds"]
+    report["mean_seconds"] = report["seconds"] / report["batches"]
+    return report.sort_index(ascending=False).reset_index()
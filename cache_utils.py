@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable
+
+
+class LRUCache:
+    """Thread-safe in-memory cache with a bounded number of entries
+
+    When full, the least recently used entry is evicted. Unlike
+    `st.cache_data`, nothing is pickled or hashed beyond the key itself and
+    the cache works the same inside Streamlit, from the command line and in
+    worker processes (where each process has its own cache).
+
+    Anything with the same `get_or_compute` / `stats` / `clear` methods can be
+    used in its place, eg: `cleaning_utils.clean_cached(text, cache=...)`.
+
+    Args:
+        max_entries (int): Maximum number of entries kept. 0 disables the
+          cache (every lookup is a miss).
+    """
+
+    def __init__(self, max_entries: int):
+        if max_entries < 0:
+            raise ValueError("max_entries must be >= 0")
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[Hashable], Any]) -> Any:
+        """Return the cached value for `key`, computing and storing it if needed
+
+        `compute` runs outside the lock, so two threads missing on the same key
+        at once may both compute it.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        value = compute(key)
+        self.put(key, value)
+        return value
+
+    def clear(self):
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        """Size of the cache and how well it is doing
+
+        Returns:
+            Dict[str, float]: entries, max_entries, hits, misses, evictions and
+              hit_rate (hits / lookups, 0 before the first lookup)
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,13 +1,54 @@
+import hashlib
+import inspect
+import operator
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import cached_property, lru_cache, reduce
+from itertools import groupby
+from pathlib import Path
 from string import punctuation
+from time import perf_counter
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
 import pandas as pd
+from numpy import array, empty
+
+from cache_utils import LRUCache
+from profiling_utils import RuleProfiler
+from rule_analysis import (
+    RuleProfile,
+    ascii_safe,
+    literal_words,
+    lowercase_pattern,
+    plan_passes,
+    profile_rule,
+)
+from rule_pack import (
+    PlanCache,
+    content_hash,
+    default_plan_cache,
+    flag_names,
+    flag_value,
+    read_pack,
+    write_pack,
+)
 
 all_punctuation = punctuation + "‘’·—»"
 # keep in dollar signs
 all_punctuation = all_punctuation.replace("$", "")
 
 
+# splits text into words (odd positions) and what is between them (even ones)
+_TOKENS = re.compile(r"(\w+)")
+
+# Joins texts in `CleanerEngine.clean_batch`. The "\x00" on either side are
+# non-word characters, so `\b` behaves at the edge of each text as it does at
+# the start / end of a string, and the "_" word stops `\W+` from reaching the
+# next text.
+BATCH_SENTINEL = "\x00_\x00"
+
 # "regex separator"
 # captures the following: 1+ spaces OR 1+ non-word characters (ex: "/", "-"),
 # OR 1 word boundary
@@ -20,9 +61,12 @@ sep = r"(?: +|\W+|\b)"
 class RegexRemoval:
     description: str
     regex_str: str  # usually raw string: r"your string"
+    flags: int = re.IGNORECASE
 
-    def __post_init__(self):
-        self.regex = re.compile(self.regex_str, re.IGNORECASE)
+    @cached_property
+    def regex(self) -> re.Pattern:
+        # Compiled on first use, so importing the ruleset stays cheap
+        return re.compile(self.regex_str, self.flags)
 
 
 @dataclass
@@ -31,9 +75,12 @@ class RegexSubstitution:
     regex_str: str  # usually raw string: r"your string"
     replacement: str
     priority: int = 10  # higher values → run later (eg: 1 runs before 20)
+    flags: int = re.IGNORECASE
 
-    def __post_init__(self):
-        self.regex = re.compile(self.regex_str, re.IGNORECASE)
+    @cached_property
+    def regex(self) -> re.Pattern:
+        # Compiled on first use, so importing the ruleset stays cheap
+        return re.compile(self.regex_str, self.flags)
 
 
 removals = [
@@ -387,7 +434,10 @@ substitutions = [
     ),
     RegexSubstitution(
         "distance within 300",
-        rf"{sep}dist{sep}w{sep}i{sep}300\b",
+        # `(?<!\W)`: only try the leading `sep` where a run of separators
+        # starts, otherwise long runs of punctuation take quadratic time.
+        # It matches the same, re.sub always finds the start of the run.
+        rf"(?<!\W){sep}dist{sep}w{sep}i{sep}300\b",
         "distance within 300",
         priority=5,
     ),
@@ -2654,15 +2704,7 @@ def prep_text(text):
     return text
 
 
-def cleaner(text):
-    if pd.isnull(text):
-        return ""
-    # Prepare text for regex substitions
-    text = prep_text(text)
-    # Do all substitutions (Case insensitive on raw text)
-    substitutions_sorted = sorted(substitutions, key=lambda s: s.priority)
-    for substitution in substitutions_sorted:
-        text = re.sub(substitution.regex, substitution.replacement, text)
+def finish_text(text):
     # Remove any terms we don't want
     for removal in removals:
         text = re.sub(removal.regex, " ", text)
@@ -2672,3 +2714,960 @@ def cleaner(text):
     text = " ".join(text.split())  # removes extra spaces: "  " → " "
     text = text.lower()
     return text
+
+
+def cleaner(text, profiler: Optional[RuleProfiler] = None):
+    if pd.isnull(text):
+        return ""
+    if profiler is not None:
+        return _profiled_cleaner(text, profiler)
+    # Prepare text for regex substitions
+    text = prep_text(text)
+    # Do all substitutions (Case insensitive on raw text)
+    substitutions_sorted = sorted(substitutions, key=lambda s: s.priority)
+    for substitution in substitutions_sorted:
+        text = re.sub(substitution.regex, substitution.replacement, text)
+    return finish_text(text)
+
+
+def _timed_sub(profiler: RuleProfiler, rule, stage: str, replacement, text: str):
+    start = profiler.clock()
+    result = re.sub(rule.regex, replacement, text)
+    profiler.record(rule, stage, profiler.clock() - start, result != text)
+    return result
+
+
+def _profiled_cleaner(text, profiler: RuleProfiler):
+    """`cleaner`, timing each substitution and removal"""
+    profiler.texts += 1
+    text = prep_text(text)
+    substitutions_sorted = sorted(substitutions, key=lambda s: s.priority)
+    for substitution in substitutions_sorted:
+        text = _timed_sub(
+            profiler, substitution, "substitution", substitution.replacement, text
+        )
+    for removal in removals:
+        text = _timed_sub(profiler, removal, "removal", " ", text)
+    return punctuation_stage(text)
+
+
+def profile_cleaning(texts: Iterable[Any], path: Optional[str] = None) -> RuleProfiler:
+    """Clean texts with `cleaner` while profiling every rule
+
+    Every rule gets a row in the report, so rules that never change any of
+    the texts show up too.
+
+    Args:
+        texts (Iterable[Any]): Texts to clean, eg: a bulk upload column
+        path (str, optional): If given, the report is also written there,
+          as CSV or JSON depending on the suffix
+
+    Returns:
+        RuleProfiler: The profiler, see `RuleProfiler.report`
+    """
+    profiler = RuleProfiler()
+    profiler.register(sorted(substitutions, key=lambda s: s.priority), "substitution")
+    profiler.register(removals, "removal")
+    for text in texts:
+        cleaner(text, profiler)
+    if path is not None:
+        profiler.dump(path)
+    return profiler
+
+
+class PrepStage:
+    """Precompiled `prep_text`
+
+    The patterns are compiled once, the regexes only run when the character
+    they need is in the text, and hyphens / forward-slashes are replaced with
+    a single `str.translate`.
+    """
+
+    def __init__(self):
+        self.number_commas = re.compile(r"(\d+?),(\d+?)")
+        self.possessive = re.compile(r"\b(\S+?)'(s)")
+        self.separators = str.maketrans({"-": " ", "/": " "})
+
+    def __call__(self, text: str) -> str:
+        if "," in text:
+            text = self.number_commas.sub(r"\1\2", text)
+        if "'" in text:
+            text = self.possessive.sub(r"\1\2", text)
+        return text.translate(self.separators)
+
+
+class RemovalStage:
+    """The removals part of `finish_text`
+
+    All removals are combined into one pattern that is searched first. Only
+    texts where some removal matches (rare in practice) go through the
+    removals one by one, since a removal can create or break a match for the
+    ones after it.
+
+    Args:
+        rules (List[RegexRemoval]): The removals, in the order they run
+    """
+
+    def __init__(self, rules: List[RegexRemoval]):
+        self.rules = rules
+        self.combined = re.compile(
+            "|".join(f"(?:{rule.regex_str})" for rule in rules), re.IGNORECASE
+        )
+
+    def __call__(self, text: str) -> str:
+        if not self.rules or self.combined.search(text) is None:
+            return text
+        for removal in self.rules:
+            text = removal.regex.sub(" ", text)
+        return text
+
+
+class PunctuationStage:
+    """The rest of `finish_text`: punctuation becomes spaces with a single
+    `str.translate`, then whitespace is collapsed and the text lowercased
+
+    Args:
+        characters (str): The punctuation to remove
+    """
+
+    def __init__(self, characters: str):
+        self.table = str.maketrans(dict.fromkeys(characters, " "))
+
+    def __call__(self, text: str) -> str:
+        return " ".join(text.translate(self.table).split()).lower()
+
+
+prep_stage = PrepStage()
+removal_stage = RemovalStage(removals)
+punctuation_stage = PunctuationStage(all_punctuation)
+
+
+class SubstitutionPass:
+    """One regex pass applying one or more substitutions
+
+    Several rules are combined into a single alternation, each wrapped in its
+    own group, and the replacement is looked up from the group that matched.
+    Only rules that `rule_analysis.plan_passes` puts together should share a
+    pass, otherwise the result differs from applying them one after the
+    other.
+
+    Args:
+        rules (List[RegexSubstitution]): The substitutions, in the order they
+          would run in `cleaner`
+        vocabulary (FrozenSet[str], optional): Every word the rules can match,
+          used to skip positions where no rule can start. Only valid for word
+          aligned rules (see `rule_analysis.word_vocabulary`).
+        triggers (FrozenSet[str], optional): Lowercase literals of which one
+          must be in the text for any of the rules to match (see
+          `rule_analysis.required_literals`). Defaults to None, meaning the
+          pass always runs.
+        batch_safe (bool, optional): Whether no match can reach into
+          `BATCH_SENTINEL`, so that the pass can run over many texts joined
+          together. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        rules: List[RegexSubstitution],
+        vocabulary: Optional[FrozenSet[str]] = None,
+        triggers: Optional[FrozenSet[str]] = None,
+        batch_safe: bool = False,
+    ):
+        self.rules = rules
+        self.triggers = tuple(sorted(triggers)) if triggers else None
+        self.batch_safe = batch_safe
+        if len(rules) == 1:
+            self.pattern = rules[0].regex_str
+            self.replacement = rules[0].replacement
+            return
+        pattern = "|".join(f"({rule.regex_str})" for rule in rules)
+        if vocabulary:
+            # Checking the boundary once up front is much cheaper than letting
+            # every alternative fail on its own `\b`
+            first_chars = re.escape("".join(sorted({w[0] for w in vocabulary})))
+            pattern = rf"\b(?=[{first_chars}])(?:{pattern})"
+        self.pattern = pattern
+        self.replacement = self._dispatch
+
+    @cached_property
+    def regex(self) -> re.Pattern:
+        """The pass compiled on first use, since most passes rarely run"""
+        if len(self.rules) == 1:
+            return self.rules[0].regex
+        # Only keep the flags every rule was compiled with
+        flags = reduce(operator.and_, (rule.flags for rule in self.rules))
+        return re.compile(self.pattern, flags)
+
+    @cached_property
+    def dispatch(self) -> Dict[int, str]:
+        """Replacement for the group number of each rule's wrapper"""
+        # Rules may have groups of their own
+        dispatch = {}
+        group = 1
+        for rule in self.rules:
+            dispatch[group] = rule.replacement
+            group += 1 + rule.regex.groups
+        return dispatch
+
+    def _dispatch(self, match):
+        return self.dispatch[match.lastindex]
+
+    def applies(self, lowered: str) -> bool:
+        """Whether the pass can change a text, given the lowercased text"""
+        if self.triggers is None:
+            return True
+        for trigger in self.triggers:
+            if trigger in lowered:
+                return True
+        return False
+
+    def __call__(self, text: str) -> str:
+        return self.regex.sub(self.replacement, text)
+
+    def __repr__(self):
+        descriptions = ", ".join(rule.description for rule in self.rules)
+        return f"{type(self).__name__}({descriptions})"
+
+
+class TokenPass(SubstitutionPass):
+    """A pass made only of pure word alternations (eg: `\\b(?:cntrl|cntrld)\\b`)
+
+    Instead of scanning the text with a regex, the text is split into words
+    once and each word is looked up in a dictionary of replacements. Text
+    that is not ASCII goes through the combined regex instead, since
+    case-insensitive matching has extra equivalences there (eg: "ſ" ~ "s").
+
+    Args:
+        rules (List[RegexSubstitution]): The substitutions, in the order they
+          would run in `cleaner`
+        words (List[FrozenSet[str]]): `rule_analysis.literal_words` of each rule
+        triggers (FrozenSet[str], optional): See `SubstitutionPass`
+        batch_safe (bool, optional): See `SubstitutionPass`
+    """
+
+    def __init__(
+        self,
+        rules: List[RegexSubstitution],
+        words: List[FrozenSet[str]],
+        triggers: Optional[FrozenSet[str]] = None,
+        batch_safe: bool = False,
+    ):
+        super().__init__(rules, frozenset().union(*words), triggers, batch_safe)
+        self.table = {
+            word: rule.replacement
+            for rule, rule_words in zip(rules, words)
+            for word in rule_words
+        }
+
+    def __call__(self, text: str) -> str:
+        if not text.isascii():
+            return super().__call__(text)
+        tokens = _TOKENS.split(text)
+        changed = False
+        # Odd positions hold the words, even ones whatever is between them
+        for i in range(1, len(tokens), 2):
+            replacement = self.table.get(tokens[i].lower())
+            if replacement is not None:
+                tokens[i] = replacement
+                changed = True
+        return "".join(tokens) if changed else text
+
+
+def _batch_safe(profile: RuleProfile, rule: RegexSubstitution) -> bool:
+    # Word aligned rules only match whole words from their vocabulary, so
+    # they can neither touch the "\x00" around the sentinel nor reach across
+    # the "_" word in its middle
+    return (
+        profile.word_aligned
+        and "_" not in profile.vocabulary
+        and "\x00" not in rule.replacement
+    )
+
+
+def _lowercase_rule(
+    rule: RegexSubstitution, flags: Optional[int] = None
+) -> RegexSubstitution:
+    """Case-sensitive copy of a rule, for text that is lowercased up front
+
+    `flags` skips working out the flags of the copy, eg: when they come from
+    a cached plan.
+    """
+    if not rule.replacement.isascii():
+        raise ValueError(
+            f"Rule {rule.description!r} has a non-ASCII replacement,"
+            " it can not be used in lowercase mode"
+        )
+    if not rule.regex_str.isascii():
+        # `re.IGNORECASE` matches the same on lowercased ASCII text
+        regex_str, flags = rule.regex_str, rule.flags
+    else:
+        regex_str = lowercase_pattern(rule.regex_str)
+        if flags is None:
+            flags = re.ASCII if ascii_safe(regex_str) else 0
+    return RegexSubstitution(
+        rule.description, regex_str, rule.replacement.lower(), rule.priority, flags
+    )
+
+
+def _plan_rules(rules: List[RegexSubstitution]) -> List[Dict[str, Any]]:
+    """Plan sorted substitutions into passes, see `CleanerEngine`
+
+    Plans are cached on disk under a key that includes `_planner_digest`, a
+    hash of this function's source and of `rule_analysis`. Bump
+    `rule_pack.PLAN_VERSION` when planning changes outside of them, eg: the
+    plan format read by `_passes_from_plan`.
+
+    Returns:
+        List[Dict[str, Any]]: For each pass, the positions of its "rules" in
+          `rules`, its "triggers", whether it is "batch_safe", the literal
+          "words" of each rule for a `TokenPass`, and the "vocabulary" of a
+          combined `SubstitutionPass`. Only JSON types, so that the plan can
+          go in a `rule_pack.PlanCache`.
+    """
+    plan = []
+    start = 0
+    for _, tier in groupby(rules, key=lambda s: s.priority):
+        tier = list(tier)
+        profiles = [profile_rule(s.regex_str, s.replacement) for s in tier]
+        for group in plan_passes(profiles):
+            entry = {
+                "rules": [start + i for i in group],
+                "triggers": None,
+                "batch_safe": all(_batch_safe(profiles[i], tier[i]) for i in group),
+                "words": None,
+                "vocabulary": None,
+            }
+            if all(profiles[i].required for i in group):
+                triggers = frozenset().union(*(profiles[i].required for i in group))
+                entry["triggers"] = sorted(triggers)
+            if profiles[group[0]].literal:
+                entry["words"] = [
+                    sorted(literal_words(tier[i].regex_str)) for i in group
+                ]
+            elif len(group) > 1:
+                vocabulary = frozenset().union(*(profiles[i].vocabulary for i in group))
+                entry["vocabulary"] = sorted(vocabulary)
+            plan.append(entry)
+        start += len(tier)
+    return plan
+
+
+def _rule_record(rule) -> Dict[str, Any]:
+    """A `RegexSubstitution` or `RegexRemoval` as rule pack record"""
+    record = {"description": rule.description, "pattern": rule.regex_str}
+    if isinstance(rule, RegexSubstitution):
+        record["replacement"] = rule.replacement
+        record["priority"] = rule.priority
+    record["flags"] = flag_names(rule.flags)
+    return record
+
+
+@lru_cache(maxsize=None)
+def _planner_digest() -> str:
+    """Hash of the code that plans passes, part of the key of cached plans
+
+    Covers `rule_analysis` and the planning functions of this module, so
+    that changing them does not reuse plans made by the old code even if
+    `rule_pack.PLAN_VERSION` was not bumped. Empty if the source can not be
+    read (eg: a build without .py files), leaving only `PLAN_VERSION`.
+    """
+    import rule_analysis
+
+    try:
+        sources = [
+            inspect.getsource(code)
+            for code in (rule_analysis, _plan_rules, _batch_safe, _lowercase_rule)
+        ]
+    except (OSError, TypeError):
+        return ""
+    return hashlib.sha256("".join(sources).encode("utf-8")).hexdigest()[:16]
+
+
+def _build_passes(
+    rules: List[RegexSubstitution],
+    plan_cache: Optional[PlanCache] = None,
+    lowercase: bool = False,
+) -> List[SubstitutionPass]:
+    """Passes for sorted substitutions, reusing a cached plan if there is one
+
+    In lowercase mode, the passes are made of the `_lowercase_rule` copies
+    of the rules, whose flags are cached along with the plan. A cached plan
+    that does not fit the rules (eg: not written by `_plan_rules`) is
+    ignored and planned again.
+    """
+    key = None
+    if plan_cache is not None:
+        key = content_hash([_rule_record(rule) for rule in rules])
+        digest = _planner_digest()
+        key += f"-{digest}" if digest else ""
+        key += "-lowercase" if lowercase else ""
+        plan = plan_cache.get(key)
+        if plan is not None:
+            try:
+                return _passes_from_plan(rules, plan, lowercase)
+            except (AttributeError, KeyError, IndexError, TypeError, ValueError):
+                pass
+    if lowercase:
+        rules = [_lowercase_rule(rule) for rule in rules]
+    plan = {
+        "flags": [rule.flags for rule in rules] if lowercase else None,
+        "passes": _plan_rules(rules),
+    }
+    if key is not None:
+        plan_cache.put(key, plan)
+    return _passes_from_plan(rules, plan)
+
+
+def _passes_from_plan(
+    rules: List[RegexSubstitution], plan: Dict[str, Any], lowercase: bool = False
+) -> List[SubstitutionPass]:
+    """The passes of a plan from `_build_passes`
+
+    With `lowercase`, `rules` are the original rules and get lowercased with
+    the plan's flags.
+
+    Raises:
+        ValueError: If the plan does not cover each rule exactly once
+    """
+    if lowercase:
+        if len(plan["flags"]) != len(rules):
+            raise ValueError("The plan has flags for other rules")
+        rules = [
+            _lowercase_rule(r, int(flags)) for r, flags in zip(rules, plan["flags"])
+        ]
+    passes = []
+    planned = []
+    for entry in plan["passes"]:
+        planned.extend(entry["rules"])
+        group_rules = [rules[i] for i in entry["rules"]]
+        triggers = entry["triggers"] and frozenset(entry["triggers"])
+        batch_safe = bool(entry["batch_safe"])
+        if entry["words"] is not None:
+            words = [frozenset(rule_words) for rule_words in entry["words"]]
+            if len(words) != len(group_rules):
+                raise ValueError("The plan has words for other rules")
+            passes.append(TokenPass(group_rules, words, triggers, batch_safe))
+        else:
+            vocabulary = entry["vocabulary"] and frozenset(entry["vocabulary"])
+            passes.append(
+                SubstitutionPass(group_rules, vocabulary, triggers, batch_safe)
+            )
+    if sorted(planned) != list(range(len(rules))):
+        raise ValueError("The plan does not cover the rules")
+    return passes
+
+
+class CleaningTimeout(Exception):
+    """Cleaning a text took longer than `CleaningGuard.time_budget`"""
+
+
+@dataclass
+class CleaningGuard:
+    """Limits that stop one pathological text from stalling a bulk job
+
+    Texts longer than `max_length` characters are cut down (at the last
+    space before the limit, if any) before cleaning. The substitutions of a
+    text are stopped once they have taken more than `time_budget` seconds,
+    in which case the text gets the `fallback` result:
+
+    - "normalize": the text without any substitutions, but still through
+      `prep_stage` and the removals / punctuation (the default)
+    - "empty": ""
+    - "raise": `CleaningTimeout` is raised
+
+    The time is checked between passes, a single regex can not be
+    interrupted. `max_length` is what bounds the time of one regex,
+    `regex_audit` looks for the rules that need it.
+
+    There is no time budget by default: whether a text runs out of time
+    depends on the load of the host, so the same text could be cleaned
+    differently from one run to the next. Set one for bulk jobs where a
+    stalled text costs more than an uncleaned one.
+    """
+
+    max_length: Optional[int] = 2000
+    time_budget: Optional[float] = None
+    fallback: str = "normalize"
+
+    def __post_init__(self):
+        if self.fallback not in ("normalize", "empty", "raise"):
+            raise ValueError(f"Unknown fallback {self.fallback!r}")
+
+    @classmethod
+    def from_env(cls) -> "CleaningGuard":
+        """The guard set with `ROTA_CLEAN_MAX_LENGTH`, `ROTA_CLEAN_TIME_BUDGET`
+        (0 disables either) and `ROTA_CLEAN_FALLBACK`
+        """
+        defaults = cls()
+        time_budget = os.environ.get("ROTA_CLEAN_TIME_BUDGET")
+        return cls(
+            int(os.environ.get("ROTA_CLEAN_MAX_LENGTH", defaults.max_length)),
+            float(time_budget) if time_budget else defaults.time_budget,
+            os.environ.get("ROTA_CLEAN_FALLBACK", defaults.fallback),
+        )
+
+
+class CleanerEngine:
+    """Precompiled version of `cleaner`
+
+    The substitutions are sorted by priority once and planned into passes
+    with `rule_analysis.plan_passes`: within a priority, substitutions that
+    can not affect each other share a single pass, pure word alternations
+    are applied with a `TokenPass` and everything else with a
+    `SubstitutionPass`. The output is identical to `cleaner`.
+
+    Each pass also gets the literals its rules require (see
+    `rule_analysis.required_literals`). Before running a pass, the engine
+    checks the lowercased text at that point for them and skips the pass if
+    none are present. `stats` reports how many rules actually ran per text.
+
+    In lowercase mode, ASCII text is lowercased right after `prep_stage` and
+    goes through a copy of the ruleset with lowercased patterns compiled
+    case-sensitively (and with `re.ASCII` where `rule_analysis.ascii_safe`).
+    Case-insensitive matching is slower in `re`, and the final text is
+    lowercased anyway. Other text uses the regular ruleset, since
+    lowercasing can change its length and Unicode case-insensitive matching
+    has extra equivalences (eg: "ſ" ~ "s").
+
+    Planning the passes is the slow part of building an engine. With a
+    `plan_cache`, plans are stored on disk under a hash of the rules, so
+    later engines for the same rules (eg: in new processes) skip it. Regexes
+    are only compiled when a pass first runs.
+
+    Args:
+        rules (List[RegexSubstitution], optional): The substitutions to apply.
+          Defaults to `substitutions`.
+        prefilter (bool, optional): Whether to skip passes whose required
+          literals are missing from the text. Defaults to True.
+        lowercase (bool, optional): Whether to use lowercase mode.
+          Defaults to False.
+        plan_cache (PlanCache, optional): Where to load / store pass plans.
+          Defaults to None (always plan).
+        removal_rules (List[RegexRemoval], optional): The removals to apply
+          after the substitutions. Defaults to `removals`.
+        guard (CleaningGuard, optional): Length and time limits per text.
+          Defaults to None (no limits).
+    """
+
+    def __init__(
+        self,
+        rules: Optional[List[RegexSubstitution]] = None,
+        prefilter: bool = True,
+        lowercase: bool = False,
+        plan_cache: Optional[PlanCache] = None,
+        removal_rules: Optional[List[RegexRemoval]] = None,
+        guard: Optional[CleaningGuard] = None,
+    ):
+        if rules is None:
+            rules = substitutions
+        self.guard = guard
+        self.removal_stage = removal_stage
+        if removal_rules is not None:
+            self.removal_stage = RemovalStage(removal_rules)
+        self.substitutions = sorted(rules, key=lambda s: s.priority)
+        self.prefilter = prefilter
+        self.lowercase = lowercase
+        self.passes = _build_passes(self.substitutions, plan_cache)
+        self.lowercase_passes = None
+        if lowercase:
+            self.lowercase_passes = _build_passes(
+                self.substitutions, plan_cache, lowercase=True
+            )
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.texts_cleaned = 0
+        self.passes_run = 0
+        self.rules_run = 0
+        self.truncated = 0
+        self.timeouts = 0
+
+    def stats(self) -> Dict[str, float]:
+        """How much work the prefilter saved since the last `reset_stats`
+
+        Returns:
+            Dict[str, float]: The number of texts cleaned, the number of rules
+              and passes there are, the average number of rules and passes
+              that actually ran per text, and how many texts the `guard`
+              truncated or gave up on.
+        """
+        texts = self.texts_cleaned or 1
+        return {
+            "texts": self.texts_cleaned,
+            "rules": len(self.substitutions),
+            "passes": len(self.passes),
+            "rules_per_text": self.rules_run / texts,
+            "passes_per_text": self.passes_run / texts,
+            "truncated": self.truncated,
+            "timeouts": self.timeouts,
+        }
+
+    def _limit(self, text: str) -> str:
+        """Cut a text down to `guard.max_length`, at a space if possible"""
+        max_length = self.guard and self.guard.max_length
+        if not max_length or len(text) <= max_length:
+            return text
+        self.truncated += 1
+        cut = text.rfind(" ", 0, max_length + 1)
+        return text[: cut if cut > 0 else max_length]
+
+    def _deadline(self, texts: int = 1) -> Optional[float]:
+        """When substituting `texts` texts starting now has to be done by"""
+        if self.guard is None or not self.guard.time_budget:
+            return None
+        return perf_counter() + self.guard.time_budget * texts
+
+    def _fallback(self, text: str) -> str:
+        """What `clean` returns for a text that ran out of time"""
+        self.timeouts += 1
+        if self.guard.fallback == "raise":
+            raise CleaningTimeout(
+                f"Cleaning took over {self.guard.time_budget}s: {text[:80]!r}"
+            )
+        if self.guard.fallback == "empty":
+            return ""
+        return self.finish(prep_stage(text))
+
+    def _run_passes(
+        self,
+        text: str,
+        passes: List[SubstitutionPass],
+        lowercased: bool = False,
+        deadline: Optional[float] = None,
+    ) -> Tuple[str, int, int]:
+        passes_run = rules_run = 0
+        # The literals are lowercase ASCII, see `rule_analysis.literal_words`
+        prefilter = self.prefilter and text.isascii()
+        lowered = text if lowercased else text.lower()
+        for substitution_pass in passes:
+            if prefilter and not substitution_pass.applies(lowered):
+                continue
+            passes_run += 1
+            rules_run += len(substitution_pass.rules)
+            substituted = substitution_pass(text)
+            if deadline is not None and perf_counter() > deadline:
+                raise CleaningTimeout(repr(substitution_pass))
+            if substituted is not text:
+                text = substituted
+                # Replacements may be non-ASCII in a custom ruleset
+                prefilter = prefilter and text.isascii()
+                lowered = text if lowercased else text.lower()
+        return text, passes_run, rules_run
+
+    def _plan(self, text: str) -> Tuple[str, List[SubstitutionPass], bool]:
+        """Pick the passes for a text, lowercasing it in lowercase mode"""
+        if self.lowercase and text.isascii():
+            return text.lower(), self.lowercase_passes, True
+        return text, self.passes, False
+
+    def substitute(self, text: str) -> str:
+        """Apply the substitutions to a text that went through `prep_stage`
+
+        In lowercase mode, the result is lowercased if the text is ASCII.
+
+        Raises:
+            CleaningTimeout: If the text takes longer than `guard.time_budget`
+        """
+        text, passes, lowercased = self._plan(text)
+        text, passes_run, rules_run = self._run_passes(
+            text, passes, lowercased, self._deadline()
+        )
+        self.texts_cleaned += 1
+        self.passes_run += passes_run
+        self.rules_run += rules_run
+        return text
+
+    def clean(self, text):
+        return self.clean_complete(text)[0]
+
+    def clean_complete(self, text) -> Tuple[str, bool]:
+        """`clean`, and whether the text was cleaned in full rather than
+        given the `guard`'s fallback result
+        """
+        if pd.isnull(text):
+            return "", True
+        text = self._limit(text)
+        try:
+            return self.finish(self.substitute(prep_stage(text))), True
+        except CleaningTimeout:
+            return self._fallback(text), False
+
+    def finish(self, text: str) -> str:
+        return punctuation_stage(self.removal_stage(text))
+
+    __call__ = clean
+
+    def clean_batch(self, texts: Iterable[Any]) -> List[str]:
+        """Clean many texts, running batch safe passes once over all of them
+
+        The texts are joined with `BATCH_SENTINEL` and every pass flagged
+        `batch_safe` runs once over the joined buffer. Other passes (and
+        the prep / finish stages) still run text by text. The results are
+        identical to calling `clean` on each text. Texts containing "\\x00"
+        can not be split back reliably and are cleaned on their own. ASCII
+        and other texts are joined separately, so that a single non-ASCII
+        text does not turn off lowercase mode and the prefilter for all.
+
+        With a `guard`, each batch gets the time budget of all its texts. If
+        it runs out, its texts are cleaned again one by one with `clean`.
+
+        Note: `stats` only counts calls to `clean`.
+
+        Args:
+            texts (Iterable[Any]): Texts to clean, NaN / None are allowed
+
+        Returns:
+            List[str]: The cleaned texts, in the same order
+        """
+        results = []
+        # Positions, raw texts and prepared texts of each batch, by whether
+        # the prepared texts are ASCII
+        batches = {True: ([], [], []), False: ([], [], [])}
+        for text in texts:
+            if pd.isnull(text):
+                results.append("")
+                continue
+            text = self._limit(text)
+            prepped = prep_stage(text)
+            if "\x00" in prepped:
+                results.append(self.clean(text))
+                continue
+            batch = batches[prepped.isascii()]
+            batch[0].append(len(results))
+            batch[1].append(text)
+            batch[2].append(prepped)
+            results.append(None)
+
+        for positions, originals, prepared in batches.values():
+            if not prepared:
+                continue
+            pieces = self._substitute_joined(prepared)
+            for j, i in enumerate(positions):
+                if pieces is None:
+                    results[i] = self.clean(originals[j])
+                else:
+                    results[i] = self.finish(pieces[j])
+        return results
+
+    def _substitute_joined(self, prepared: List[str]) -> Optional[List[str]]:
+        """`substitute` for texts that are all ASCII or all not, None if the
+        guard's time budget runs out
+        """
+        # The sentinel is ASCII, so the joined text is only ASCII if every
+        # text is, in which case lowercase mode applies to all of them
+        joined, passes, lowercased = self._plan(BATCH_SENTINEL.join(prepared))
+        pieces = joined.split(BATCH_SENTINEL)
+        deadline = self._deadline(len(pieces))
+        try:
+            for batch_safe, segment in groupby(passes, lambda p: p.batch_safe):
+                segment = list(segment)
+                if batch_safe:
+                    joined = BATCH_SENTINEL.join(pieces)
+                    joined, _, _ = self._run_passes(
+                        joined, segment, lowercased, deadline
+                    )
+                    pieces = joined.split(BATCH_SENTINEL)
+                else:
+                    pieces = [
+                        self._run_passes(piece, segment, lowercased, deadline)[0]
+                        for piece in pieces
+                    ]
+        except CleaningTimeout:
+            return None
+        return pieces
+
+
+def dump_rules(
+    path: Union[str, Path],
+    rules: Optional[List[RegexSubstitution]] = None,
+    removal_rules: Optional[List[RegexRemoval]] = None,
+) -> Path:
+    """Write a ruleset to a JSON rule pack (see `rule_pack.write_pack`)
+
+    Args:
+        path (Union[str, Path]): The file to write
+        rules (List[RegexSubstitution], optional): Defaults to `substitutions`
+        removal_rules (List[RegexRemoval], optional): Defaults to `removals`
+
+    Returns:
+        Path: The file written
+    """
+    rules = substitutions if rules is None else rules
+    removal_rules = removals if removal_rules is None else removal_rules
+    return write_pack(
+        path,
+        [_rule_record(rule) for rule in rules],
+        [_rule_record(rule) for rule in removal_rules],
+    )
+
+
+def load_rules(
+    path: Union[str, Path]
+) -> Tuple[List[RegexSubstitution], List[RegexRemoval]]:
+    """Read a ruleset written by `dump_rules`
+
+    Returns:
+        Tuple[List[RegexSubstitution], List[RegexRemoval]]: The substitutions
+          and removals. Their regexes are compiled on first use.
+    """
+    pack = read_pack(path)
+    rules = [
+        RegexSubstitution(
+            record["description"],
+            record["pattern"],
+            record["replacement"],
+            record["priority"],
+            flag_value(record["flags"]),
+        )
+        for record in pack["substitutions"]
+    ]
+    removal_rules = [
+        RegexRemoval(
+            record["description"], record["pattern"], flag_value(record["flags"])
+        )
+        for record in pack["removals"]
+    ]
+    return rules, removal_rules
+
+
+@lru_cache(maxsize=None)
+def default_engine() -> CleanerEngine:
+    """The `CleanerEngine` for the default ruleset, built on first use
+
+    The rules come from the rule pack at `ROTA_RULE_PACK` if that is set
+    (see `dump_rules`), otherwise from this module. Pass plans are cached in
+    `rule_pack.default_plan_cache()`. Texts are cleaned with
+    `CleaningGuard.from_env()`.
+    """
+    rules = removal_rules = None
+    if os.environ.get("ROTA_RULE_PACK"):
+        rules, removal_rules = load_rules(os.environ["ROTA_RULE_PACK"])
+    return CleanerEngine(
+        rules,
+        lowercase=True,
+        plan_cache=default_plan_cache(),
+        removal_rules=removal_rules,
+        guard=CleaningGuard.from_env(),
+    )
+
+
+# Maximum number of cleaned texts kept by `clean_cached`
+CLEAN_CACHE_SIZE = int(os.environ.get("ROTA_CLEAN_CACHE_SIZE", "100000"))
+clean_cache = LRUCache(CLEAN_CACHE_SIZE)
+
+
+class _Uncached(Exception):
+    """Carries a result that `clean_cached` returns without caching it"""
+
+    def __init__(self, cleaned: str):
+        super().__init__(cleaned)
+        self.cleaned = cleaned
+
+
+def _clean_for_cache(text: str) -> str:
+    cleaned, complete = default_engine().clean_complete(text)
+    if not complete:
+        raise _Uncached(cleaned)
+    return cleaned
+
+
+def clean_cached(text, cache: Optional[LRUCache] = None) -> str:
+    """`cleaner`, remembering results in a bounded LRU cache
+
+    Texts that ran out of the guard's time budget are not cached, so that a
+    busy moment does not leave them uncleaned for the life of the process.
+
+    Args:
+        text: The text to clean, NaN / None give "" and are not cached
+        cache (LRUCache, optional): The cache to use. Defaults to
+          `clean_cache`, whose size is set with the `ROTA_CLEAN_CACHE_SIZE`
+          environment variable.
+
+    Returns:
+        str: The cleaned text
+    """
+    if pd.isnull(text):
+        return ""
+    if cache is None:
+        cache = clean_cache
+    try:
+        return cache.get_or_compute(text, _clean_for_cache)
+    except _Uncached as uncached:
+        return uncached.cleaned
+
+
+def clean_batch(texts: Iterable[Any]) -> List[str]:
+    """`cleaner` for many texts at once, see `CleanerEngine.clean_batch`"""
+    return default_engine().clean_batch(texts)
+
+
+def clean_parallel(
+    texts: Iterable[Any], workers: Optional[int] = None, chunksize: int = 1000
+) -> List[str]:
+    """`cleaner` for many texts at once, spread over a pool of processes
+
+    `re` holds the GIL, so cleaning only uses one core per process. The texts
+    are cut into chunks that worker processes clean with `clean_batch`; each
+    worker builds `default_engine()` once when it starts. Inputs that fit in
+    a single chunk (or `workers=1`) are cleaned in this process instead,
+    since starting the pool would cost more than it saves.
+
+    Args:
+        texts (Iterable[Any]): Texts to clean, NaN / None are allowed
+        workers (int, optional): Number of processes. Defaults to the number
+          of CPUs.
+        chunksize (int, optional): Number of texts sent to a worker at a
+          time. Defaults to 1000.
+
+    Returns:
+        List[str]: The cleaned texts, in the same order
+    """
+    texts = list(texts)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = [texts[i : i + chunksize] for i in range(0, len(texts), chunksize)]
+    if workers <= 1 or len(chunks) <= 1:
+        return clean_batch(texts)
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)), initializer=default_engine
+    ) as pool:
+        # `map` yields in submission order, whichever worker finishes first
+        for cleaned in pool.map(clean_batch, chunks):
+            results.extend(cleaned)
+    return results
+
+
+def clean_series(
+    series: pd.Series, engine: Optional[CleanerEngine] = None
+) -> pd.Series:
+    """`cleaner` for a whole column
+
+    The column is factorized so that every distinct value is cleaned only
+    once (with `CleanerEngine.clean_batch`), and the results are mapped back
+    to the rows through the integer codes. Missing values become "" like
+    they do in `cleaner`. Texts containing "\\x00" are cleaned row by row.
+
+    Args:
+        series (pd.Series): The texts to clean
+        engine (CleanerEngine, optional): Defaults to `default_engine()`
+
+    Returns:
+        pd.Series: The cleaned texts, with the index and name of `series`
+    """
+    if engine is None:
+        engine = default_engine()
+    # pandas hashes strings as C strings, so values that only differ after a
+    # "\x00" would share a code: those rows are kept out of `factorize`
+    nul = None
+    if pd.api.types.is_string_dtype(series):
+        nul = series.str.contains("\x00", regex=False, na=False).to_numpy(bool)
+    if nul is None or not nul.any():
+        codes, uniques = pd.factorize(series)
+        # Missing values get the code -1, which picks the trailing ""
+        cleaned = array(engine.clean_batch(uniques) + [""], dtype=object)[codes]
+        return pd.Series(cleaned, index=series.index, name=series.name)
+    cleaned = empty(len(series), dtype=object)
+    cleaned[~nul] = clean_series(series[~nul], engine).to_numpy(object)
+    cleaned[nul] = engine.clean_batch(series[nul])
+    return pd.Series(cleaned, index=series.index, name=series.name)
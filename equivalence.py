@@ -0,0 +1,297 @@
+import random
+import sys
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from cleaning_utils import (
+    CleanerEngine,
+    RegexSubstitution,
+    clean_batch,
+    clean_series,
+    cleaner,
+    default_engine,
+    finish_text,
+    prep_text,
+    substitutions,
+)
+from rule_analysis import word_vocabulary
+from synthetic_corpus import synthetic_corpus
+
+# Takes a list of texts and returns them cleaned, in the same order
+BatchCleaner = Callable[[List[Any]], List[str]]
+# Builds a per-text cleaner from a list of substitutions
+EngineFactory = Callable[[List[RegexSubstitution]], Callable[[Any], str]]
+
+SEPARATORS = [" ", "  ", "/", "-", ".", ", ", "&", "", " - ", "'S "]
+# Words the rules handle through their patterns rather than as literals
+EXTRA_WORDS = ["w/o", "w/i", "&lt;", "a&b", "B & E", "1,000", "<"]
+# Characters that are not in the ruleset but show up in dirty data
+NOISE = ["ſ", "é", "İ", " ", "\t", "#", "(", ")", "$", ";", "'", "0", "\x00"]
+
+
+def generated_corpus(size: int, seed: int = 0) -> List[str]:
+    """Random texts made of words from the ruleset and separators
+
+    Args:
+        size (int): Number of texts
+        seed (int, optional): Defaults to 0.
+
+    Returns:
+        List[str]: The texts
+    """
+    rng = random.Random(seed)
+    words = set()
+    for rule in substitutions:
+        words |= word_vocabulary(rule.regex_str) or set()
+        words |= set(rule.replacement.split())
+    words = sorted(words) + EXTRA_WORDS
+    texts = []
+    for _ in range(size):
+        text = ""
+        for _ in range(rng.randint(1, 8)):
+            word = rng.choice(words)
+            if rng.random() < 0.3:
+                word = word.upper()
+            text += word + rng.choice(SEPARATORS)
+        texts.append(text)
+    return texts
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    """A random edit of a text: case, separators, noise, joins, cuts"""
+    if not text:
+        return rng.choice(NOISE)
+    i = rng.randrange(len(text) + 1)
+    kind = rng.randrange(6)
+    if kind == 0:
+        return text.swapcase() if rng.random() < 0.5 else text.upper()
+    if kind == 1:
+        return text[:i] + rng.choice(SEPARATORS) + text[i:]
+    if kind == 2:
+        return text[:i] + rng.choice(NOISE) + text[i:]
+    if kind == 3:
+        return text.replace(" ", "", 1) if " " in text else text + text
+    if kind == 4:
+        return text[:i] + text[i + 1 :]
+    return text[i:] + " " + text[:i]
+
+
+def mutated_corpus(
+    texts: Sequence[str], size: int, seed: int = 0, edits: int = 3
+) -> List[str]:
+    """`size` texts made by applying up to `edits` random `mutate`s to texts"""
+    rng = random.Random(seed)
+    texts = [text for text in texts if isinstance(text, str)]
+    mutated = []
+    for _ in range(size):
+        text = rng.choice(texts)
+        for _ in range(rng.randint(1, edits)):
+            text = mutate(text, rng)
+        mutated.append(text)
+    return mutated
+
+
+@dataclass
+class Divergence:
+    """A text an engine cleans differently from `cleaner`
+
+    Attributes:
+        text: The raw text
+        expected (str): What `cleaner` gives
+        actual (str): What the engine gives
+        rule (str, optional): Description of the first rule that, added to
+          the engine, makes it diverge (see `responsible_rule`). None if it
+          was not looked for or not found.
+    """
+
+    text: Any
+    expected: str
+    actual: str
+    rule: Optional[str] = None
+
+
+@dataclass
+class EngineReport:
+    """How an engine compares with `cleaner` on a corpus"""
+
+    name: str
+    texts: int
+    seconds: float
+    divergences: List[Divergence] = field(default_factory=list)
+    diverging: int = 0
+
+    @property
+    def texts_per_second(self) -> float:
+        return self.texts / self.seconds if self.seconds else float("inf")
+
+    @property
+    def equivalent(self) -> bool:
+        return self.diverging == 0
+
+
+def responsible_rule(
+    text: str,
+    factory: EngineFactory,
+    rules: Optional[List[RegexSubstitution]] = None,
+) -> Optional[str]:
+    """Find the rule that makes an engine diverge from `cleaner` on a text
+
+    Engines are built from growing prefixes of the sorted rules and compared
+    with `cleaner` stopped after the same rules, bisecting for the shortest
+    prefix that diverges. This assumes that once an engine diverges, adding
+    rules does not make it agree again, which holds unless a later rule
+    happens to undo the difference.
+
+    Args:
+        text (str): A text the engine built from all `rules` cleans wrong
+        factory (EngineFactory): Builds the engine from a list of rules
+        rules (List[RegexSubstitution], optional): Defaults to `substitutions`
+
+    Returns:
+        str, optional: The rule's description, "prep / finish" if the engine
+          diverges without any rule, or None if the engine from `factory`
+          does not diverge on the text alone (eg: the divergence depends on
+          the other texts of a batch)
+    """
+    rules = sorted(substitutions if rules is None else rules, key=lambda s: s.priority)
+    states = [prep_text(text)]
+    for rule in rules:
+        states.append(rule.regex.sub(rule.replacement, states[-1]))
+
+    def diverges(k: int) -> bool:
+        return factory(rules[:k])(text) != finish_text(states[k])
+
+    if not diverges(len(rules)):
+        return None
+    if diverges(0):
+        return "prep / finish"
+    low, high = 0, len(rules)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if diverges(middle):
+            high = middle
+        else:
+            low = middle
+    return rules[high - 1].description
+
+
+def compare_engine(
+    name: str,
+    engine: BatchCleaner,
+    texts: List[Any],
+    expected: List[str],
+    factory: Optional[EngineFactory] = None,
+    max_divergences: int = 10,
+) -> EngineReport:
+    """Run an engine over texts and compare it with the expected output
+
+    Args:
+        name (str): Name in the report
+        engine (BatchCleaner): Cleans a list of texts
+        texts (List[Any]): The corpus
+        expected (List[str]): `cleaner` of each text
+        factory (EngineFactory, optional): Builds the engine for a list of
+          rules, to find the rule responsible for each divergence
+        max_divergences (int, optional): Number of divergences kept (and
+          attributed), in corpus order. Defaults to 10.
+
+    Returns:
+        EngineReport: The comparison
+    """
+    start = perf_counter()
+    actual = engine(texts)
+    report = EngineReport(name, len(texts), perf_counter() - start)
+    for text, want, got in zip(texts, expected, actual):
+        if got == want:
+            continue
+        report.diverging += 1
+        if len(report.divergences) < max_divergences:
+            rule = None
+            if factory is not None and isinstance(text, str):
+                rule = responsible_rule(text, factory)
+            report.divergences.append(Divergence(text, want, got, rule))
+    return report
+
+
+def default_engines() -> Dict[str, BatchCleaner]:
+    """The faster cleaning paths of `cleaning_utils`"""
+    return {
+        "CleanerEngine.clean": lambda texts: list(map(default_engine().clean, texts)),
+        "clean_batch": clean_batch,
+        "clean_series": lambda texts: clean_series(pd.Series(texts)).tolist(),
+    }
+
+
+def default_factories() -> Dict[str, EngineFactory]:
+    return {
+        name: lambda rules: CleanerEngine(rules, lowercase=True).clean
+        for name in default_engines()
+    }
+
+
+def compare_engines(
+    texts: Sequence[Any],
+    engines: Optional[Dict[str, BatchCleaner]] = None,
+    factories: Optional[Dict[str, EngineFactory]] = None,
+    max_divergences: int = 10,
+) -> pd.DataFrame:
+    """Compare engines with `cleaner` on a corpus, with their throughput
+
+    Args:
+        texts (Sequence[Any]): The corpus, eg: real texts plus
+          `generated_corpus` and `mutated_corpus`
+        engines (Dict[str, BatchCleaner], optional): The engines, by name.
+          Defaults to `default_engines()`.
+        factories (Dict[str, EngineFactory], optional): For the engines
+          whose divergences should be attributed to a rule. Defaults to
+          `default_factories()` when `engines` is not given.
+        max_divergences (int, optional): See `compare_engine`
+
+    Returns:
+        pd.DataFrame: A row for `cleaner` and each engine with "texts",
+          "seconds", "texts_per_second", "speedup", "diverging" and the
+          first divergences
+    """
+    if engines is None:
+        engines = default_engines()
+        factories = default_factories() if factories is None else factories
+    factories = factories or {}
+    texts = list(texts)
+    start = perf_counter()
+    expected = [cleaner(text) for text in texts]
+    reference = EngineReport("cleaner", len(texts), perf_counter() - start)
+    reports = [reference] + [
+        compare_engine(
+            name, engine, texts, expected, factories.get(name), max_divergences
+        )
+        for name, engine in engines.items()
+    ]
+    return pd.DataFrame(
+        {
+            "engine": report.name,
+            "texts": report.texts,
+            "seconds": report.seconds,
+            "texts_per_second": report.texts_per_second,
+            "speedup": reference.seconds / report.seconds if report.seconds else None,
+            "diverging": report.diverging,
+            "divergences": report.divergences,
+        }
+        for report in reports
+    )
+
+
+if __name__ == "__main__":
+    # python equivalence.py [corpus.csv column]
+    corpus = generated_corpus(5000) + synthetic_corpus(5000)
+    if len(sys.argv) > 2:
+        corpus += pd.read_csv(sys.argv[1])[sys.argv[2]].tolist()
+    corpus += mutated_corpus(corpus, 5000)
+    results = compare_engines(corpus)
+    print(results.drop(columns="divergences").to_string())
+    for row in results.itertuples():
+        for divergence in row.divergences:
+            print(row.engine, divergence)
+    sys.exit(int(results["diverging"].any()))
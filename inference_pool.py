@@ -0,0 +1,324 @@
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import traceback
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+from model_prep import default_model_path
+from prediction_utils import Predictions, unique_codes
+from session_config import available_cores
+
+# Builds, in a worker, the function that predicts a batch of cleaned texts
+PredictorFactory = Callable[[], Callable[[List[str]], List[Any]]]
+# Batches queued per worker: enough that a worker never waits for the next
+# one, few enough to bound the memory of a big job
+PREFETCH = 2
+# Seconds between checks that the workers are still alive
+POLL_SECONDS = 1.0
+
+
+def core_sets(workers: int, cores: Optional[List[int]] = None) -> List[List[int]]:
+    """Split the CPUs into one set per worker, for `os.sched_setaffinity`
+
+    Args:
+        workers (int): Number of sets
+        cores (List[int], optional): Defaults to the CPUs this process may
+          run on
+
+    Returns:
+        List[List[int]]: Contiguous, non-overlapping sets as even as
+          possible. With fewer CPUs than workers, workers share CPUs.
+    """
+    if cores is None:
+        try:
+            cores = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            cores = list(range(os.cpu_count() or 1))
+    if workers > len(cores):
+        return [[cores[i % len(cores)]] for i in range(workers)]
+    size, extra = divmod(len(cores), workers)
+    sets = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (i < extra)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def external_data_model(model_path: Path, output_path: Optional[Path] = None) -> Path:
+    """A copy of an ONNX model with its weights in a separate file
+
+    ONNX Runtime memory-maps weights stored as external data instead of
+    reading them into each session, so the sessions of several processes
+    share one copy through the page cache. Weights that are rewritten when
+    the session is created (prepacked or folded by graph optimizations) are
+    still private to each process.
+
+    The copy is only made once and needs the `onnx` package.
+
+    Args:
+        model_path (Path): The .onnx file
+        output_path (Path, optional): Defaults to "<name>.external.onnx"
+          next to `model_path`, with the weights in "<name>.external.data"
+
+    Returns:
+        Path: The copy
+    """
+    import onnx
+
+    model_path = Path(model_path)
+    if output_path is None:
+        output_path = model_path.with_suffix(".external.onnx")
+    if output_path.exists():
+        return output_path
+    model = onnx.load(str(model_path))
+    tmp = output_path.with_name(f"tmp-{output_path.name}")
+    onnx.save_model(
+        model,
+        str(tmp),
+        save_as_external_data=True,
+        all_tensors_to_one_file=True,
+        location=output_path.with_suffix(".data").name,
+        size_threshold=1024,
+    )
+    os.replace(tmp, output_path)
+    return output_path
+
+
+def bulk_predictor() -> Callable[[List[str]], List[Any]]:
+    """The default `PredictorFactory`: the worker's own ONNX pipeline"""
+    from onnx_model_utils import pipeline
+
+    return pipeline.bulk
+
+
+def _sendable(error: Exception) -> Exception:
+    """`error`, or a `RuntimeError` with its traceback if it can not go
+    through a queue (the put would fail in the queue's thread and the
+    parent would wait for the result forever)
+    """
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        lines = traceback.format_exception(type(error), error, error.__traceback__)
+        return RuntimeError(f"Inference worker failed:\n{''.join(lines)}")
+
+
+def _worker(
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+    factory: PredictorFactory,
+    cores: Optional[List[int]],
+    env: Dict[str, str],
+):
+    if cores:
+        os.sched_setaffinity(0, cores)
+    # The session profile and model path are read at import, so the
+    # variables go in before `factory` imports anything
+    os.environ.update(env)
+    predict = factory()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        index, texts = task
+        try:
+            results.put((index, predict(texts), None))
+        except Exception as error:  # Raised again in the parent process
+            results.put((index, None, _sendable(error)))
+
+
+class InferencePool:
+    """Predict batches in several processes, each with its own model
+
+    Each worker process loads an `ONNXCPUClassificationPipeline` (through
+    `factory`) with its share of the CPUs as intra-op threads, optionally
+    pinned to them. Batches go through a single queue that idle workers take
+    from, so a worker that gets short texts just takes more batches, and
+    the results are put back in the order of the batches.
+
+    With `share_weights`, the workers load `external_data_model`, whose
+    weights are memory-mapped once for all of them, with prepacking turned
+    off so that it does not make a private copy per worker (unless
+    `ROTA_ORT_DISABLE_PREPACKING` says otherwise).
+
+    Use it as a context manager:
+
+        with InferencePool(workers=4) as pool:
+            predictions = pool.predict(cleaned_texts)
+
+    Args:
+        workers (int, optional): Number of processes. Defaults to the number
+          of usable physical cores divided by 4 (at least 1), since each
+          session scales well up to a few threads.
+        factory (PredictorFactory, optional): Defaults to `bulk_predictor`.
+          Must be importable by the workers (a module level function).
+        pin_cores (bool, optional): Whether to pin each worker to its own
+          set of CPUs (Linux only). Defaults to False.
+        share_weights (bool, optional): Defaults to True
+        model_path (Path, optional): Defaults to `model_prep.default_model_path()`,
+          which has to exist (eg: after importing `onnx_model_utils` once)
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        factory: Optional[PredictorFactory] = None,
+        pin_cores: bool = False,
+        share_weights: bool = True,
+        model_path: Optional[Path] = None,
+    ):
+        if workers is None:
+            workers = max(1, available_cores() // 4)
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self.factory = factory or bulk_predictor
+        self.pin_cores = pin_cores
+        self.share_weights = share_weights
+        self.model_path = model_path
+        self.processes: List[multiprocessing.Process] = []
+
+    def _worker_env(self, cores: List[int]) -> Dict[str, str]:
+        threads = max(1, len(cores) * available_cores() // available_cores(True))
+        env = {
+            "ROTA_ORT_INTRA_OP_NUM_THREADS": str(threads),
+            "OMP_NUM_THREADS": str(threads),
+            # The workers already use all the cores between them
+            "TOKENIZERS_PARALLELISM": "false",
+        }
+        if self.model_path is not None:
+            env["ROTA_MODEL_PATH"] = str(self.model_path)
+        if self.share_weights and self.factory is bulk_predictor:
+            shared_path = external_data_model(self.model_path or default_model_path())
+            env["ROTA_MODEL_PATH"] = str(shared_path)
+            env["ROTA_ORT_DISABLE_PREPACKING"] = os.environ.get(
+                "ROTA_ORT_DISABLE_PREPACKING", "1"
+            )
+        return env
+
+    def start(self) -> "InferencePool":
+        # Not forked: onnxruntime's threads do not survive a fork
+        context = multiprocessing.get_context("spawn")
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        for cores in core_sets(self.workers):
+            process = context.Process(
+                target=_worker,
+                args=(
+                    self.tasks,
+                    self.results,
+                    self.factory,
+                    cores if self.pin_cores else None,
+                    self._worker_env(cores),
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        return self
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+    def __enter__(self) -> "InferencePool":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _result(self):
+        while True:
+            try:
+                return self.results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                dead = [p for p in self.processes if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(
+                        f"Inference worker exited with code {dead[0].exitcode}"
+                    )
+
+    def map(self, batches: Iterable[List[str]]) -> Iterator[List[Any]]:
+        """Predict batches of cleaned texts, yielding results in order
+
+        Args:
+            batches (Iterable[List[str]]): The batches, read as the workers
+              need more
+
+        Yields:
+            List[Any]: The predictions of each batch
+        """
+        if not self.processes:
+            raise RuntimeError("The pool is not started")
+        batches = enumerate(batches)
+        in_flight = 0
+        for index, batch in islice(batches, PREFETCH * self.workers):
+            self.tasks.put((index, list(batch)))
+            in_flight += 1
+        done = {}
+        next_index = 0
+        try:
+            while in_flight:
+                index, predictions, error = self._result()
+                in_flight -= 1
+                if error is not None:
+                    raise error
+                done[index] = predictions
+                for next_batch in islice(batches, 1):
+                    self.tasks.put((next_batch[0], list(next_batch[1])))
+                    in_flight += 1
+                while next_index in done:
+                    yield done.pop(next_index)
+                    next_index += 1
+        finally:
+            # When stopped early, the batches still running would otherwise
+            # be taken as results of the next call
+            while in_flight:
+                self._result()
+                in_flight -= 1
+
+    def predict(self, texts: Iterable[str], chunk_size: int = 1024) -> Any:
+        """Predict cleaned texts, `chunk_size` texts per task
+
+        Returns:
+            Any: The `Predictions` of the chunks stacked together, or their
+              results as one list for predictors that return lists
+        """
+        texts = list(texts)
+        # Without texts, one empty chunk still gets the predictor's empty
+        # result, eg: `Predictions` with the labels but no rows
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        chunks = chunks or [[]]
+        results = list(self.map(chunks))
+        if results and isinstance(results[0], Predictions):
+            return Predictions.concat(results)
+        return [prediction for result in results for prediction in result]
+
+
+if __name__ == "__main__":
+    # python inference_pool.py input.csv column output.csv [workers]
+    from cleaning_utils import clean_series
+
+    input_path, column, output_path = sys.argv[1:4]
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    frame = pd.read_csv(input_path)
+    unique_texts, codes = unique_codes(clean_series(frame[column]))
+    with InferencePool(workers, pin_cores=True) as pool:
+        predictions = pool.predict(unique_texts)[codes]
+    frame["charge_category_pred"] = predictions.max_labels()
+    frame["charge_category_pred_confidence"] = predictions.confidence()
+    frame.to_csv(output_path, index=False)
@@ -0,0 +1,143 @@
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+# Outputs added by `add_postprocessing`
+PROBABILITIES = "probabilities"
+TOP_SCORES = "top_scores"
+TOP_INDICES = "top_indices"
+# Labels kept by the TopK node
+DEFAULT_TOP_K = 5
+# Where `onnx_model_utils` downloads the release model to
+RELEASE_PATH = Path("onnx/rota-quantized.onnx")
+
+
+def add_postprocessing(
+    model_path: Path,
+    output_path: Path,
+    k: int = DEFAULT_TOP_K,
+    keep_logits: bool = False,
+) -> Path:
+    """Rewrite a classifier to output probabilities and its top `k` labels
+
+    A Softmax node is added after the model's first output (the logits),
+    followed by a TopK node, so that ONNX Runtime returns:
+
+    - "probabilities": the (n_texts, n_labels) float32 softmax
+    - "top_scores": the (n_texts, k) best probabilities, best first
+    - "top_indices": their (n_texts, k) int64 label ids
+
+    `ONNXCPUClassificationPipeline` uses these outputs when the model has
+    them. Needs the `onnx` package.
+
+    Args:
+        model_path (Path): The .onnx classifier
+        output_path (Path): Where to write the rewritten model
+        k (int, optional): Defaults to `DEFAULT_TOP_K`. Cut down to the number
+          of labels when the model says how many there are.
+        keep_logits (bool, optional): Whether to keep the logits as an output
+          too. Defaults to False.
+
+    Returns:
+        Path: `output_path`
+    """
+    import onnx
+    from onnx import TensorProto, helper
+
+    model = onnx.load(str(model_path))
+    graph = model.graph
+    names = {name for node in graph.node for name in node.output}
+    names |= {value.name for value in graph.output}
+    taken = names & {PROBABILITIES, TOP_SCORES, TOP_INDICES, "top_k"}
+    if taken:
+        raise ValueError(f"The model already has {sorted(taken)}")
+
+    logits = graph.output[0]
+    dims = logits.type.tensor_type.shape.dim
+    batch = dims[0].dim_param or dims[0].dim_value or "batch"
+    if len(dims) == 2 and dims[1].dim_value:
+        k = min(k, dims[1].dim_value)
+    opset = next(
+        (o.version for o in model.opset_import if o.domain in ("", "ai.onnx")), 1
+    )
+
+    nodes = [
+        helper.make_node("Softmax", [logits.name], [PROBABILITIES], axis=1),
+    ]
+    if opset >= 10:
+        graph.initializer.append(
+            helper.make_tensor("top_k", TensorProto.INT64, [1], [k])
+        )
+        nodes.append(
+            helper.make_node(
+                "TopK", [PROBABILITIES, "top_k"], [TOP_SCORES, TOP_INDICES], axis=1
+            )
+        )
+    else:
+        nodes.append(
+            helper.make_node(
+                "TopK", [PROBABILITIES], [TOP_SCORES, TOP_INDICES], axis=1, k=k
+            )
+        )
+    graph.node.extend(nodes)
+
+    n_labels = dims[1].dim_value if len(dims) == 2 and dims[1].dim_value else None
+    outputs = [
+        helper.make_tensor_value_info(
+            PROBABILITIES, TensorProto.FLOAT, [batch, n_labels]
+        ),
+        helper.make_tensor_value_info(TOP_SCORES, TensorProto.FLOAT, [batch, k]),
+        helper.make_tensor_value_info(TOP_INDICES, TensorProto.INT64, [batch, k]),
+    ]
+    if not keep_logits:
+        graph.output.remove(logits)
+    graph.output.extend(outputs)
+    onnx.checker.check_model(model)
+
+    output_path = Path(output_path)
+    tmp = output_path.with_name(f"tmp-{output_path.name}")
+    onnx.save_model(model, str(tmp))
+    os.replace(tmp, output_path)
+    return output_path
+
+
+def model_digest(model_path: Path) -> str:
+    """A short SHA-256 of a model file, eg: to tell apart the predictions of
+    models released under the same tag
+    """
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def postprocessed_path(model_path: Path) -> Path:
+    """Where the rewritten copy of a model goes, eg: "x.postprocess.onnx" """
+    return Path(model_path).with_suffix(".postprocess.onnx")
+
+
+def default_model_path() -> Path:
+    """The model to load: `ROTA_MODEL_PATH`, or else the release with its
+    post-processing (made by `prepare_model` on first load)
+    """
+    return Path(os.environ.get("ROTA_MODEL_PATH", postprocessed_path(RELEASE_PATH)))
+
+
+def prepare_model(model_path: Path, k: int = DEFAULT_TOP_K) -> Path:
+    """`add_postprocessing` to `postprocessed_path`, unless already done"""
+    output_path = postprocessed_path(model_path)
+    if not output_path.exists():
+        add_postprocessing(model_path, output_path, k)
+    return output_path
+
+
+if __name__ == "__main__":
+    # python model_prep.py onnx/rota-quantized.onnx [output.onnx] [k]
+    model_path = Path(sys.argv[1])
+    output_path = Path(sys.argv[2]) if len(sys.argv) > 2 else None
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_TOP_K
+    print(
+        add_postprocessing(model_path, output_path or postprocessed_path(model_path), k)
+    )
@@ -2,34 +2,57 @@
 # This turns off 'imports not at top of file' to address the
 # staggered imports below
 import os
-from psutil import cpu_count
 
-# Constants from the performance optimization available in onnxruntime
-# It needs to be done before importing onnxruntime
-os.environ["OMP_NUM_THREADS"] = str(cpu_count(logical=True))
-os.environ["OMP_WAIT_POLICY"] = "ACTIVE"
-os.environ["TOKENIZERS_PARALLELISM"] = "true"
+from session_config import SessionProfile
+
+# Threading of the ONNX Runtime session, set with ROTA_ORT_* variables or a
+# ROTA_ORT_CONFIG file (see `SessionProfile.load`). OpenMP reads its
+# variables when onnxruntime is imported, so they are set first.
+session_profile = SessionProfile.load()
+session_profile.set_environment()
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
 
 import copy
 import gzip
 import json
 import os
 import shutil
+from functools import partial
 from pathlib import Path
-from typing import Any, BinaryIO, Dict, List, Optional
+from typing import Any, BinaryIO, Dict, List, Optional, Union
 
 import requests
-import streamlit as st
-from numpy import ndarray
-from onnxruntime import GraphOptimizationLevel, InferenceSession, SessionOptions
-from scipy.special import softmax
 from tqdm import tqdm
 from transformers import AutoTokenizer
 
-from cleaning_utils import cleaner
+from batching_utils import BatchRecord, BatchSizeController
+from cleaning_utils import clean_cached
+from model_prep import (
+    RELEASE_PATH,
+    default_model_path,
+    model_digest,
+    postprocessed_path,
+    prepare_model,
+)
+from onnx_pipeline import (
+    MAX_BATCH_SIZE,
+    MAX_BATCH_TOKENS,
+    ONNXCPUClassificationPipeline,
+)
+from prediction_cache import default_prediction_cache, predict_unique
+from prediction_utils import Predictions
 
 RELEASE_TAG = "2021.05.18.15"
-OUTPUT_PATH = Path("onnx/rota-quantized.onnx")
+# Shared by all bulk predictions, so what it learns carries over between
+# calls. `batch_controller.report()` gives the budgets of the last batches of
+# any job, pass `records` to `predict_bulk` for those of one job.
+batch_controller = BatchSizeController.from_env(MAX_BATCH_TOKENS)
+OUTPUT_PATH = RELEASE_PATH
+# The model that is loaded: by default the release with softmax and top-k
+# added to the graph (see `model_prep`), made on first load. Can be another
+# copy, eg: the external data version that `inference_pool` workers share.
+PREPARED_PATH = postprocessed_path(OUTPUT_PATH)
+MODEL_PATH = default_model_path()
 ONNX_RELEASE = (
     "https://github.com/RTIInternational/"
     "rota/"
@@ -72,9 +95,8 @@ def http_get(
     progress.close()
 
 
-@st.cache_data
 def cleaner_cache(text):
-    return cleaner(text)
+    return clean_cached(text)
 
 
 def get_label_config(model_name, config_path: Path = Path("config.json")):
@@ -89,61 +111,6 @@ def get_label_config(model_name, config_path: Path = Path("config.json")):
     return labels
 
 
-class ONNXCPUClassificationPipeline:
-    def __init__(self, tokenizer, model_path):
-        self.tokenizer = tokenizer
-        self.model = create_cpu_model(model_path)
-        self.labels = get_label_config(
-            tokenizer.name_or_path, config_path=Path("onnx/config.json")
-        )
-
-    def __call__(self, texts: List[str]) -> List[List[Dict[str, Any]]]:
-        # Inputs are provided through numpy array
-        model_inputs = self.tokenizer(texts, return_tensors="pt", padding=True)
-        inputs_onnx = {k: v.cpu().detach().numpy() for k, v in model_inputs.items()}
-
-        # Run the model (None = get all the outputs)
-        output = self.model.run(0, inputs_onnx)
-        probs = softmax(output[0], axis=1)
-        predictions = self._format_predictions(probs, self.labels)
-        return predictions
-
-    def _format_predictions(
-        self, softmax_array: ndarray, labels: List[str]
-    ) -> List[List[Dict[str, Any]]]:
-        """Format predictions from ONNX similar to the
-        huggingface transformers classification pipeline
-
-        Args:
-            softmax_array (np.ndarray): array of shape (n_preds, n_labels)
-
-        Returns:
-            List[List[Dict[str, Any]]]: Output of predictions, where each row is a list
-            of Dict with keys "label" and "score"
-        """
-        predictions = [
-            [
-                {"label": labels[column], "score": float(softmax_array[row][column])}
-                for column in range(softmax_array.shape[1])
-            ]
-            for row in range(softmax_array.shape[0])
-        ]
-        return predictions
-
-
-def create_cpu_model(model_path: str) -> InferenceSession:
-    # Few properties that might have an impact on performances (provided by MS)
-    options = SessionOptions()
-    options.intra_op_num_threads = 1
-    options.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
-
-    # Load the model as a graph and prepare the CPU backend
-    session = InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
-    session.disable_fallback()
-
-    return session
-
-
 def download_model():
     OUTPUT_PATH.parent.mkdir(exist_ok=True)
     with open(f"{OUTPUT_PATH}.gz", "wb") as f:
@@ -158,14 +125,38 @@ def download_model():
 
 
 def load_model():
-    if not OUTPUT_PATH.exists():
-        download_model()
+    if not MODEL_PATH.exists():
+        # Only the release and its prepared copy can be made here
+        if MODEL_PATH not in (OUTPUT_PATH, PREPARED_PATH):
+            raise FileNotFoundError(
+                f"ROTA_MODEL_PATH is set to {str(MODEL_PATH)!r}, which does not"
+                " exist. Unset it to download the release model."
+            )
+        if not OUTPUT_PATH.exists():
+            download_model()
+        if MODEL_PATH == PREPARED_PATH:
+            prepare_model(OUTPUT_PATH)
     tokenizer = AutoTokenizer.from_pretrained("rti-international/rota")
-    pipeline = ONNXCPUClassificationPipeline(tokenizer, str(OUTPUT_PATH))
+    labels = get_label_config(
+        tokenizer.name_or_path, config_path=Path("onnx/config.json")
+    )
+    pipeline = ONNXCPUClassificationPipeline(
+        tokenizer,
+        str(MODEL_PATH),
+        [labels[i] for i in range(len(labels))],
+        session_profile,
+        batch_controller,
+        MAX_BATCH_SIZE,
+    )
     return pipeline
 
 
 pipeline = load_model()
+# Scores of cleaned texts kept across runs (see `prediction_cache`), for the
+# model that was loaded: ROTA_MODEL_PATH can point at another model under the
+# same release tag. The cleaning rules need no part in it, the texts are
+# already cleaned. None if disabled.
+prediction_cache = default_prediction_cache(f"{RELEASE_TAG}-{model_digest(MODEL_PATH)}")
 
 
 def predict(text: str, sort=True) -> List[List[Dict[str, Any]]]:
@@ -181,29 +172,37 @@ def predict(text: str, sort=True) -> List[List[Dict[str, Any]]]:
           label scores.
     """
     clean = cleaner_cache(text)
-    preds = pipeline([clean])
-    if sort:
-        sorted_preds = [
-            sorted(p, key=lambda d: d["score"], reverse=True) for p in preds
-        ]
-        return sorted_preds
-    else:
-        return preds
+    return predict_unique([clean], pipeline, prediction_cache).to_dicts(sort=sort)
 
 
-def predict_bulk(texts: List[str]) -> List[List[Dict[str, Any]]]:
+def predict_bulk(
+    texts: List[str], clean: bool = True, records: Optional[List[BatchRecord]] = None
+) -> Predictions:
     """Generate predictions on a list of strings.
 
     Args:
         texts (List[str]): Input texts to generate predictions (post-cleaning)
+        clean (bool, optional): Whether to clean the texts first. Pass False if
+          they were already cleaned, eg: with `cleaning_utils.clean_series`.
+          Defaults to True.
+        records (List[BatchRecord], optional): Gets the `BatchRecord` of each
+          batch run appended, for the `batching_utils.batch_report` of a job
+
+    Each distinct cleaned text is only predicted once, many raw texts clean
+    to the same one, and not at all if it is in `prediction_cache`. The
+    texts are batched by token length, see
+    `ONNXCPUClassificationPipeline.bulk`.
 
     Returns:
-        List[List[Dict[str, Any]]]: Predicted label scores for each input text
+        Predictions: Predicted label scores for each input text, as a matrix.
+          Indexing or iterating gives the list of 'label' and 'score' dicts of
+          a text.
     """
-    cleaned = [cleaner_cache(text) for text in texts]
-    preds = pipeline(cleaned)
-    del cleaned
-    return preds
+    if clean:
+        texts = [cleaner_cache(text) for text in texts]
+    return predict_unique(
+        texts, partial(pipeline.bulk, records=records), prediction_cache
+    )
 
 
 def _max_pred(prediction_scores: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -220,15 +219,21 @@ def _max_pred(prediction_scores: List[Dict[str, Any]]) -> Dict[str, Any]:
     return max(prediction_scores, key=lambda d: d["score"])
 
 
-def max_pred_bulk(preds: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+def max_pred_bulk(
+    preds: Union[Predictions, List[List[Dict[str, Any]]]]
+) -> List[Dict[str, Any]]:
     """Generates a "column" of label predictions by finding the max
     prediction score per element
 
     Args:
-        preds (List[List[Dict[str, Any]]]): A list of predictions
+        preds (Union[Predictions, List[List[Dict[str, Any]]]]): Predictions,
+          from `predict_bulk` or as lists of dicts. `Predictions.max_labels`
+          and `Predictions.max_scores` give the same as arrays.
 
     Returns:
         List[Dict[str, Any]: A list of  'label' and 'score' dict with the highest score
           value
     """
+    if isinstance(preds, Predictions):
+        return preds.max_dicts()
     return [_max_pred(pred) for pred in preds]
@@ -0,0 +1,167 @@
+import os
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence
+
+from numpy import argsort, concatenate, empty, int64, ndarray
+
+from batching_utils import BatchRecord, BatchSizeController, iter_batches, pad_batch
+from model_prep import PROBABILITIES, TOP_INDICES, TOP_SCORES
+from prediction_utils import Predictions, softmax
+from session_config import SessionProfile
+
+# Padded tokens (texts x longest text) per batch in bulk predictions, the
+# starting point of an adaptive `BatchSizeController`
+MAX_BATCH_TOKENS = int(os.environ.get("ROTA_MAX_BATCH_TOKENS", "8192"))
+# Most texts per batch in bulk predictions
+MAX_BATCH_SIZE = int(os.environ.get("ROTA_MAX_BATCH_SIZE", "256"))
+
+
+def create_cpu_model(model_path: str, profile: Optional[SessionProfile] = None):
+    """Load the model for the CPU
+
+    onnxruntime is imported here rather than at the top, so that
+    `SessionProfile.set_environment` can run first (see `onnx_model_utils`).
+
+    Args:
+        model_path (str): Path of the .onnx file
+        profile (SessionProfile, optional): Threading and memory options.
+          Defaults to `SessionProfile.load()`.
+
+    Returns:
+        onnxruntime.InferenceSession: The session
+    """
+    from onnxruntime import InferenceSession
+
+    options = (profile or SessionProfile.load()).session_options()
+
+    # Load the model as a graph and prepare the CPU backend
+    session = InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+    session.disable_fallback()
+
+    return session
+
+
+class ONNXCPUClassificationPipeline:
+    """A text classifier run by ONNX Runtime on the CPU
+
+    Args:
+        tokenizer: A huggingface tokenizer, or anything called the same way
+          with the same attributes
+        model_path (str): The .onnx classifier, optionally with the outputs
+          of `model_prep.add_postprocessing`
+        label_names (Sequence[str]): The label of each output column
+        profile (SessionProfile, optional): See `create_cpu_model`
+        controller (BatchSizeController, optional): The default of `bulk`.
+          Defaults to a fixed budget of `MAX_BATCH_TOKENS` per batch.
+        max_batch_size (int, optional): Defaults to `MAX_BATCH_SIZE`
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        model_path: str,
+        label_names: Sequence[str],
+        profile: Optional[SessionProfile] = None,
+        controller: Optional[BatchSizeController] = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+    ):
+        self.tokenizer = tokenizer
+        self.model = create_cpu_model(model_path, profile)
+        self.label_names = list(label_names)
+        self.controller = controller or BatchSizeController(
+            MAX_BATCH_TOKENS, MAX_BATCH_TOKENS, MAX_BATCH_TOKENS
+        )
+        self.max_batch_size = max_batch_size
+        # Models from `model_prep.add_postprocessing` give probabilities and
+        # top labels, others only logits
+        outputs = {output.name for output in self.model.get_outputs()}
+        self.postprocessed = {PROBABILITIES, TOP_SCORES, TOP_INDICES} <= outputs
+
+    def __call__(self, texts: List[str]) -> Predictions:
+        # Tokenize straight to the int64 numpy arrays ONNX Runtime takes,
+        # without going through torch tensors
+        model_inputs = self.tokenizer(texts, return_tensors="np", padding=True)
+        inputs_onnx = {k: v.astype(int64, copy=False) for k, v in model_inputs.items()}
+        return self._predict(inputs_onnx)
+
+    def _predict(self, inputs_onnx: Dict[str, ndarray]) -> Predictions:
+        if self.postprocessed:
+            scores, top_scores, top_indices = self.model.run(
+                [PROBABILITIES, TOP_SCORES, TOP_INDICES], inputs_onnx
+            )
+            return Predictions(scores, self.label_names, (top_indices, top_scores))
+        # Run the model (None = get all the outputs)
+        output = self.model.run(None, inputs_onnx)
+        return Predictions(softmax(output[0]), self.label_names)
+
+    def bulk(
+        self,
+        texts: List[str],
+        max_tokens: Optional[int] = None,
+        max_batch_size: Optional[int] = None,
+        controller: Optional[BatchSizeController] = None,
+        records: Optional[List[BatchRecord]] = None,
+    ) -> Predictions:
+        """Predict many texts, batched by length
+
+        The texts are tokenized once without padding, grouped with texts of
+        similar length into batches of up to `max_tokens` padded tokens
+        (see `batching_utils.token_budget_batches`), and the predictions are
+        put back in the order of `texts`.
+
+        Args:
+            texts (List[str]): The (cleaned) texts
+            max_tokens (int, optional): A fixed budget per batch. Defaults to
+              asking `controller`.
+            max_batch_size (int, optional): Defaults to `self.max_batch_size`
+            controller (BatchSizeController, optional): Picks the budget of
+              each batch from the time the previous ones took. Defaults to
+              `self.controller`.
+            records (List[BatchRecord], optional): Gets the `BatchRecord` of
+              each batch appended, eg: for the `batching_utils.batch_report`
+              of one job when the controller is shared
+
+        Returns:
+            Predictions: Same as `__call__`
+        """
+        texts = list(texts)
+        if not texts:
+            return Predictions(empty((0, len(self.label_names))), self.label_names)
+        encodings = self.tokenizer(texts)
+        lengths = [len(ids) for ids in encodings["input_ids"]]
+        pad_values = {
+            "input_ids": self.tokenizer.pad_token_id,
+            "token_type_ids": self.tokenizer.pad_token_type_id,
+        }
+        if max_tokens is not None:
+            controller = BatchSizeController(max_tokens, max_tokens, max_tokens)
+        elif controller is None:
+            controller = self.controller
+        batches = []
+        predictions = []
+        # The budget each batch was formed with: other jobs sharing the
+        # controller may change its size before the batch is recorded
+        sizes = []
+
+        def budget() -> int:
+            sizes.append(controller.size)
+            return sizes[-1]
+
+        for batch in iter_batches(
+            lengths, budget, max_batch_size or self.max_batch_size
+        ):
+            inputs_onnx = pad_batch(
+                encodings, batch, pad_values, self.tokenizer.padding_side
+            )
+            size = sizes[-1]
+            start = perf_counter()
+            predictions.append(self._predict(inputs_onnx))
+            tokens = sum(lengths[i] for i in batch)
+            record = BatchRecord(size, len(batch), tokens, perf_counter() - start)
+            controller.add(record)
+            if records is not None:
+                records.append(record)
+            batches.append(batch)
+        # Back from the order of the batches to the order of `texts`
+        order = argsort(concatenate(batches))
+        return Predictions.concat(predictions)[order]
@@ -0,0 +1,264 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Union
+
+from numpy import empty, float32, frombuffer, ndarray
+
+from prediction_utils import Predictions, unique_codes
+
+# Texts per SQL statement, under SQLite's default limit of 999 parameters
+CHUNK_SIZE = 500
+# Share of `max_entries` kept when the cache is full, so that eviction
+# happens once in a while rather than on every write
+EVICT_TO = 0.9
+
+
+class PredictionCache:
+    """Scores of cleaned texts, kept in a SQLite file across runs
+
+    Entries belong to a `namespace`, eg: the `RELEASE_TAG` and the
+    `model_prep.model_digest` of the loaded model: when either changes, the
+    old entries are no longer found and get evicted in time. The cleaning
+    rules are not part of it, since the entries are keyed by cleaned text.
+    When there are more than `max_entries` (over all namespaces), the least
+    recently used ones are deleted.
+
+    Safe to share between the threads of a process, and between processes
+    (SQLite locks the file).
+
+    Args:
+        path (Union[str, Path]): The SQLite file, created if needed
+        namespace (str): The version of the model
+        max_entries (int, optional): Defaults to 1,000,000. An entry takes
+          4 bytes per label plus the text.
+    """
+
+    def __init__(
+        self, path: Union[str, Path], namespace: str, max_entries: int = 1_000_000
+    ):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.connection = sqlite3.connect(
+            str(self.path), check_same_thread=False, timeout=30
+        )
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " namespace TEXT, text TEXT, scores BLOB, used REAL,"
+                " PRIMARY KEY (namespace, text))"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS predictions_used ON predictions (used)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS labels (namespace TEXT PRIMARY KEY,"
+                " labels TEXT)"
+            )
+        self.entries = self._count()
+
+    def _count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def labels(self) -> Optional[List[str]]:
+        """The labels of the scores of this namespace, None if none stored
+
+        Raises:
+            ValueError: If the stored labels are not a list of names
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT labels FROM labels WHERE namespace = ?", (self.namespace,)
+            ).fetchone()
+        if row is None:
+            return None
+        labels = json.loads(row[0])
+        if not isinstance(labels, list) or not all(isinstance(x, str) for x in labels):
+            raise ValueError(f"Bad labels in the prediction cache: {row[0]!r}")
+        return labels
+
+    def get_many(self, texts: Sequence[str]) -> Dict[str, ndarray]:
+        """The float32 scores of the texts that are cached, by text"""
+        found = {}
+        now = time.time()
+        with self.lock, self.connection:
+            for start in range(0, len(texts), CHUNK_SIZE):
+                chunk = list(texts[start : start + CHUNK_SIZE])
+                marks = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    "SELECT text, scores FROM predictions"
+                    f" WHERE namespace = ? AND text IN ({marks})",
+                    [self.namespace] + chunk,
+                ).fetchall()
+                found.update(
+                    (text, frombuffer(scores, float32)) for text, scores in rows
+                )
+                if rows:
+                    self.connection.execute(
+                        "UPDATE predictions SET used = ?"
+                        f" WHERE namespace = ? AND text IN ({marks})",
+                        [now, self.namespace] + chunk,
+                    )
+            self.hits += len(found)
+            self.misses += len(set(texts)) - len(found)
+        return found
+
+    def put_many(self, texts: Sequence[str], predictions: Predictions):
+        """Store the scores of texts, and evict if the cache is over its size"""
+        now = time.time()
+        rows = [
+            (self.namespace, text, scores.tobytes(), now)
+            for text, scores in zip(texts, predictions.scores)
+        ]
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO labels VALUES (?, ?)",
+                (self.namespace, json.dumps(predictions.labels.tolist())),
+            )
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)", rows
+            )
+            # Replaced rows count as changes too, so this can overestimate
+            self.entries += self.connection.total_changes - before
+            if self.entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        self.entries = self._count()
+        excess = self.entries - int(self.max_entries * EVICT_TO)
+        if excess <= 0:
+            return
+        self.connection.execute(
+            "DELETE FROM predictions WHERE rowid IN"
+            " (SELECT rowid FROM predictions ORDER BY used LIMIT ?)",
+            (excess,),
+        )
+        self.entries -= excess
+        self.evictions += excess
+
+    def predict(
+        self, texts: Sequence[str], predict: Callable[[List[str]], Predictions]
+    ) -> Predictions:
+        """Predictions for distinct texts, only running `predict` on those
+        that are not cached (and then caching them)
+
+        Errors of the cache itself are ignored: the texts are predicted as
+        if they were not cached.
+
+        Args:
+            texts (Sequence[str]): Distinct cleaned texts
+            predict (Callable[[List[str]], Predictions]): Predicts texts, eg:
+              `ONNXCPUClassificationPipeline.bulk`
+
+        Returns:
+            Predictions: In the order of `texts`
+        """
+        texts = list(texts)
+        try:
+            labels = self.labels()
+            found = self.get_many(texts) if labels is not None else {}
+        except (sqlite3.Error, ValueError):
+            # ValueError: labels or scores that are not what was stored
+            labels, found = None, {}
+        found = {t: s for t, s in found.items() if len(s) == len(labels)}
+        missing = [text for text in texts if text not in found]
+        if not found:
+            predictions = predict(texts)
+            self._put(texts, predictions)
+            return predictions
+        computed = predict(missing) if missing else None
+        if computed is not None:
+            self._put(missing, computed)
+        scores = empty((len(texts), len(labels)), dtype=float32)
+        for i, text in enumerate(texts):
+            if text in found:
+                scores[i] = found[text]
+        if computed is not None:
+            rows = [i for i, text in enumerate(texts) if text not in found]
+            scores[rows] = computed.scores
+        return Predictions(scores, labels)
+
+    def _put(self, texts: List[str], predictions: Predictions):
+        try:
+            self.put_many(texts, predictions)
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM predictions")
+            self.connection.execute("DELETE FROM labels")
+            self.entries = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self.entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def predict_unique(
+    texts: Iterable[str],
+    predict: Callable[[List[str]], Predictions],
+    cache: Optional[PredictionCache] = None,
+) -> Predictions:
+    """Predict each distinct cleaned text once, and not at all if cached
+
+    Args:
+        texts (Iterable[str]): Cleaned texts, with repeats
+        predict (Callable[[List[str]], Predictions]): Predicts texts
+        cache (PredictionCache, optional): Where to look up and store
+          predictions. Defaults to none.
+
+    Returns:
+        Predictions: A row per text of `texts`
+    """
+    unique_texts, codes = unique_codes(texts)
+    if cache is None:
+        return predict(unique_texts)[codes]
+    return cache.predict(unique_texts, predict)[codes]
+
+
+def default_prediction_cache(namespace: str) -> Optional[PredictionCache]:
+    """The prediction cache at `ROTA_PREDICTION_CACHE`, or else
+    "predictions.sqlite" in `ROTA_CACHE_DIR` (default: ~/.cache/rota, next to
+    the cleaning plans of `rule_pack.default_plan_cache`)
+
+    It keeps the scores of every cleaned text predicted so far, so that the
+    same text never goes through the model twice, up to
+    `ROTA_PREDICTION_CACHE_SIZE` texts (default: 1,000,000) with the least
+    recently used dropped first. Setting either path to an empty string
+    disables it.
+    """
+    directory = os.environ.get(
+        "ROTA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rota")
+    )
+    default = os.path.join(directory, "predictions.sqlite") if directory else ""
+    path = os.environ.get("ROTA_PREDICTION_CACHE", default)
+    if not path:
+        return None
+    max_entries = int(os.environ.get("ROTA_PREDICTION_CACHE_SIZE", "1000000"))
+    try:
+        return PredictionCache(path, namespace, max_entries)
+    except (OSError, sqlite3.Error):
+        # eg: a read-only home directory, predictions still work without it
+        return None
@@ -0,0 +1,284 @@
+from numbers import Integral
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import pandas as pd
+from numpy import (
+    arange,
+    argpartition,
+    argsort,
+    asarray,
+    broadcast_to,
+    concatenate,
+    empty,
+    exp,
+    fromiter,
+    float32,
+    float64,
+    int16,
+    int64,
+    ndarray,
+    rint,
+    take_along_axis,
+    uint8,
+)
+
+# Columns of `Predictions.output_frame` start with this
+OUTPUT_PREFIX = "charge_category"
+OUTPUT_MODES = ("max", "top_k", "scores")
+
+
+def softmax(logits: ndarray) -> ndarray:
+    """Softmax over the labels of a (n_texts, n_labels) array of logits"""
+    exps = exp(logits - logits.max(axis=1, keepdims=True))
+    return exps / exps.sum(axis=1, keepdims=True)
+
+
+def unique_codes(texts: Iterable[str]) -> Tuple[List[str], ndarray]:
+    """The distinct texts, and the position of each text among them
+
+    Predict the distinct texts only, then index the `Predictions` with the
+    codes to get a row per text: `predict(uniques)[codes]`. A dict rather
+    than `pd.factorize`, which hashes strings as C strings and would merge
+    texts that only differ after a "\x00".
+
+    Returns:
+        Tuple[List[str], ndarray]: The distinct texts in order of first
+          appearance, and the int64 codes
+    """
+    positions = {}
+    codes = fromiter(
+        (positions.setdefault(text, len(positions)) for text in texts), dtype=int64
+    )
+    return list(positions), codes
+
+
+def percent(scores: ndarray) -> ndarray:
+    """Scores as rounded percentages, 0 to 100 in a uint8 each"""
+    # In float64, like `round(float(score) * 100)` was
+    return rint(asarray(scores, dtype=float64) * 100).astype(uint8)
+
+
+class Predictions:
+    """Label scores of many texts, as a matrix
+
+    Holds a (n_texts, n_labels) float32 matrix of scores and the array of
+    label names, instead of a dict per text and label. The argmax / top-k
+    are computed on the whole matrix at once, and the list of
+    {"label", "score"} dicts of the huggingface pipelines is only built for
+    the rows asked for (`row`, `to_dicts`, indexing and iterating).
+
+    Args:
+        scores (ndarray): The (n_texts, n_labels) scores, cast to float32
+        labels (Sequence[str]): The name of each column
+        top (Tuple[ndarray, ndarray], optional): The best label columns of
+          each text and their scores, best first, eg: from the TopK node of
+          `model_prep.add_postprocessing`. Used instead of sorting scores
+          when they have enough columns.
+    """
+
+    def __init__(
+        self,
+        scores: ndarray,
+        labels: Sequence[str],
+        top: Optional[Tuple[ndarray, ndarray]] = None,
+    ):
+        scores = asarray(scores, dtype=float32)
+        labels = asarray(labels, dtype=object)
+        if scores.ndim != 2 or scores.shape[1] != len(labels):
+            raise ValueError(
+                f"Scores of shape {scores.shape} do not fit {len(labels)} labels"
+            )
+        if top is not None:
+            top = (asarray(top[0], dtype=int64), asarray(top[1], dtype=float32))
+            if top[0].shape != top[1].shape or len(top[0]) != len(scores):
+                raise ValueError("The top labels do not fit the scores")
+        self.scores = scores
+        self.labels = labels
+        self.top = top
+
+    @classmethod
+    def concat(
+        cls,
+        predictions: Sequence["Predictions"],
+        labels: Optional[Sequence[str]] = None,
+    ) -> "Predictions":
+        """Stack the predictions of several batches, in order
+
+        Args:
+            predictions (Sequence[Predictions]): The batches
+            labels (Sequence[str], optional): The labels, needed when there
+              are no batches (eg: an empty upload) to give a (0, n_labels)
+              matrix. Defaults to those of the first batch.
+
+        Raises:
+            ValueError: If there are neither batches nor `labels`
+        """
+        if not predictions:
+            if labels is None:
+                raise ValueError("Nothing to concatenate")
+            return cls(empty((0, len(labels)), dtype=float32), labels)
+        labels = predictions[0].labels
+        top = None
+        if all(p.top is not None for p in predictions):
+            width = min(p.top[0].shape[1] for p in predictions)
+            top = tuple(
+                concatenate([p.top[i][:, :width] for p in predictions])
+                for i in range(2)
+            )
+        return cls(concatenate([p.scores for p in predictions]), labels, top)
+
+    def __len__(self) -> int:
+        return self.scores.shape[0]
+
+    def __getitem__(self, key: Union[int, slice, Sequence[int], ndarray]):
+        """The dicts of a row, or the `Predictions` of several rows"""
+        if isinstance(key, Integral):
+            return self.row(int(key))
+        top = None if self.top is None else (self.top[0][key], self.top[1][key])
+        return Predictions(self.scores[key], self.labels, top)
+
+    def __iter__(self) -> Iterator[List[Dict[str, Any]]]:
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def argmax(self) -> ndarray:
+        """Column of the best label of each text"""
+        if self.top is not None and self.top[0].shape[1]:
+            return self.top[0][:, 0]
+        return self.scores.argmax(axis=1)
+
+    def max_labels(self) -> ndarray:
+        """Name of the best label of each text"""
+        return self.labels[self.argmax()]
+
+    def max_scores(self) -> ndarray:
+        """Score of the best label of each text"""
+        if self.top is not None and self.top[1].shape[1]:
+            return self.top[1][:, 0]
+        return self.scores.max(axis=1)
+
+    def confidence(self) -> ndarray:
+        """Score of the best label as a rounded percentage, eg: 87"""
+        return percent(self.max_scores())
+
+    def top_k(self, k: int) -> Tuple[ndarray, ndarray]:
+        """The `k` best labels of each text, best first
+
+        Slices `top` when it has enough columns, and otherwise uses
+        `argpartition`, so only the `k` best scores of each row are sorted.
+
+        Returns:
+            Tuple[ndarray, ndarray]: The (n_texts, k) label columns and
+              their scores
+        """
+        n_labels = self.scores.shape[1]
+        k = min(k, n_labels)
+        if self.top is not None and k <= self.top[0].shape[1]:
+            return self.top[0][:, :k], self.top[1][:, :k]
+        if k == 1:
+            # Same as `argmax` when labels tie
+            columns = self.argmax()[:, None]
+            return columns, take_along_axis(self.scores, columns, axis=1)
+        if k < n_labels:
+            columns = argpartition(-self.scores, k - 1, axis=1)[:, :k]
+        else:
+            columns = broadcast_to(arange(n_labels), self.scores.shape)
+        scores = take_along_axis(self.scores, columns, axis=1)
+        order = argsort(-scores, axis=1, kind="stable")
+        columns = take_along_axis(columns, order, axis=1)
+        return columns, take_along_axis(scores, order, axis=1)
+
+    def row(self, i: int, sort: bool = False) -> List[Dict[str, Any]]:
+        """One text's {"label", "score"} dicts, in label order or best first"""
+        scores = self.scores[i]
+        columns = argsort(-scores, kind="stable") if sort else range(len(scores))
+        return [
+            {"label": self.labels[column], "score": float(scores[column])}
+            for column in columns
+        ]
+
+    def to_dicts(self, sort: bool = False) -> List[List[Dict[str, Any]]]:
+        """The output of the huggingface classification pipeline"""
+        return [self.row(i, sort) for i in range(len(self))]
+
+    def max_dicts(self) -> List[Dict[str, Any]]:
+        """The best {"label", "score"} of each text"""
+        return [
+            {"label": label, "score": float(score)}
+            for label, score in zip(self.max_labels(), self.max_scores())
+        ]
+
+    def label_table(self) -> pd.DataFrame:
+        """The "label_id" and "label" of each column, to look up label ids"""
+        return pd.DataFrame(
+            {"label_id": arange(len(self.labels), dtype=int16), "label": self.labels}
+        )
+
+    def output_frame(
+        self,
+        mode: str = "max",
+        k: int = 3,
+        as_percent: bool = True,
+        label_ids: bool = False,
+        prefix: str = OUTPUT_PREFIX,
+        index: Optional[pd.Index] = None,
+    ) -> pd.DataFrame:
+        """The predictions as columns for a bulk upload
+
+        - "max": "<prefix>_pred" and "<prefix>_pred_confidence", the best
+          label and its score
+        - "top_k": the same for the `k` best labels, with "_2", "_3", ...
+          after "pred" for the second best and so on
+        - "scores": "max", plus a "<prefix>_score_<label>" column per label
+
+        The columns are made from the arrays, not from the dicts of each
+        text. Labels are categoricals (written out as their names), or the
+        int16 ids of `label_table` with `label_ids`. Scores are uint8
+        percentages, or the float32 scores without `as_percent`.
+
+        Args:
+            mode (str, optional): "max", "top_k" or "scores". Defaults to "max".
+            k (int, optional): Labels per text in "top_k" mode. Defaults to 3.
+            as_percent (bool, optional): Defaults to True.
+            label_ids (bool, optional): Defaults to False.
+            prefix (str, optional): Defaults to `OUTPUT_PREFIX`.
+            index (pd.Index, optional): Index of the frame, eg: the uploaded
+              column's
+
+        Returns:
+            pd.DataFrame: A row per text
+        """
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f"mode must be one of {OUTPUT_MODES}")
+        columns, scores = self.top_k(k if mode == "top_k" else 1)
+        output = {}
+        for rank in range(columns.shape[1]):
+            name = f"{prefix}_pred" if rank == 0 else f"{prefix}_pred_{rank + 1}"
+            output[name] = self._label_column(columns[:, rank], label_ids)
+            output[f"{name}_confidence"] = self._score_column(
+                scores[:, rank], as_percent
+            )
+        if mode == "scores":
+            for column, label in enumerate(self.labels):
+                output[f"{prefix}_score_{label}"] = self._score_column(
+                    self.scores[:, column], as_percent
+                )
+        return pd.DataFrame(output, index=index)
+
+    def _label_column(self, columns: ndarray, label_ids: bool):
+        if label_ids:
+            return columns.astype(int16)
+        return pd.Categorical.from_codes(columns, categories=self.labels)
+
+    def _score_column(self, scores: ndarray, as_percent: bool) -> ndarray:
+        return percent(scores) if as_percent else scores.astype(float32)
@@ -0,0 +1,137 @@
+import json
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Union
+
+import pandas as pd
+
+REPORT_COLUMNS = [
+    "stage",
+    "description",
+    "priority",
+    "pattern",
+    "invocations",
+    "texts_changed",
+    "total_seconds",
+    "mean_microseconds",
+]
+SORT_KEYS = ["total_seconds", "invocations", "texts_changed"]
+
+
+class RuleProfiler:
+    """Time spent in, and texts changed by, each cleaning rule
+
+    Pass one to `cleaning_utils.cleaner(text, profiler=...)`: every rule it
+    applies is timed and counted. Rules are told apart by identity, so two
+    rules sharing a description get a row each. Rules that are `register`ed
+    but never change a text show up with `texts_changed == 0`.
+
+    Args:
+        clock (Callable[[], float], optional): Returns the current time in
+          seconds. Defaults to `time.perf_counter`.
+    """
+
+    def __init__(self, clock: Callable[[], float] = perf_counter):
+        self.clock = clock
+        self.texts = 0
+        self._rows: Dict[int, Dict[str, Any]] = {}
+
+    def _row(self, rule: Any, stage: str) -> Dict[str, Any]:
+        row = self._rows.get(id(rule))
+        if row is None:
+            row = self._rows[id(rule)] = {
+                "stage": stage,
+                "description": rule.description,
+                "priority": getattr(rule, "priority", None),
+                "pattern": rule.regex_str,
+                "invocations": 0,
+                "texts_changed": 0,
+                "total_seconds": 0.0,
+                # Keeps the rule (and so its id) alive as long as the row
+                "rule": rule,
+            }
+        return row
+
+    def register(self, rules: Iterable[Any], stage: str):
+        """Add rules to the report before they run
+
+        Args:
+            rules (Iterable[Any]): Objects with `description` and `regex_str`
+              (and optionally `priority`), eg: `RegexSubstitution`
+            stage (str): Where the rules run, eg: "substitution"
+        """
+        for rule in rules:
+            self._row(rule, stage)
+
+    def record(self, rule: Any, stage: str, seconds: float, changed: bool):
+        """Count one application of a rule to a text"""
+        row = self._row(rule, stage)
+        row["invocations"] += 1
+        row["texts_changed"] += changed
+        row["total_seconds"] += seconds
+
+    def reset(self):
+        """Forget every measurement (registered rules stay, at zero)"""
+        self.texts = 0
+        for row in self._rows.values():
+            row["invocations"] = row["texts_changed"] = 0
+            row["total_seconds"] = 0.0
+
+    def report(self, sort_by: str = "total_seconds") -> pd.DataFrame:
+        """One row per rule, most expensive (or busiest) first
+
+        Args:
+            sort_by (str, optional): One of `SORT_KEYS`. Defaults to
+              "total_seconds".
+
+        Returns:
+            pd.DataFrame: `REPORT_COLUMNS` for each rule
+        """
+        if sort_by not in SORT_KEYS:
+            raise ValueError(f"sort_by must be one of {SORT_KEYS}, got {sort_by!r}")
+        report = pd.DataFrame(
+            [
+                {k: v for k, v in row.items() if k != "rule"}
+                for row in self._rows.values()
+            ],
+            columns=REPORT_COLUMNS[:-1],
+        )
+        calls = report["invocations"].where(report["invocations"] > 0)
+        report["mean_microseconds"] = (report["total_seconds"] / calls * 1e6).fillna(0)
+        # Stable sort, so ties keep the order the rules run in
+        return report.sort_values(
+            sort_by, ascending=False, kind="mergesort"
+        ).reset_index(drop=True)
+
+    def dead_rules(self) -> List[str]:
+        """Descriptions of the rules that never changed a text"""
+        return [
+            row["description"]
+            for row in self._rows.values()
+            if row["texts_changed"] == 0
+        ]
+
+    def dump(self, path: Union[str, Path], sort_by: str = "total_seconds") -> Path:
+        """Write `report` to a ".csv" or ".json" file
+
+        The JSON file also holds the number of texts profiled.
+
+        Args:
+            path (Union[str, Path]): Where to write, the suffix picks the format
+            sort_by (str, optional): See `report`
+
+        Returns:
+            Path: The file written
+        """
+        path = Path(path)
+        report = self.report(sort_by)
+        suffix = path.suffix.lower()
+        if suffix == ".csv":
+            report.to_csv(path, index=False)
+        elif suffix == ".json":
+            rules = json.loads(report.to_json(orient="records"))
+            payload = {"texts": self.texts, "rules": rules}
+            path.write_text(json.dumps(payload, indent=2))
+        else:
+            raise ValueError(f"Unsupported report format {suffix!r}, use .csv or .json")
+        return path
@@ -0,0 +1,138 @@
+import math
+import sys
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+import pandas as pd
+
+from cleaning_utils import RegexRemoval, RegexSubstitution, removals, substitutions
+from rule_analysis import ComplexPattern, required_literals, word_vocabulary
+
+Rule = Union[RegexSubstitution, RegexRemoval]
+
+# Building blocks repeated up to the target length. Dirty court data has long
+# runs of spaces / punctuation and chains of abbreviations, which is what
+# makes `sep` and the optional chains (eg: `in?t?e?n?t?`) backtrack.
+ADVERSARIAL_UNITS = [" ", "/", "- ", ". ", "w ", "w/", "w/ ", "a", "1,", "'s "]
+SIZES = (1000, 2000, 4000)
+# Doubling the input of a linear rule doubles its time (growth 1), a
+# quadratic one quadruples it (growth 2)
+SUPERLINEAR_GROWTH = 1.5
+# Below this, timings are too noisy to say anything about growth
+MIN_SECONDS = 1e-3
+
+
+def _rule_words(rule: Rule) -> List[str]:
+    """A few words the rule matches or needs, to pump the inputs with"""
+    try:
+        words = word_vocabulary(rule.regex_str, rule.flags) or set()
+    except ComplexPattern:
+        words = set()
+    words |= required_literals(rule.regex_str) or set()
+    words = {word for word in words if word.strip()}
+    # Shortest first: near misses of long chains are built from prefixes
+    return sorted(words, key=lambda word: (len(word), word))[:3]
+
+
+def adversarial_inputs(rule: Rule, length: int) -> Dict[str, str]:
+    """Inputs of about `length` characters that stress a rule
+
+    Returns:
+        Dict[str, str]: Each input, keyed by the unit it repeats
+    """
+    units = list(ADVERSARIAL_UNITS)
+    for word in _rule_words(rule):
+        units += [
+            f"{word} ",
+            f"{word}/",
+            f"{word} - ",
+            # Near miss: every prefix of the word, then a non-match
+            "".join(word[:i] for i in range(1, len(word) + 1)) + " ",
+        ]
+    inputs = {}
+    for unit in units:
+        inputs[unit] = (unit * (length // len(unit) + 1))[:length]
+    # One match candidate followed by a long run of separators
+    for word in _rule_words(rule):
+        inputs[f"{word} + spaces"] = word + " " * length + "x"
+        inputs[f"{word} + punctuation"] = word + "/ -." * (length // 4) + "x"
+    return inputs
+
+
+def time_rule(rule: Rule, text: str, repeat: int = 3) -> float:
+    """Best time, in seconds, of applying a rule to a text"""
+    replacement = getattr(rule, "replacement", " ")
+    best = math.inf
+    for _ in range(repeat):
+        start = perf_counter()
+        rule.regex.sub(replacement, text)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def audit_rule(
+    rule: Rule, sizes: Sequence[int] = SIZES, repeat: int = 3
+) -> Dict[str, object]:
+    """Time a rule on adversarial inputs of growing sizes
+
+    The growth of an input is the exponent `k` in `time ~ length ** k`
+    between the two largest sizes. The input with the worst time at the
+    largest size is reported.
+
+    Returns:
+        Dict[str, object]: "description", "pattern", "worst_input",
+          "seconds" (at the largest size), "growth" and "superlinear"
+    """
+    worst = None
+    for name in adversarial_inputs(rule, sizes[-1]):
+        times = []
+        for size in sizes[-2:]:
+            text = adversarial_inputs(rule, size)[name]
+            times.append(time_rule(rule, text, repeat))
+        growth = math.log(
+            max(times[1], 1e-9) / max(times[0], 1e-9), sizes[-1] / sizes[-2]
+        )
+        if worst is None or times[1] > worst["seconds"]:
+            worst = {"worst_input": name, "seconds": times[1], "growth": growth}
+    superlinear = (
+        worst["seconds"] >= MIN_SECONDS and worst["growth"] >= SUPERLINEAR_GROWTH
+    )
+    return {
+        "description": rule.description,
+        "pattern": rule.regex_str,
+        **worst,
+        "superlinear": superlinear,
+    }
+
+
+def audit_rules(
+    rules: Optional[Iterable[Rule]] = None,
+    sizes: Sequence[int] = SIZES,
+    repeat: int = 3,
+) -> pd.DataFrame:
+    """Worst-case timings of every rule, slowest first
+
+    Args:
+        rules (Iterable[Rule], optional): Defaults to the substitutions and
+          removals in `cleaning_utils`
+        sizes (Sequence[int], optional): Input lengths, growth is measured
+          between the last two. Defaults to `SIZES`.
+        repeat (int, optional): Timings per input, the best is kept.
+          Defaults to 3.
+
+    Returns:
+        pd.DataFrame: One `audit_rule` row per rule
+    """
+    if rules is None:
+        rules = substitutions + removals
+    report = pd.DataFrame([audit_rule(rule, sizes, repeat) for rule in rules])
+    return report.sort_values("seconds", ascending=False).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    # python regex_audit.py [report.csv]
+    report = audit_rules()
+    print(report.head(20).to_string())
+    print(f"{report['superlinear'].sum()} superlinear rules")
+    if len(sys.argv) > 1:
+        report.to_csv(sys.argv[1], index=False)
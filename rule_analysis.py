@@ -0,0 +1,425 @@
+"""Static analysis of the cleaning regexes.
+
+The cleaner applies hundreds of `RegexSubstitution` rules one after another.
+Most of them are simple word-level rewrites (``\\bcntrl\\b`` → "controlled"),
+and two such rules can only influence each other when they share a word. The
+helpers here work out which words a rule can possibly match so that
+`cleaning_utils.CleanerEngine` can run independent rules in a single pass
+without changing the output of `cleaning_utils.cleaner`.
+"""
+import re
+from dataclasses import dataclass
+from typing import FrozenSet, List, Optional, Set
+
+try:  # Python 3.11+
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # pragma: no cover - Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Upper bound on the number of distinct strings enumerated for a single rule.
+# Anything larger is treated as a complex rule and is never merged.
+MAX_ENUMERATED = 4096
+
+# Placeholders used while enumerating a pattern's language
+_SEP = " "  # any run of non-word characters
+_BOUNDARY = "\x00"  # a `\b` assertion
+
+_WORD_CHAR = re.compile(r"\w")
+_WORDS = re.compile(r"\w+")
+
+_NON_WORD_CATEGORIES = {
+    sre_constants.CATEGORY_NOT_WORD,
+    sre_constants.CATEGORY_SPACE,
+}
+
+
+class ComplexPattern(Exception):
+    """Raised when a pattern cannot be reduced to a finite set of words"""
+
+
+def _is_word_char(char: str) -> bool:
+    return bool(_WORD_CHAR.match(char))
+
+
+def _literal(code: int) -> str:
+    char = chr(code)
+    if not char.isascii():
+        # Case-insensitive matching of non-ASCII letters has its own
+        # equivalences (eg: "ſ" ~ "s") that we do not try to model
+        raise ComplexPattern(f"non-ascii literal {char!r}")
+    return char.lower() if _is_word_char(char) else _SEP
+
+
+def _concat(left: Set[str], right: Set[str]) -> Set[str]:
+    result = set()
+    for a in left:
+        for b in right:
+            joined = a + b
+            # Collapse runs of separators so that equivalent strings dedupe
+            while _SEP + _SEP in joined:
+                joined = joined.replace(_SEP + _SEP, _SEP)
+            result.add(joined)
+    if len(result) > MAX_ENUMERATED:
+        raise ComplexPattern("too many alternatives")
+    return result
+
+
+def _enumerate_in(items) -> Set[str]:
+    chars = set()
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            chars.add(_literal(av))
+        elif op == sre_constants.CATEGORY and av in _NON_WORD_CATEGORIES:
+            chars.add(_SEP)
+        elif op == sre_constants.RANGE and av[1] - av[0] < 16:
+            chars.update(_literal(code) for code in range(av[0], av[1] + 1))
+        else:
+            raise ComplexPattern(f"character set item {op}")
+    return chars
+
+
+def _enumerate(items) -> Set[str]:
+    strings = {""}
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            options = {_literal(av)}
+        elif op == sre_constants.IN:
+            options = _enumerate_in(av)
+        elif op == sre_constants.AT and av == sre_constants.AT_BOUNDARY:
+            options = {_BOUNDARY}
+        elif op == sre_constants.SUBPATTERN:
+            options = _enumerate(av[-1])
+        elif op == sre_constants.BRANCH:
+            options = set()
+            for alternative in av[1]:
+                options |= _enumerate(alternative)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, high, item = av
+            body = _enumerate(item)
+            if high == sre_constants.MAXREPEAT:
+                # Unbounded repeats are only understood for separators
+                if body != {_SEP}:
+                    raise ComplexPattern("unbounded repeat")
+                options = {_SEP} if low else {"", _SEP}
+            else:
+                options = set()
+                repeated = {""}
+                for count in range(high + 1):
+                    if count >= low:
+                        options |= repeated
+                    if count < high:
+                        repeated = _concat(repeated, body)
+        else:
+            raise ComplexPattern(f"unsupported opcode {op}")
+        strings = _concat(strings, options)
+    return strings
+
+
+def _resolve_boundaries(string: str) -> Optional[str]:
+    """Check the `\\b` markers of one enumerated string and strip them
+
+    Returns None if a marker sits between two characters of the same kind,
+    which means this alternative can never match (eg: `w\\bin`).
+    """
+    chars = []
+    for i, char in enumerate(string):
+        if char != _BOUNDARY:
+            chars.append(char)
+            continue
+        before = chars[-1] if chars else None
+        after = next((c for c in string[i + 1 :] if c != _BOUNDARY), None)
+        if before is not None and after is not None:
+            if _is_word_char(before) == _is_word_char(after):
+                return None
+    return "".join(chars)
+
+
+def _word_aligned(string: str) -> bool:
+    """Whether a match must start and end on a `\\b` next to a word character"""
+    return (
+        string.startswith(_BOUNDARY)
+        and string.endswith(_BOUNDARY)
+        and _is_word_char(string.strip(_BOUNDARY)[:1] or _SEP)
+        and _is_word_char(string.strip(_BOUNDARY)[-1:] or _SEP)
+    )
+
+
+def _aligned_matches(pattern: str, flags: int) -> Optional[Set[str]]:
+    """Every string a word-aligned pattern can match, with separators
+    normalised to a single space, or None if the pattern is not understood"""
+    try:
+        strings = _enumerate(sre_parse.parse(pattern, flags))
+    except ComplexPattern:
+        return None
+    matches = set()
+    for string in strings:
+        resolved = _resolve_boundaries(string)
+        if resolved is None:
+            continue
+        if not _word_aligned(string):
+            return None
+        matches.add(resolved)
+    return matches or None
+
+
+def word_vocabulary(
+    pattern: str, flags: int = re.IGNORECASE
+) -> Optional[FrozenSet[str]]:
+    """Find every (lowercased) word a pattern can match
+
+    Only "word aligned" patterns are understood: every match must start and
+    end on a `\\b` next to a word character, and the pattern may only use
+    literals, separators (spaces / `\\W`), `\\b` and bounded repeats.
+
+    Args:
+        pattern (str): The regular expression
+        flags (int, optional): Flags used to compile the pattern.
+          Defaults to re.IGNORECASE.
+
+    Returns:
+        Optional[FrozenSet[str]]: The words any match is made of, or None
+          if the pattern is too complex to analyse.
+    """
+    matches = _aligned_matches(pattern, flags)
+    if matches is None:
+        return None
+    return frozenset(word for match in matches for word in _WORDS.findall(match))
+
+
+def literal_words(pattern: str, flags: int = re.IGNORECASE) -> Optional[FrozenSet[str]]:
+    """The words matched by a pure word alternation (eg: `\\b(?:cntrl|cntrld)\\b`)
+
+    Returns None unless every match of the pattern is exactly one whole word.
+    """
+    matches = _aligned_matches(pattern, flags)
+    if matches is None or not all(_WORDS.fullmatch(m) for m in matches):
+        return None
+    return frozenset(matches)
+
+
+def matched_phrases(
+    pattern: str, flags: int = re.IGNORECASE
+) -> Optional[FrozenSet[str]]:
+    """Every (lowercased) phrase a word aligned pattern can match, with any
+    run of separators written as a single space (eg: "w i" for `\\bw{sep}i\\b`)
+
+    Returns None if the pattern is too complex to analyse.
+    """
+    matches = _aligned_matches(pattern, flags)
+    return None if matches is None else frozenset(matches)
+
+
+def replacement_words(replacement: str) -> Optional[FrozenSet[str]]:
+    """Words written out by a replacement string
+
+    Returns None for replacements that are templates (backreferences,
+    escapes) or that contain no word at all, since those can join or split
+    the words around them.
+    """
+    if "\\" in replacement:
+        return None
+    words = frozenset(w.lower() for w in _WORDS.findall(replacement))
+    return words or None
+
+
+def _selectivity(options: FrozenSet[str]):
+    # Prefer sets whose shortest literal is longest, then smaller sets
+    return (min(len(option) for option in options), -len(options))
+
+
+def _required(items) -> Optional[FrozenSet[str]]:
+    candidates = []
+    run = ""
+    for op, av in items:
+        if op == sre_constants.LITERAL and chr(av).isascii():
+            run += chr(av).lower()
+            continue
+        if op in (
+            sre_constants.AT,
+            sre_constants.ASSERT,
+            sre_constants.ASSERT_NOT,
+        ):
+            # Zero-width, the literals on either side stay next to each other
+            continue
+        if run:
+            candidates.append(frozenset([run]))
+            run = ""
+        if op == sre_constants.SUBPATTERN:
+            candidates.append(_required(av[-1]))
+        elif op == sre_constants.BRANCH:
+            alternatives = [_required(alternative) for alternative in av[1]]
+            if all(alternatives):
+                candidates.append(frozenset().union(*alternatives))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0]:
+            candidates.append(_required(av[2]))
+    if run:
+        candidates.append(frozenset([run]))
+    candidates = [c for c in candidates if c]
+    if not candidates:
+        return None
+    return max(candidates, key=_selectivity)
+
+
+def required_literals(
+    pattern: str, flags: int = re.IGNORECASE
+) -> Optional[FrozenSet[str]]:
+    """Literals of which at least one appears in every match of a pattern
+
+    For example `\\bsol(?: +|\\W+|\\b)cds\\b` requires "sol" (or "cds") and
+    `\\b(?:sub|subs|subst)\\b` requires one of "sub", "subs" or "subst". The
+    literals are lowercased, so they should be looked up in lowercased ASCII
+    text (see `literal_words` for why non-ASCII text is different).
+
+    Args:
+        pattern (str): The regular expression
+        flags (int, optional): Flags used to compile the pattern.
+          Defaults to re.IGNORECASE.
+
+    Returns:
+        Optional[FrozenSet[str]]: The literals, or None if the pattern has no
+          literal every match must contain.
+    """
+    return _required(sre_parse.parse(pattern, flags))
+
+
+def lowercase_pattern(pattern: str) -> str:
+    """Lowercase the literals of a pattern, leaving escapes (eg: `\\W`) alone
+
+    Matching the result case-sensitively against lowercased ASCII text finds
+    the same matches as matching the original pattern with `re.IGNORECASE`
+    against the original text.
+    """
+    chars = []
+    escaped = False
+    for char in pattern:
+        chars.append(char if escaped else char.lower())
+        escaped = not escaped and char == "\\"
+    return "".join(chars)
+
+
+def _uses_whitespace_class(items) -> bool:
+    for op, av in items:
+        if op == sre_constants.IN:
+            if any(
+                item_op == sre_constants.CATEGORY
+                and item_av
+                in (sre_constants.CATEGORY_SPACE, sre_constants.CATEGORY_NOT_SPACE)
+                for item_op, item_av in av
+            ):
+                return True
+        elif op == sre_constants.BRANCH:
+            if any(_uses_whitespace_class(alternative) for alternative in av[1]):
+                return True
+        elif op in (
+            sre_constants.SUBPATTERN,
+            sre_constants.ASSERT,
+            sre_constants.ASSERT_NOT,
+        ):
+            if _uses_whitespace_class(av[-1]):
+                return True
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if _uses_whitespace_class(av[2]):
+                return True
+    return False
+
+
+def ascii_safe(pattern: str, flags: int = 0) -> bool:
+    """Whether compiling a pattern with `re.ASCII` keeps its matches on ASCII text
+
+    `\\w`, `\\d` and `\\b` agree on ASCII text either way, but Unicode `\\s`
+    also matches the ASCII separators "\\x1c" to "\\x1f". Patterns with
+    non-ASCII literals are not considered safe either.
+    """
+    if not pattern.isascii():
+        return False
+    return not _uses_whitespace_class(sre_parse.parse(pattern, flags))
+
+
+@dataclass(frozen=True)
+class RuleProfile:
+    """What the analysis knows about one substitution rule
+
+    Attributes:
+        vocabulary: `word_vocabulary` of the pattern
+        outputs: `replacement_words` of the replacement
+        literal: Whether every match is a single whole word, in which case
+          the rule can be applied with a dictionary lookup per word
+        required: `required_literals` of the pattern
+    """
+
+    vocabulary: Optional[FrozenSet[str]]
+    outputs: Optional[FrozenSet[str]]
+    literal: bool = False
+    required: Optional[FrozenSet[str]] = None
+
+    @property
+    def word_aligned(self) -> bool:
+        return self.vocabulary is not None and self.outputs is not None
+
+
+def profile_rule(pattern: str, replacement: str) -> RuleProfile:
+    vocabulary = word_vocabulary(pattern)
+    return RuleProfile(
+        vocabulary=vocabulary,
+        outputs=replacement_words(replacement),
+        literal=vocabulary is not None and literal_words(pattern) is not None,
+        required=required_literals(pattern),
+    )
+
+
+def independent(earlier: RuleProfile, later: RuleProfile) -> bool:
+    """Whether a word-aligned rule can run in the same pass as an earlier one
+
+    A later rule is independent of an earlier one when it shares no word with
+    what the earlier rule matches and the earlier replacement does not
+    produce a word it matches. In that case, running both through one
+    alternation gives the same text as running them one after the other.
+    """
+    return (
+        earlier.word_aligned
+        and later.word_aligned
+        and not (later.vocabulary & earlier.vocabulary)
+        and not (later.vocabulary & earlier.outputs)
+    )
+
+
+def commute(first: RuleProfile, second: RuleProfile) -> bool:
+    """Whether two rules give the same text whichever one runs first"""
+    return independent(first, second) and independent(second, first)
+
+
+def plan_passes(profiles: List[RuleProfile]) -> List[List[int]]:
+    """Group a sequence of rules into as few passes as possible
+
+    Each rule joins the earliest pass of the same kind (literal or not) that
+    it is independent of, as long as it commutes with every rule in the
+    passes it has to jump over. Rules the analysis does not understand get a
+    pass of their own and nothing moves across them, so the result is always
+    the same as running the rules in their original order.
+
+    Args:
+        profiles (List[RuleProfile]): `profile_rule` of each rule, in the
+          order the rules run
+
+    Returns:
+        List[List[int]]: Indices of the rules in each pass, in pass order
+    """
+    passes: List[List[int]] = []
+    for i, profile in enumerate(profiles):
+        target = None
+        if profile.word_aligned:
+            for k in range(len(passes) - 1, -1, -1):
+                members = [profiles[j] for j in passes[k]]
+                if members[0].literal == profile.literal and all(
+                    independent(member, profile) for member in members
+                ):
+                    target = k
+                if not all(commute(member, profile) for member in members):
+                    break
+        if target is None:
+            passes.append([i])
+        else:
+            passes[target].append(i)
+    return passes
@@ -0,0 +1,183 @@
+import random
+import sys
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import pandas as pd
+
+from cleaning_utils import (
+    CleanerEngine,
+    RegexSubstitution,
+    dump_rules,
+    prep_text,
+    substitutions,
+)
+
+ACTIVE = "active"  # changed at least one text
+SHADOWED = "shadowed"  # matched some input, but earlier rules always got there first
+DEAD = "dead"  # never matched any input
+
+
+def rule_coverage(
+    texts: Sequence[Any], rules: Optional[List[RegexSubstitution]] = None
+) -> pd.DataFrame:
+    """Which rules change the texts when they go through `cleaner`
+
+    Each rule is applied in `cleaner` order. A rule that changed some text
+    is "active". A rule that never did is "shadowed" if it matches some
+    input on its own (after `prep_text`, before any substitution), and
+    "dead" otherwise.
+
+    Args:
+        texts (Sequence[Any]): The corpus, NaN / None are skipped
+        rules (List[RegexSubstitution], optional): Defaults to `substitutions`
+
+    Returns:
+        pd.DataFrame: One row per rule, in the order they run, with its
+          "description", "priority", "pattern", the number of texts it
+          "changed" and "matched" on its own, and its "status"
+    """
+    rules = sorted(substitutions if rules is None else rules, key=lambda s: s.priority)
+    changed = [0] * len(rules)
+    matched = [0] * len(rules)
+    for text in texts:
+        if pd.isnull(text):
+            continue
+        prepped = text = prep_text(text)
+        for i, rule in enumerate(rules):
+            if rule.regex.search(prepped) is not None:
+                matched[i] += 1
+            substituted = rule.regex.sub(rule.replacement, text)
+            if substituted != text:
+                changed[i] += 1
+                text = substituted
+    coverage = pd.DataFrame(
+        {
+            "description": [rule.description for rule in rules],
+            "priority": [rule.priority for rule in rules],
+            "pattern": [rule.regex_str for rule in rules],
+            "changed": changed,
+            "matched": matched,
+        }
+    )
+    coverage["status"] = DEAD
+    coverage.loc[coverage["matched"] > 0, "status"] = SHADOWED
+    coverage.loc[coverage["changed"] > 0, "status"] = ACTIVE
+    return coverage
+
+
+@dataclass
+class PruneResult:
+    """A pruned ruleset and how it compares with the full one
+
+    Attributes:
+        rules (List[RegexSubstitution]): The rules that are kept
+        coverage (pd.DataFrame): `rule_coverage` of the corpus they were
+          picked on
+        texts (int): Number of texts the two rulesets were compared on
+        differing (List[Dict[str, str]]): The "text", "full" and "pruned"
+          cleaned text, for each text that is cleaned differently
+        label_agreement (float, optional): Share of the differing texts
+          that still get the same label, if a `predict` function was given
+        full_passes (int): Number of passes of the full ruleset
+        pruned_passes (int): Number of passes of the pruned ruleset
+    """
+
+    rules: List[RegexSubstitution]
+    coverage: pd.DataFrame
+    texts: int
+    differing: List[Dict[str, str]]
+    label_agreement: Optional[float]
+    full_passes: int
+    pruned_passes: int
+
+    @property
+    def equivalence(self) -> float:
+        """Share of the compared texts cleaned exactly the same"""
+        return 1 - len(self.differing) / self.texts if self.texts else 1.0
+
+    def summary(self) -> Dict[str, Any]:
+        counts = self.coverage["status"].value_counts()
+        return {
+            "rules": len(self.coverage),
+            "kept": len(self.rules),
+            **{status: int(counts.get(status, 0)) for status in (SHADOWED, DEAD)},
+            "full_passes": self.full_passes,
+            "pruned_passes": self.pruned_passes,
+            "texts": self.texts,
+            "differing": len(self.differing),
+            "equivalence": self.equivalence,
+            "label_agreement": self.label_agreement,
+        }
+
+
+def prune_rules(
+    texts: Sequence[Any],
+    holdout: float = 0.2,
+    seed: int = 0,
+    predict: Optional[Callable[[List[str]], Sequence[Any]]] = None,
+) -> PruneResult:
+    """Drop the rules that never change a corpus, and measure what it costs
+
+    The corpus is split at random: rules that are not "active" on the first
+    part are dropped, and both rulesets then clean the `holdout` part. On the
+    texts the coverage was computed on, the pruned ruleset is equivalent by
+    construction, so only held out texts say anything about new data.
+
+    Args:
+        texts (Sequence[Any]): The corpus
+        holdout (float, optional): Share of the corpus kept for comparing the
+          rulesets. 0 compares them on the whole corpus. Defaults to 0.2.
+        seed (int, optional): Seed of the split. Defaults to 0.
+        predict (Callable[[List[str]], Sequence[Any]], optional): Gives the
+          label of each cleaned text, used to see whether the differences
+          matter to the model
+
+    Returns:
+        PruneResult: The pruned ruleset and the comparison
+    """
+    texts = [text for text in texts if not pd.isnull(text)]
+    order = list(range(len(texts)))
+    random.Random(seed).shuffle(order)
+    cut = len(texts) - int(len(texts) * holdout)
+    fit = [texts[i] for i in order[:cut]]
+    compare = [texts[i] for i in order[cut:]] if holdout else texts
+
+    full = sorted(substitutions, key=lambda s: s.priority)
+    coverage = rule_coverage(fit, full)
+    rules = [rule for rule, status in zip(full, coverage["status"]) if status == ACTIVE]
+
+    full_engine = CleanerEngine(full, lowercase=True)
+    pruned_engine = CleanerEngine(rules, lowercase=True)
+    differing = []
+    for text, expected, cleaned in zip(
+        compare, full_engine.clean_batch(compare), pruned_engine.clean_batch(compare)
+    ):
+        if cleaned != expected:
+            differing.append({"text": text, "full": expected, "pruned": cleaned})
+
+    label_agreement = None
+    if predict is not None and differing:
+        full_labels = predict([row["full"] for row in differing])
+        pruned_labels = predict([row["pruned"] for row in differing])
+        same = sum(a == b for a, b in zip(full_labels, pruned_labels))
+        label_agreement = same / len(differing)
+    return PruneResult(
+        rules,
+        coverage,
+        len(compare),
+        differing,
+        label_agreement,
+        len(full_engine.passes),
+        len(pruned_engine.passes),
+    )
+
+
+if __name__ == "__main__":
+    # python rule_coverage.py corpus.csv column fast-rules.json
+    corpus_path, column, pack_path = sys.argv[1:4]
+    result = prune_rules(pd.read_csv(corpus_path)[column].tolist())
+    for key, value in result.summary().items():
+        print(f"{key}: {value}")
+    # Load with `cleaning_utils.load_rules` or `ROTA_RULE_PACK=fast-rules.json`
+    dump_rules(pack_path, result.rules)
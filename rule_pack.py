@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+# Bump when the rule pack format changes
+RULE_PACK_VERSION = 1
+# Bump when the pass planning in `cleaning_utils` changes, so plans cached by
+# older code are not reused. Changes to `rule_analysis` and
+# `cleaning_utils._plan_rules` are also caught by `_planner_digest`.
+PLAN_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def flag_names(flags: int) -> Tuple[str, ...]:
+    """`re` flags as names, eg: ("IGNORECASE",)"""
+    return tuple(
+        flag.name for flag in re.RegexFlag if flag.value and flags & flag.value
+    )
+
+
+def flag_value(names: Iterable[str]) -> int:
+    """Inverse of `flag_names`"""
+    value = 0
+    for name in names:
+        value |= re.RegexFlag[name].value
+    return value
+
+
+def content_hash(records: List[Dict[str, Any]], version: int = PLAN_VERSION) -> str:
+    """SHA-256 of rule records (see `write_pack`) and a format version"""
+    payload = json.dumps(
+        {"version": version, "rules": records}, sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def write_pack(
+    path: Union[str, Path],
+    substitutions: List[Dict[str, Any]],
+    removals: List[Dict[str, Any]],
+) -> Path:
+    """Write a ruleset to a JSON rule pack
+
+    Args:
+        path (Union[str, Path]): The file to write
+        substitutions (List[Dict[str, Any]]): One record per substitution,
+          with "description", "pattern", "replacement", "priority" and
+          "flags" (see `flag_names`)
+        removals (List[Dict[str, Any]]): One record per removal, with
+          "description", "pattern" and "flags"
+
+    Returns:
+        Path: The file written
+    """
+    path = Path(path)
+    pack = {
+        "version": RULE_PACK_VERSION,
+        "hash": content_hash(substitutions + removals, RULE_PACK_VERSION),
+        "substitutions": substitutions,
+        "removals": removals,
+    }
+    path.write_text(json.dumps(pack, indent=2, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def read_pack(path: Union[str, Path]) -> Dict[str, Any]:
+    """Read a rule pack written by `write_pack`
+
+    Raises:
+        ValueError: If the pack is from another format version
+    """
+    pack = json.loads(Path(path).read_text(encoding="utf-8"))
+    if pack.get("version") != RULE_PACK_VERSION:
+        raise ValueError(
+            f"Rule pack {path} has version {pack.get('version')!r},"
+            f" expected {RULE_PACK_VERSION}"
+        )
+    return pack
+
+
+class PlanCache:
+    """Directory of pass plans computed by `cleaning_utils.CleanerEngine`
+
+    Planning the passes means analysing every rule, which takes much longer
+    than compiling them. Plans are plain JSON stored under the hash of the
+    rules they were made for (see `content_hash`) and of the planning code,
+    so an edited ruleset, edited planning or a new `PLAN_VERSION` simply
+    misses. Failing to read or write the cache, or a file that is not a
+    plan for the rules, is not an error: the plan is then computed as if it
+    was not there.
+
+    Args:
+        directory (Union[str, Path]): Where plans are stored, created on the
+          first write
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"plan-v{PLAN_VERSION}-{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self.path(key).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, plan: Dict[str, Any]):
+        path = self.path(key)
+        # Written to a temporary file first, so that processes starting at
+        # the same time never read a partial plan
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(plan), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+
+
+def default_plan_cache() -> Optional[PlanCache]:
+    """The plan cache in `ROTA_CACHE_DIR` (default: ~/.cache/rota)
+
+    It keeps the cleaning passes planned for each ruleset as "plan-*.json",
+    so that startup does not analyse every rule again. Setting
+    `ROTA_CACHE_DIR` to an empty string disables it, along with the
+    `prediction_cache.default_prediction_cache` kept there.
+    """
+    directory = os.environ.get(
+        "ROTA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rota")
+    )
+    return PlanCache(directory) if directory else None
@@ -0,0 +1,193 @@
+import json
+import os
+from dataclasses import dataclass, fields, replace
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+EXECUTION_MODES = ("sequential", "parallel")
+GRAPH_OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+OMP_WAIT_POLICIES = ("ACTIVE", "PASSIVE")
+# Settings of each field are read from ROTA_ORT_<FIELD NAME>
+ENV_PREFIX = "ROTA_ORT_"
+
+
+def available_cores(logical: bool = False) -> int:
+    """Number of CPUs this process may run on
+
+    Counts the CPUs of the process's affinity mask (what `taskset` and
+    container cpusets restrict) rather than all of the host's, and only
+    physical cores unless `logical`, going by the host's ratio of physical
+    to logical cores.
+    """
+    try:
+        usable = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS / Windows
+        usable = os.cpu_count() or 1
+    if logical:
+        return usable
+    try:
+        from psutil import cpu_count
+    except ImportError:
+        return usable
+    physical, total = cpu_count(logical=False), cpu_count(logical=True)
+    if not physical or not total:
+        return usable
+    return max(1, usable * physical // total)
+
+
+@dataclass
+class SessionProfile:
+    """How the ONNX Runtime session runs the model
+
+    Attributes:
+        intra_op_num_threads (int): Threads used within an operator, 0 lets
+          ONNX Runtime pick (one per physical core)
+        inter_op_num_threads (int): Threads running operators side by side,
+          only used in "parallel" `execution_mode`. 0 lets ONNX Runtime pick.
+        execution_mode (str): "sequential" or "parallel"
+        allow_spinning (bool): Whether idle threads busy-wait for work,
+          which lowers latency but uses CPU between requests
+        enable_cpu_mem_arena (bool): Whether to keep freed memory in an
+          arena for reuse
+        enable_mem_pattern (bool): Whether to plan allocations from the
+          previous runs, which only helps when input shapes repeat
+        disable_prepacking (bool): Whether to skip repacking weights into
+          the layout of the CPU kernels. Prepacked weights are a private
+          copy per session, so this saves memory when sessions of several
+          processes share memory-mapped weights, at some speed.
+        graph_optimization_level (str): "disable", "basic", "extended" or
+          "all"
+        omp_wait_policy (str): OMP_WAIT_POLICY for OpenMP builds of ONNX
+          Runtime, "ACTIVE" (spin) or "PASSIVE"
+    """
+
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+    execution_mode: str = "sequential"
+    allow_spinning: bool = False
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = False
+    disable_prepacking: bool = False
+    graph_optimization_level: str = "all"
+    omp_wait_policy: str = "PASSIVE"
+
+    def __post_init__(self):
+        for name, allowed in (
+            ("execution_mode", EXECUTION_MODES),
+            ("graph_optimization_level", GRAPH_OPTIMIZATION_LEVELS),
+            ("omp_wait_policy", OMP_WAIT_POLICIES),
+        ):
+            if getattr(self, name) not in allowed:
+                raise ValueError(f"{name} must be one of {allowed}")
+        if self.intra_op_num_threads < 0 or self.inter_op_num_threads < 0:
+            raise ValueError("Thread counts can not be negative")
+
+    @classmethod
+    def preset(cls, name: str = "auto") -> "SessionProfile":
+        """A profile for a kind of host
+
+        - "auto": all the usable physical cores, without spinning, which
+          suits a shared host or an app that is idle between requests
+        - "latency": all the usable physical cores, spinning, for a
+          dedicated host answering one coder at a time
+        - "throughput": for bulk jobs on a dedicated host, spinning, with
+          memory patterns since bulk batches repeat shapes
+        """
+        cores = available_cores()
+        if name == "auto":
+            return cls(intra_op_num_threads=cores)
+        if name == "latency":
+            return cls(
+                intra_op_num_threads=cores,
+                allow_spinning=True,
+                omp_wait_policy="ACTIVE",
+            )
+        if name == "throughput":
+            return cls(
+                intra_op_num_threads=cores,
+                allow_spinning=True,
+                enable_mem_pattern=True,
+                omp_wait_policy="ACTIVE",
+            )
+        raise ValueError(f"Unknown session profile {name!r}")
+
+    @classmethod
+    def load(
+        cls, path: Optional[Path] = None, env: Optional[Dict[str, str]] = None
+    ) -> "SessionProfile":
+        """The profile set by the environment and an optional config file
+
+        Settings are applied in this order, later ones winning:
+
+        1. The preset named by `ROTA_ORT_PROFILE` or else the file's
+           "profile" key (see `preset`, "auto" by default)
+        2. The other keys of the JSON file at `path` or `ROTA_ORT_CONFIG`,
+           eg: {"profile": "latency", "intra_op_num_threads": 4}
+        3. `ROTA_ORT_<FIELD>` variables, eg: `ROTA_ORT_ALLOW_SPINNING=0`
+
+        Args:
+            path (Path, optional): Defaults to `ROTA_ORT_CONFIG`, if set
+            env (Dict[str, str], optional): Defaults to `os.environ`
+
+        Returns:
+            SessionProfile: The profile
+        """
+        env = os.environ if env is None else env
+        if path is None and env.get(f"{ENV_PREFIX}CONFIG"):
+            path = Path(env[f"{ENV_PREFIX}CONFIG"])
+        settings = json.loads(Path(path).read_text()) if path is not None else {}
+        preset = settings.pop("profile", "auto")
+        preset = env.get(f"{ENV_PREFIX}PROFILE") or preset
+        names = {f.name for f in fields(cls)}
+        unknown = set(settings) - names
+        if unknown:
+            raise ValueError(f"Unknown session settings {sorted(unknown)}")
+        for name in names:
+            value = env.get(f"{ENV_PREFIX}{name.upper()}")
+            if value is not None:
+                settings[name] = value
+        profile = cls.preset(preset)
+        return replace(
+            profile, **{k: profile._parse(k, v) for k, v in settings.items()}
+        )
+
+    def _parse(self, name: str, value: Any) -> Any:
+        """A setting from a file or an environment variable, as its field type"""
+        kind = type(getattr(self, name))
+        if kind is bool and isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        return kind(value)
+
+    def set_environment(self):
+        """Set OpenMP's variables, unless already set. Must run before
+        onnxruntime is imported.
+        """
+        threads = self.intra_op_num_threads or available_cores()
+        os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+        os.environ.setdefault("OMP_WAIT_POLICY", self.omp_wait_policy)
+
+    def session_options(self):
+        """The profile as `onnxruntime.SessionOptions`"""
+        from onnxruntime import ExecutionMode, GraphOptimizationLevel, SessionOptions
+
+        options = SessionOptions()
+        options.intra_op_num_threads = self.intra_op_num_threads
+        options.inter_op_num_threads = self.inter_op_num_threads
+        options.execution_mode = {
+            "sequential": ExecutionMode.ORT_SEQUENTIAL,
+            "parallel": ExecutionMode.ORT_PARALLEL,
+        }[self.execution_mode]
+        options.graph_optimization_level = {
+            "disable": GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[self.graph_optimization_level]
+        options.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+        options.enable_mem_pattern = self.enable_mem_pattern
+        spinning = "1" if self.allow_spinning else "0"
+        options.add_session_config_entry("session.intra_op.allow_spinning", spinning)
+        options.add_session_config_entry("session.inter_op.allow_spinning", spinning)
+        if self.disable_prepacking:
+            options.add_session_config_entry("session.disable_prepacking", "1")
+        return options
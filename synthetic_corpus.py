@@ -0,0 +1,256 @@
+import math
+import random
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from cleaning_utils import RegexSubstitution, substitutions
+from rule_analysis import matched_phrases
+
+# Offense descriptions written out in full, as `cleaner` would output them.
+# "{slot}"s are filled from `SLOTS`.
+TEMPLATES = [
+    "possession of {drug}",
+    "possession of {drug} {schedule}",
+    "possession with intent to distribute {drug}",
+    "possession of {drug} {amount}",
+    "unlawful possession of a controlled substance",
+    "manufacturing distribution possession {drug}",
+    "distribution controlled substances within 1000 feet of {place}",
+    "solicitation of controlled substances",
+    "possession of paraphernalia",
+    "minor in possession of alcohol",
+    "aggravated assault with dangerous weapon",
+    "assault {degree}",
+    "assault and battery on a law enforcement officer",
+    "sexual assault {degree}",
+    "criminal sexual conduct {degree}",
+    "child molestation {degree}",
+    "burglary {degree}",
+    "breaking and entering {place}",
+    "robbery with firearm",
+    "attempted robbery",
+    "murder {degree}",
+    "terrorism threats",
+    "domestic violence",
+    "violation of domestic violence protective order",
+    "driving while license suspended",
+    "driving while license revoked",
+    "driving under the influence of alcohol",
+    "reckless driving",
+    "failure to yield",
+    "retail theft under $500",
+    "receiving stolen property",
+    "embezzlement of funds",
+    "credit card fraud",
+    "false report to law enforcement officer",
+    "obstruction of law enforcement",
+    "violation of probation",
+    "probation revocation",
+    "contempt of court",
+    "disturbing the peace",
+    "indecent exposure",
+    "neglect of child",
+    "prostitution",
+    "unlawful possession of firearm by felon",
+    "carrying concealed weapon",
+]
+SLOTS = {
+    "drug": [
+        "cocaine",
+        "marijuana",
+        "methamphetamine",
+        "hydrocodone",
+        "ecstasy",
+        "controlled substance",
+        "crack or cocaine",
+        "rohypnol",
+    ],
+    "schedule": [
+        "schedule one",
+        "schedule two",
+        "schedule three",
+        "schedule four",
+        "schedule five",
+    ],
+    "degree": ["first degree", "second degree", "third degree"],
+    "place": ["school", "park", "residence", "building", "motor vehicle"],
+    "amount": ["{n} grams", "{n} ounces", "{n} pounds", "small amount"],
+    "ordinal": ["first", "second", "third", "fourth", "fifth"],
+}
+# Added before / after a template until the text reaches its length
+PREFIXES = ["attempted", "conspiracy to commit", "felony", "misdemeanor"]
+SUFFIXES = [
+    "{ordinal} offense",
+    "{n} counts",
+    "subsequent offense",
+    "with prior conviction",
+    "{degree}",
+    "within 1000 feet of {place}",
+    "{n} years of age",
+    "{statute}",
+]
+# Tries at making a text that is not a duplicate
+MAX_ATTEMPTS = 20
+# What runs of separators in abbreviations are written as
+SEPARATORS = [" ", " ", " ", "/", "-", ". ", ""]
+
+
+def abbreviation_table(
+    rules: Optional[List[RegexSubstitution]] = None,
+) -> Dict[Tuple[str, ...], List[str]]:
+    """The substitutions in reverse: the abbreviated forms of each phrase
+
+    Args:
+        rules (List[RegexSubstitution], optional): Defaults to `substitutions`
+
+    Returns:
+        Dict[Tuple[str, ...], List[str]]: For the words of each replacement,
+          the other phrases the rules rewrite to it (eg: ("controlled",) ->
+          ["cntrl", "cntrld", "contrlld"]), with separators as " "
+    """
+    table = {}
+    for rule in substitutions if rules is None else rules:
+        phrases = matched_phrases(rule.regex_str, rule.flags)
+        if not phrases:
+            continue
+        key = tuple(rule.replacement.lower().split())
+        variants = table.setdefault(key, set())
+        variants |= {phrase for phrase in phrases if tuple(phrase.split()) != key}
+    return {key: sorted(variants) for key, variants in table.items() if variants}
+
+
+def _fill(text: str, rng: random.Random) -> str:
+    """Fill the "{slot}"s of a template, including those in slot values"""
+    while "{" in text:
+        start = text.index("{")
+        end = text.index("}", start)
+        slot = text[start + 1 : end]
+        if slot == "n":
+            value = str(rng.choice([1, 2, 3, 5, 10, 28, 100, 500, 1000]))
+        elif slot == "statute":
+            value = f"{rng.randint(1, 99)}.{rng.randint(1, 99)}.{rng.randint(1, 999)}"
+        else:
+            value = rng.choice(SLOTS[slot])
+        text = text[:start] + value + text[end + 1 :]
+    return text
+
+
+def abbreviate(
+    text: str,
+    table: Dict[Tuple[str, ...], List[str]],
+    rng: random.Random,
+    rate: float = 0.7,
+) -> str:
+    """Replace phrases of a text with their abbreviations
+
+    The longest phrase of `table` starting at each word is replaced with
+    probability `rate` by one of its abbreviations, whose separators are
+    written as spaces, slashes, hyphens, dots or nothing.
+    """
+    longest = max(map(len, table), default=0)
+    words = text.split()
+    output = []
+    i = 0
+    while i < len(words):
+        for length in range(min(longest, len(words) - i), 0, -1):
+            key = tuple(words[i : i + length])
+            if key in table:
+                if rng.random() < rate:
+                    variant = rng.choice(table[key])
+                    output.append(rng.choice(SEPARATORS).join(variant.split()))
+                else:
+                    output.append(" ".join(key))
+                i += length
+                break
+        else:
+            output.append(words[i])
+            i += 1
+    return " ".join(output)
+
+
+def _offense(
+    rng: random.Random,
+    words: int,
+    table: Dict[Tuple[str, ...], List[str]],
+    abbreviation_rate: float,
+    upper_rate: float,
+) -> str:
+    text = _fill(rng.choice(TEMPLATES), rng)
+    while len(text.split()) < words:
+        if rng.random() < 0.3:
+            text = f"{_fill(rng.choice(PREFIXES), rng)} {text}"
+        else:
+            text = f"{text} {_fill(rng.choice(SUFFIXES), rng)}"
+    # Long descriptions get cut off, like fixed width fields do
+    text = " ".join(text.split()[:words])
+    text = abbreviate(text, table, rng, abbreviation_rate)
+    if rng.random() < upper_rate:
+        return text.upper()
+    return text.title() if rng.random() < 0.5 else text
+
+
+def synthetic_corpus(
+    size: int,
+    seed: int = 0,
+    median_words: float = 6,
+    max_words: int = 30,
+    duplicate_rate: float = 0.3,
+    abbreviation_rate: float = 0.7,
+    upper_rate: float = 0.8,
+) -> List[str]:
+    """Realistic looking offense descriptions, for benchmarks and load tests
+
+    Each text is a template (see `TEMPLATES`) padded with prefixes and
+    suffixes to a log-normally distributed number of words, cut at
+    `max_words`, with phrases abbreviated through `abbreviation_table` (eg:
+    "possession controlled substance within" -> "POSS CNTRL SUBST W/I").
+
+    Args:
+        size (int): Number of texts
+        seed (int, optional): Defaults to 0.
+        median_words (float, optional): Median number of words, before
+          abbreviating. Defaults to 6.
+        max_words (int, optional): Longest text, in words. Defaults to 30.
+        duplicate_rate (float, optional): Share of the texts that repeat an
+          earlier one (picked uniformly). Defaults to 0.3.
+        abbreviation_rate (float, optional): Probability of abbreviating a
+          phrase that can be. Defaults to 0.7.
+        upper_rate (float, optional): Share of the texts in upper case, the
+          others are title or lower case. Defaults to 0.8.
+
+    Returns:
+        List[str]: The texts
+    """
+    if not 0 <= duplicate_rate <= 1:
+        raise ValueError("duplicate_rate must be between 0 and 1")
+    rng = random.Random(seed)
+    table = abbreviation_table()
+    texts = []
+    seen = set()
+    for _ in range(size):
+        if texts and rng.random() < duplicate_rate:
+            texts.append(rng.choice(texts))
+            continue
+        # Short texts often come out the same by chance, which would push
+        # the duplicate rate over the one asked for
+        for _ in range(MAX_ATTEMPTS):
+            words = round(rng.lognormvariate(math.log(median_words), 0.5))
+            words = min(max(words, 1), max_words)
+            text = _offense(rng, words, table, abbreviation_rate, upper_rate)
+            if text not in seen:
+                break
+        seen.add(text)
+        texts.append(text)
+    return texts
+
+
+def synthetic_frame(size: int, column: str = "offense", **kwargs) -> pd.DataFrame:
+    """`synthetic_corpus` as a bulk upload, see `synthetic_corpus` for kwargs"""
+    return pd.DataFrame({column: synthetic_corpus(size, **kwargs)})
+
+
+if __name__ == "__main__":
+    # python synthetic_corpus.py 100000 corpus.csv
+    synthetic_frame(int(sys.argv[1])).to_csv(sys.argv[2], index=False)
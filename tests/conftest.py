@@ -0,0 +1,13 @@
+import os
+import shutil
+import tempfile
+
+
+def pytest_configure(config):
+    # Plan caches go to a temporary directory instead of ~/.cache/rota, and
+    # there is no prediction cache unless a test makes one. Set before the
+    # test modules are imported, since they build engines.
+    cache_dir = tempfile.mkdtemp(prefix="rota-cache-")
+    os.environ["ROTA_CACHE_DIR"] = cache_dir
+    os.environ["ROTA_PREDICTION_CACHE"] = ""
+    config.add_cleanup(lambda: shutil.rmtree(cache_dir, ignore_errors=True))
@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from batching_utils import (
+    HISTORY_SIZE,
+    BatchRecord,
+    BatchSizeController,
+    batch_report,
+    iter_batches,
+    pad_batch,
+    padding_stats,
+    token_budget_batches,
+)
+
+
+def test_token_budget_batches():
+    lengths = [5, 2, 9, 2, 5, 3]
+    batches = token_budget_batches(lengths, max_tokens=10)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        longest = max(lengths[i] for i in batch)
+        assert len(batch) * longest <= 10
+    # Similar lengths end up together
+    assert batches[0] == [1, 3, 5]
+    assert batches[1] == [0, 4]
+
+
+def test_token_budget_batches_limits():
+    # A text over the budget gets its own batch
+    assert token_budget_batches([3, 50, 3], max_tokens=10) == [[0, 2], [1]]
+    assert token_budget_batches([1] * 5, max_tokens=100, max_batch_size=2) == [
+        [0, 1],
+        [2, 3],
+        [4],
+    ]
+    assert token_budget_batches([], max_tokens=10) == []
+
+
+def test_pad_batch():
+    encodings = {
+        "input_ids": [[0, 7, 2], [0, 5, 6, 8, 2], [0, 2]],
+        "attention_mask": [[1, 1, 1], [1, 1, 1, 1, 1], [1, 1]],
+    }
+    batch = pad_batch(encodings, [2, 0], pad_values={"input_ids": 1})
+    assert batch["input_ids"].tolist() == [[0, 2, 1], [0, 7, 2]]
+    assert batch["attention_mask"].tolist() == [[1, 1, 0], [1, 1, 1]]
+    assert batch["input_ids"].dtype == "int64"
+
+    left = pad_batch(encodings, [2, 0], {"input_ids": 1}, padding_side="left")
+    assert left["input_ids"].tolist() == [[1, 0, 2], [0, 7, 2]]
+    assert left["attention_mask"].tolist() == [[0, 1, 1], [1, 1, 1]]
+
+
+def test_padding_stats():
+    lengths = [2, 4, 4]
+    stats = padding_stats(lengths, [[0, 1, 2]])
+    assert stats["batches"] == 1
+    assert stats["tokens"] == 10
+    assert stats["padded_tokens"] == 12
+    assert stats["padding"] == pytest.approx(1 / 6)
+    lengths = [4, 2, 4, 2]
+    bucketed = padding_stats(lengths, token_budget_batches(lengths, max_tokens=8))
+    assert bucketed["batches"] == 2
+    assert bucketed["padding"] == 0
+
+
+def test_iter_batches_asks_budget_per_batch():
+    budgets = iter([2, 4, 100])
+    batches = list(iter_batches([1] * 7, lambda: next(budgets)))
+    assert batches == [[0, 1], [2, 3, 4, 5], [6]]
+
+
+def simulate(controller, latency, batches=40):
+    """Run batches whose time is `latency(size)`, with 1 token per row"""
+    for _ in range(batches):
+        size = controller.size
+        controller.record(size, size, latency(size))
+    return controller
+
+
+def test_controller_latency_target():
+    # 10ms overhead per batch, then 1ms per 100 tokens
+    controller = simulate(
+        BatchSizeController(size=256, target_latency=0.05),
+        lambda size: 0.01 + size / 100_000,
+    )
+    assert controller.size == pytest.approx(4000, rel=0.05)
+    # Bounded
+    controller = simulate(
+        BatchSizeController(size=256, max_size=1000, target_latency=0.05),
+        lambda size: 0.01 + size / 100_000,
+    )
+    assert controller.size == 1000
+
+
+def test_controller_throughput():
+    # Fastest around 4096 tokens, eg: past it the batches spill out of cache
+    def latency(size):
+        return size / 1000 * (1 + abs(size - 4096) / 4096)
+
+    controller = simulate(BatchSizeController(size=256), latency)
+    assert max(controller.throughput, key=controller.throughput.get) in range(
+        2800, 6000
+    )
+    # Keeps probing around the best size
+    assert 1800 < controller.size < 9000
+
+    report = controller.report()
+    assert list(report.columns) == [
+        "size",
+        "batches",
+        "rows",
+        "tokens",
+        "seconds",
+        "tokens_per_second",
+        "mean_seconds",
+    ]
+    assert report["batches"].sum() == 40
+    assert report["size"].is_monotonic_decreasing
+
+
+def test_controller_fixed(monkeypatch):
+    controller = simulate(BatchSizeController(512, 512, 512), lambda size: 1.0)
+    assert set(controller.throughput) == {512}
+    monkeypatch.setenv("ROTA_ADAPTIVE_BATCHING", "0")
+    assert BatchSizeController.from_env(1024).max_size == 1024
+    monkeypatch.delenv("ROTA_ADAPTIVE_BATCHING")
+    monkeypatch.setenv("ROTA_BATCH_TARGET_LATENCY", "0.2")
+    assert BatchSizeController.from_env(1024).target_latency == 0.2
+    with pytest.raises(ValueError):
+        BatchSizeController(min_size=10, max_size=5)
+
+
+def test_controller_shared():
+    controller = BatchSizeController(size=256)
+
+    def job(_):
+        records = []
+        for _ in range(HISTORY_SIZE // 2):
+            size = controller.size
+            record = BatchRecord(size, size, size, size / 1000)
+            controller.add(record)
+            records.append(record)
+        return batch_report(records)
+
+    with ThreadPoolExecutor(4) as executor:
+        reports = list(executor.map(job, range(4)))
+    # Only the last batches are kept
+    assert len(controller.history) == HISTORY_SIZE
+    assert controller.report()["batches"].sum() == HISTORY_SIZE
+    # Each job reports on its own batches
+    assert [report["batches"].sum() for report in reports] == [HISTORY_SIZE // 2] * 4
+    assert batch_report([]).empty
+
+
+def test_controller_interleaved_jobs():
+    # Two jobs form their batches, then both record: each measure has to go
+    # to the budget its batch was formed with, not the current one
+    def latency(size):
+        return size / 1000 * (1 + abs(size - 4096) / 4096)
+
+    controller = BatchSizeController(size=1024)
+    for _ in range(20):
+        sizes = [controller.size]
+        controller.add(BatchRecord(sizes[0], 1, sizes[0], latency(sizes[0])))
+        sizes.append(controller.size)
+        for size in sizes[::-1]:
+            controller.add(BatchRecord(size, 1, size, latency(size)))
+    for size, tokens_per_second in controller.throughput.items():
+        assert tokens_per_second == pytest.approx(size / latency(size))
+
+    controller = BatchSizeController(size=1024)
+    controller.add(BatchRecord(65536, 100, 65536, 0.01))
+    assert set(controller.throughput) == {65536}
+
+    # A slow batch of another job scales its own budget, not the current one
+    controller = BatchSizeController(size=1024, target_latency=0.05)
+    assert controller.add(BatchRecord(8192, 10, 8192, 0.1)) == 5461
@@ -0,0 +1,45 @@
+import pytest
+
+from cache_utils import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.stats() == {
+        "entries": 2,
+        "max_entries": 2,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 1,
+        "hit_rate": 0.5,
+    }
+
+
+def test_get_or_compute():
+    cache = LRUCache(max_entries=10)
+    calls = []
+
+    def compute(key):
+        calls.append(key)
+        return key.upper()
+
+    assert cache.get_or_compute("x", compute) == "X"
+    assert cache.get_or_compute("x", compute) == "X"
+    assert calls == ["x"]
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()["hits"] == 0
+
+
+def test_disabled_cache():
+    cache = LRUCache(max_entries=0)
+    assert cache.get_or_compute("x", str.upper) == "X"
+    assert len(cache) == 0
+    with pytest.raises(ValueError):
+        LRUCache(max_entries=-1)
@@ -0,0 +1,235 @@
+import pandas as pd
+import pytest
+
+import cleaning_utils
+from cache_utils import LRUCache
+from cleaning_utils import (
+    CleanerEngine,
+    CleaningGuard,
+    CleaningTimeout,
+    TokenPass,
+    clean_batch,
+    clean_cached,
+    clean_parallel,
+    clean_series,
+    cleaner,
+    default_engine,
+    finish_text,
+    prep_stage,
+    prep_text,
+    punctuation_stage,
+    removal_stage,
+    substitutions,
+)
+from equivalence import generated_corpus
+from rule_analysis import literal_words, required_literals
+
+SAMPLES = [
+    "FRAUDULENT USE OF A CREDIT CARD OR DEBT CARD >= $25,000",
+    "BURGLARY - OVERNIGHT ACCOMMODATION, PERSON PRESENT",
+    "POSS CNTRL SUBST W/I 1000 FT OF SCHOOL",
+    "poss. controlled substance",
+    "AGG ASLT W/DEADLY WPN",
+    "DWLS 3RD OFFENSE",
+    "A&B ON A POLICE OFFICER",
+    "SOL CDS W/INTENT TO DIST",
+    "OBSCIS 12.34.56 MENTALLY ILL PERSON'S PROPERTY",
+    "THEFT <$500 2YR",
+    "POſS CNTRL ſUBST",
+    "",
+    float("nan"),
+    None,
+]
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    """Random texts built from words the ruleset knows about"""
+    return generated_corpus(2000)
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_engine_samples(text):
+    assert default_engine().clean(text) == cleaner(text)
+
+
+def test_engine_corpus(corpus):
+    engine = default_engine()
+    for text in corpus:
+        assert engine.clean(text) == cleaner(text), text
+
+
+def test_engine_merges_passes():
+    engine = default_engine()
+    assert len(engine.passes) < len(substitutions)
+    assert sum(len(p.rules) for p in engine.passes) == len(substitutions)
+
+
+def test_engine_custom_rules():
+    rules = [rule for rule in substitutions if rule.priority == 20]
+    engine = CleanerEngine(rules)
+    assert engine.clean("POSS CNTRL SUBST") == "poss controlled substance"
+
+
+def test_literal_rules_use_token_passes():
+    engine = default_engine()
+    token_passes = [p for p in engine.passes if isinstance(p, TokenPass)]
+    assert token_passes
+    for token_pass in token_passes:
+        for rule in token_pass.rules:
+            assert literal_words(rule.regex_str) is not None
+    assert literal_words(r"\b(?:cntrld|cntrl|contrlld)\b") == {
+        "cntrld",
+        "cntrl",
+        "contrlld",
+    }
+    assert literal_words(r"\bw(?: +|\W+|\b)(?:i|in)\b") is None
+    assert literal_words(r"\bat(?! risk)\b") is None
+
+
+def test_required_literals():
+    assert required_literals(r"\bupcs\b") == {"upcs"}
+    assert required_literals(r"\b(?:a\&b|a \& b|ab)(?!c)\b") == {"a"}
+    assert required_literals(r"\bsol(?: +|\W+|\b)cds\b") in ({"sol"}, {"cds"})
+    assert required_literals(r"(?: +|\W+|\b)") is None
+
+
+def test_prefilter_skips_rules(corpus):
+    engine = CleanerEngine()
+    unfiltered = CleanerEngine(prefilter=False)
+    for text in corpus[:200]:
+        assert engine.clean(text) == unfiltered.clean(text)
+    stats = engine.stats()
+    assert stats["texts"] == 200
+    assert stats["rules_per_text"] < unfiltered.stats()["rules_per_text"]
+    engine.reset_stats()
+    assert engine.stats()["texts"] == 0
+
+
+def test_clean_batch(corpus):
+    texts = SAMPLES + corpus[:500] + ["W/\x00_\x00IN", "_ W _", "A_B W/I"]
+    assert clean_batch(texts) == [cleaner(text) for text in texts]
+    assert clean_batch([]) == []
+
+
+def test_clean_batch_splits_ascii(corpus, monkeypatch):
+    engine = CleanerEngine(lowercase=True)
+    joined = []
+    substitute_joined = engine._substitute_joined
+
+    def record(prepared):
+        joined.append(prepared)
+        return substitute_joined(prepared)
+
+    monkeypatch.setattr(engine, "_substitute_joined", record)
+    texts = corpus[:100] + ["POſS CNTRL ſUBST", "KİLL W/I"]
+    assert engine.clean_batch(texts) == [cleaner(text) for text in texts]
+    # A non-ASCII text does not turn off lowercase mode for the others
+    assert sorted(len(prepared) for prepared in joined) == [2, 100]
+    assert all(len({text.isascii() for text in group}) == 1 for group in joined)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "1,2,3 $25,000.00 ,5 6,",
+        "JOHN'S CAR'S 'S PERSON'S",
+        "HIT-AND-RUN W/O 1/2",
+        "OBSCIS THEFT",
+        "x OBSCISy a b c d 12 34 5678",
+        "AB 12.3.45 STATUTE",
+        "‘QUOTED’ · TEXT — » (PARENS) $5",
+        "",
+    ],
+)
+def test_stages_match_reference(text):
+    assert prep_stage(text) == prep_text(text)
+    assert punctuation_stage(removal_stage(text)) == finish_text(text)
+
+
+def test_lowercase_mode(corpus):
+    engine = CleanerEngine(lowercase=True)
+    texts = SAMPLES + corpus + ["Poss\x1cCntrl\x1dSubst", "KİLL ſUBST", "JOHN'S john's"]
+    for text in texts:
+        assert engine.clean(text) == cleaner(text), text
+    assert engine.clean_batch(texts) == [cleaner(text) for text in texts]
+
+
+def test_clean_series(corpus):
+    values = (corpus[:50] + [None, float("nan")]) * 3
+    series = pd.Series(values, index=range(len(values), 0, -1), name="offense")
+    cleaned = clean_series(series)
+    assert cleaned.name == "offense"
+    assert list(cleaned.index) == list(series.index)
+    assert list(cleaned) == [cleaner(value) for value in values]
+    assert clean_series(pd.Series([], dtype=object)).empty
+    # pandas' factorize merges strings that only differ after a "\x00"
+    values = ["a\x00cntrl", "a\x00b", "a", "\x00w/i"] * 20 + ["b"] * 20
+    assert list(clean_series(pd.Series(values))) == [cleaner(v) for v in values]
+
+
+def test_clean_parallel(corpus):
+    texts = corpus[:300] + [None]
+    expected = [cleaner(text) for text in texts]
+    assert clean_parallel(texts, workers=2, chunksize=50) == expected
+    assert clean_parallel(texts, workers=1) == expected
+    assert clean_parallel([], workers=2) == []
+
+
+def test_clean_cached():
+    cache = LRUCache(max_entries=2)
+    for text in ["POSS CNTRL SUBST", "POSS CNTRL SUBST", None, "DWLS", "W/I"]:
+        assert clean_cached(text, cache=cache) == cleaner(text)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 1)
+
+
+def test_clean_cached_skips_fallback(monkeypatch):
+    engine = CleanerEngine(guard=CleaningGuard(time_budget=1e-12))
+    monkeypatch.setattr(cleaning_utils, "default_engine", lambda: engine)
+    cache = LRUCache(max_entries=10)
+    assert clean_cached("POSS CNTRL SUBST", cache=cache) == "poss cntrl subst"
+    assert "POSS CNTRL SUBST" not in cache
+    engine.guard = CleaningGuard()
+    assert clean_cached("POSS CNTRL SUBST", cache=cache) == cleaner("POSS CNTRL SUBST")
+    assert "POSS CNTRL SUBST" in cache
+
+
+def test_guard_from_env(monkeypatch):
+    assert CleaningGuard.from_env() == CleaningGuard(2000, None, "normalize")
+    monkeypatch.setenv("ROTA_CLEAN_TIME_BUDGET", "0.5")
+    monkeypatch.setenv("ROTA_CLEAN_MAX_LENGTH", "0")
+    assert CleaningGuard.from_env() == CleaningGuard(0, 0.5, "normalize")
+
+
+def test_guard_max_length():
+    engine = CleanerEngine(guard=CleaningGuard(max_length=18, time_budget=None))
+    assert engine.clean("POSS CNTRL SUBST W/I 1000 FT") == cleaner("POSS CNTRL SUBST")
+    assert engine.clean("A" * 30) == "a" * 18
+    assert engine.stats()["truncated"] == 2
+
+
+@pytest.mark.parametrize(
+    "fallback,expected",
+    [("normalize", "poss cntrl subst w i 1000 ft"), ("empty", "")],
+)
+def test_guard_time_budget(fallback, expected):
+    guard = CleaningGuard(time_budget=1e-12, fallback=fallback)
+    engine = CleanerEngine(guard=guard)
+    assert engine.clean("POSS CNTRL SUBST W/I 1000 FT") == expected
+    assert engine.clean_batch(["POSS CNTRL SUBST W/I 1000 FT", None]) == [expected, ""]
+    assert engine.stats()["timeouts"] == 2
+
+
+def test_guard_raise():
+    engine = CleanerEngine(guard=CleaningGuard(time_budget=1e-12, fallback="raise"))
+    with pytest.raises(CleaningTimeout):
+        engine.clean("POSS CNTRL SUBST")
+    with pytest.raises(ValueError):
+        CleaningGuard(fallback="skip")
+
+
+def test_guard_within_limits(corpus):
+    engine = CleanerEngine(lowercase=True, guard=CleaningGuard())
+    assert engine.clean_batch(corpus[:300]) == [cleaner(text) for text in corpus[:300]]
+    assert engine.stats()["timeouts"] == 0
@@ -0,0 +1,54 @@
+from cleaning_utils import CleanerEngine, RegexSubstitution, substitutions
+from equivalence import (
+    compare_engines,
+    generated_corpus,
+    mutated_corpus,
+    responsible_rule,
+)
+
+
+def broken_factory(rules):
+    """Engine where the "controlled" rule has the wrong replacement"""
+    rules = [
+        RegexSubstitution(r.description, r.regex_str, "ctrl", r.priority)
+        if r.description == "controlled"
+        else r
+        for r in rules
+    ]
+    return CleanerEngine(rules).clean
+
+
+def test_corpora():
+    corpus = generated_corpus(50, seed=1)
+    assert corpus == generated_corpus(50, seed=1)
+    mutated = mutated_corpus(corpus, 100, seed=1)
+    assert len(mutated) == 100
+    assert mutated == mutated_corpus(corpus, 100, seed=1)
+    assert set(mutated) - set(corpus)
+
+
+def test_default_engines_are_equivalent():
+    corpus = generated_corpus(300) + [None, "", "a\x00cntrl", "a"]
+    corpus += mutated_corpus(corpus, 300)
+    results = compare_engines(corpus)
+    assert list(results["engine"])[0] == "cleaner"
+    assert (results["diverging"] == 0).all(), results["divergences"]
+    assert (results["texts_per_second"] > 0).all()
+
+
+def test_divergence_is_attributed():
+    broken = broken_factory(substitutions)
+    results = compare_engines(
+        ["POSS CNTRL SUBST", "DWLS", "CNTRL"],
+        engines={"broken": lambda texts: list(map(broken, texts))},
+        factories={"broken": broken_factory},
+    )
+    row = results.set_index("engine").loc["broken"]
+    assert row["diverging"] == 2
+    assert [d.rule for d in row["divergences"]] == ["controlled", "controlled"]
+    assert row["divergences"][0].actual == "possession ctrl substance"
+
+
+def test_responsible_rule_not_reproduced():
+    assert responsible_rule("DWLS", broken_factory) is None
+    assert responsible_rule("DWLS", lambda rules: lambda text: "x") == "prep / finish"
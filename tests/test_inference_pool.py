@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+import pytest
+
+from inference_pool import InferencePool, core_sets
+from prediction_utils import Predictions
+
+
+class UnpicklableError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+def upper_predictor():
+    def predict(texts):
+        if "fail" in texts:
+            raise ValueError("bad batch")
+        if "unpicklable" in texts:
+            # Pickled with its message only, so it can not be made again
+            raise UnpicklableError("odd batch", 3)
+        return [(text.upper(), os.getpid()) for text in texts]
+
+    return predict
+
+
+def ones_predictor():
+    def predict(texts):
+        return Predictions(np.ones((len(texts), 2)), ["a", "b"])
+
+    return predict
+
+
+def test_core_sets():
+    assert core_sets(2, [0, 1, 2, 3, 4]) == [[0, 1, 2], [3, 4]]
+    assert core_sets(3, [0, 1]) == [[0], [1], [0]]
+    sets = core_sets(1)
+    assert len(sets) == 1 and sets[0]
+
+
+def test_pool_keeps_order():
+    texts = [f"text {i}" for i in range(50)]
+    with InferencePool(workers=2, factory=upper_predictor) as pool:
+        predictions = pool.predict(texts, chunk_size=3)
+        assert [text for text, _ in predictions] == [t.upper() for t in texts]
+        assert os.getpid() not in {pid for _, pid in predictions}
+
+        batches = [["a"], ["b", "c"], [], ["d"]]
+        assert [[t for t, _ in batch] for batch in pool.map(batches)] == [
+            ["A"],
+            ["B", "C"],
+            [],
+            ["D"],
+        ]
+        with pytest.raises(ValueError, match="bad batch"):
+            list(pool.map([["fail"]] + [["ok"]] * 5))
+        with pytest.raises(RuntimeError, match="UnpicklableError: odd batch"):
+            list(pool.map([["unpicklable"]]))
+        # Nothing left over from the failed calls
+        assert [t for t, _ in pool.predict(["x", "y"], chunk_size=1)] == ["X", "Y"]
+
+
+def test_pool_not_started():
+    with pytest.raises(RuntimeError):
+        list(InferencePool(workers=1, factory=upper_predictor).map([["a"]]))
+    with pytest.raises(ValueError):
+        InferencePool(workers=0)
+
+
+def test_pool_predicts_no_texts():
+    with InferencePool(workers=1, factory=ones_predictor) as pool:
+        predictions = pool.predict([])
+        assert predictions.scores.shape == (0, 2)
+        assert list(predictions.labels) == ["a", "b"]
+        assert pool.predict(["x", "y", "z"], chunk_size=2).scores.shape == (3, 2)
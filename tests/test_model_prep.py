@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from model_prep import (
+    PROBABILITIES,
+    TOP_INDICES,
+    TOP_SCORES,
+    add_postprocessing,
+    default_model_path,
+    model_digest,
+    prepare_model,
+)
+from prediction_utils import Predictions, softmax
+
+onnx = pytest.importorskip("onnx")
+onnxruntime = pytest.importorskip("onnxruntime")
+
+WEIGHTS = np.random.default_rng(0).normal(size=(3, 6)).astype(np.float32)
+
+
+def linear_model(path, opset):
+    """A "classifier" of 3 features into 6 labels"""
+    from onnx import TensorProto, helper, numpy_helper
+
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["features", "weights"], ["logits"])],
+        "linear",
+        [helper.make_tensor_value_info("features", TensorProto.FLOAT, ["batch", 3])],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", 6])],
+        [numpy_helper.from_array(WEIGHTS, "weights")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", opset)])
+    model.ir_version = 7
+    onnx.save_model(model, str(path))
+    return path
+
+
+@pytest.mark.parametrize("opset", [9, 13])
+def test_add_postprocessing(tmp_path, opset):
+    model_path = linear_model(tmp_path / "model.onnx", opset)
+    prepared = add_postprocessing(model_path, tmp_path / "prepared.onnx", k=3)
+    session = onnxruntime.InferenceSession(
+        str(prepared), providers=["CPUExecutionProvider"]
+    )
+    assert [o.name for o in session.get_outputs()] == [
+        PROBABILITIES,
+        TOP_SCORES,
+        TOP_INDICES,
+    ]
+    features = np.random.default_rng(1).normal(size=(10, 3)).astype(np.float32)
+    probabilities, top_scores, top_indices = session.run(None, {"features": features})
+
+    expected = softmax(features @ WEIGHTS)
+    assert probabilities == pytest.approx(expected, abs=1e-6)
+    assert (top_indices == np.argsort(-expected, axis=1)[:, :3]).all()
+    assert top_indices.dtype == np.int64
+
+    predictions = Predictions(probabilities, list("abcdef"), (top_indices, top_scores))
+    assert (predictions.argmax() == expected.argmax(axis=1)).all()
+    columns, scores = predictions.top_k(2)
+    assert (columns == top_indices[:, :2]).all()
+    # More than the graph kept: sorted from the scores
+    columns, _ = predictions.top_k(4)
+    assert (columns == np.argsort(-expected, axis=1)[:, :4]).all()
+
+
+def test_prepare_model(tmp_path):
+    model_path = linear_model(tmp_path / "model.onnx", 13)
+    prepared = prepare_model(model_path, k=10)
+    assert prepared.name == "model.postprocess.onnx"
+    model = onnx.load(str(prepared))
+    # k is cut down to the number of labels
+    assert model.graph.output[1].type.tensor_type.shape.dim[1].dim_value == 6
+    # Done once
+    assert prepare_model(model_path) == prepared
+    with pytest.raises(ValueError, match="already"):
+        add_postprocessing(prepared, tmp_path / "twice.onnx")
+
+
+def test_model_digest(tmp_path):
+    model_path = linear_model(tmp_path / "model.onnx", 13)
+    copy = tmp_path / "copy.onnx"
+    copy.write_bytes(model_path.read_bytes())
+    assert model_digest(model_path) == model_digest(copy)
+    assert model_digest(model_path) != model_digest(prepare_model(model_path))
+
+
+def test_default_model_path(monkeypatch):
+    monkeypatch.delenv("ROTA_MODEL_PATH", raising=False)
+    assert default_model_path().name == "rota-quantized.postprocess.onnx"
+    monkeypatch.setenv("ROTA_MODEL_PATH", "other.onnx")
+    assert default_model_path().name == "other.onnx"
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from batching_utils import BatchSizeController
+from model_prep import add_postprocessing
+from prediction_cache import PredictionCache, predict_unique
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from onnx_pipeline import ONNXCPUClassificationPipeline  # noqa: E402
+
+LABELS = list("abcdef")
+WEIGHTS = np.random.default_rng(0).normal(size=(2, 6)).astype(np.float32) / 50
+
+
+class FakeTokenizer:
+    """A token per word, between a start and an end token"""
+
+    pad_token_id = 0
+    pad_token_type_id = 0
+    padding_side = "right"
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text):
+        return [1] + [sum(map(ord, word)) % 97 + 3 for word in text.split()] + [2]
+
+    def __call__(self, texts, return_tensors=None, padding=False):
+        self.calls += 1
+        input_ids = [self.encode(text) for text in texts]
+        attention_mask = [[1] * len(ids) for ids in input_ids]
+        if return_tensors != "np":
+            return {"input_ids": input_ids, "attention_mask": attention_mask}
+        width = max(map(len, input_ids))
+        arrays = {}
+        for key, rows in (("input_ids", input_ids), ("attention_mask", attention_mask)):
+            arrays[key] = np.zeros((len(rows), width), dtype=np.int32)
+            for i, row in enumerate(rows):
+                arrays[key][i, : len(row)] = row
+        return arrays
+
+
+def token_model(path):
+    """A "classifier" of the sum of the token ids and the number of tokens"""
+    from onnx import TensorProto, helper, numpy_helper
+
+    nodes = [
+        helper.make_node("Cast", ["input_ids"], ["ids"], to=TensorProto.FLOAT),
+        helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+        helper.make_node("ReduceSum", ["ids"], ["id_sum"], axes=[1], keepdims=1),
+        helper.make_node("ReduceSum", ["mask"], ["length"], axes=[1], keepdims=1),
+        helper.make_node("Concat", ["id_sum", "length"], ["features"], axis=1),
+        helper.make_node("MatMul", ["features", "weights"], ["logits"]),
+    ]
+    inputs = [
+        helper.make_tensor_value_info(name, TensorProto.INT64, ["batch", "sequence"])
+        for name in ("input_ids", "attention_mask")
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "tokens",
+        inputs,
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", 6])],
+        [numpy_helper.from_array(WEIGHTS, "weights")],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 11)])
+    model.ir_version = 7
+    onnx.save_model(model, str(path))
+    return path
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["logits", "postprocess"])
+def pipeline(request, tmp_path_factory):
+    model_path = token_model(tmp_path_factory.mktemp("model") / "model.onnx")
+    if request.param:
+        model_path = add_postprocessing(model_path, model_path.with_suffix(".pp.onnx"))
+    return ONNXCPUClassificationPipeline(FakeTokenizer(), str(model_path), LABELS)
+
+
+@pytest.fixture(scope="module")
+def texts():
+    rng = np.random.default_rng(1)
+    words = ["poss", "cntrl", "subst", "w/i", "1000", "ft", "school", "theft"]
+    return [" ".join(rng.choice(words, rng.integers(1, 30))) for _ in range(200)]
+
+
+def test_call(pipeline, texts):
+    predictions = pipeline(texts[:3])
+    assert predictions.scores.shape == (3, 6)
+    assert predictions.scores.sum(axis=1) == pytest.approx(1, abs=1e-5)
+    assert predictions.labels.tolist() == LABELS
+
+
+def test_bulk_keeps_input_order(pipeline, texts):
+    expected = np.concatenate([pipeline([text]).scores for text in texts])
+    controller = BatchSizeController(64, 32, 128)
+    records = []
+    predictions = pipeline.bulk(
+        texts, max_batch_size=8, controller=controller, records=records
+    )
+    # Several batches, whose texts are out of the input order
+    assert len(records) > 10
+    assert list(controller.history) == records
+    assert sum(record.rows for record in records) == len(texts)
+    assert predictions.scores == pytest.approx(expected, abs=1e-5)
+    assert (predictions.argmax() == expected.argmax(axis=1)).all()
+    assert pipeline.bulk(texts, max_tokens=100000).scores == pytest.approx(
+        expected, abs=1e-5
+    )
+    assert pipeline.bulk([]).scores.shape == (0, 6)
+
+
+def test_predict_unique(pipeline, texts, tmp_path):
+    repeated = texts[:50] * 3
+    expected = pipeline.bulk(repeated).scores
+    cache = PredictionCache(tmp_path / "cache.sqlite", "v1")
+    for model_calls in (1, 0):
+        calls = pipeline.tokenizer.calls
+        predictions = predict_unique(repeated, pipeline.bulk, cache)
+        assert pipeline.tokenizer.calls - calls == model_calls
+        assert predictions.scores == pytest.approx(expected, abs=1e-5)
+    predictions = predict_unique(repeated, pipeline.bulk)
+    assert predictions.scores == pytest.approx(expected, abs=1e-5)
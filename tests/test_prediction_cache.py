@@ -0,0 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from prediction_cache import PredictionCache, default_prediction_cache
+from prediction_utils import Predictions
+
+LABELS = ["Assault", "Burglary", "Drugs"]
+
+
+class FakeModel:
+    """Scores each text from its length, and remembers what it was asked"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        scores = np.array([[len(t), 1.0, 2.0] for t in texts]).reshape(-1, 3)
+        return Predictions(scores, LABELS)
+
+
+def test_predict_skips_cached(tmp_path):
+    model = FakeModel()
+    cache = PredictionCache(tmp_path / "cache.sqlite", "v1")
+    first = cache.predict(["burglary", "poss cocaine"], model)
+    assert first.scores[:, 0].tolist() == [8, 12]
+
+    predictions = cache.predict(["theft", "poss cocaine", "burglary"], model)
+    assert model.calls[-1] == ["theft"]
+    assert predictions.scores[:, 0].tolist() == [5, 12, 8]
+    assert predictions.labels.tolist() == LABELS
+    assert cache.stats()["hits"] == 2
+
+    # Kept across runs
+    reopened = PredictionCache(tmp_path / "cache.sqlite", "v1")
+    calls = len(model.calls)
+    assert reopened.predict(["burglary", "theft"], model).scores[:, 0].tolist() == [
+        8,
+        5,
+    ]
+    assert len(model.calls) == calls
+    assert reopened.stats()["hit_rate"] == 1.0
+
+
+@pytest.mark.parametrize(
+    "table,value",
+    [("labels", "{not json"), ("labels", '{"a": 1}'), ("predictions", b"\x00" * 5)],
+)
+def test_corrupt_cache(tmp_path, table, value):
+    model = FakeModel()
+    cache = PredictionCache(tmp_path / "cache.sqlite", "v1")
+    cache.predict(["burglary", "theft"], model)
+    column = "labels" if table == "labels" else "scores"
+    with cache.connection:
+        cache.connection.execute(f"UPDATE {table} SET {column} = ?", (value,))
+    predictions = cache.predict(["burglary", "theft"], model)
+    assert predictions.scores[:, 0].tolist() == [8, 5]
+    assert model.calls[-1] == ["burglary", "theft"]
+
+
+def test_threads(tmp_path):
+    cache = PredictionCache(tmp_path / "cache.sqlite", "v1")
+    cache.predict(["burglary", "theft"], FakeModel())
+    lookups = ["burglary", "theft", "arson"]
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: cache.get_many(lookups), range(400)))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (800, 400)
+
+
+def test_namespaces(tmp_path):
+    model = FakeModel()
+    PredictionCache(tmp_path / "cache.sqlite", "v1").predict(["burglary"], model)
+    # eg: a new release or model file (cleaned texts do not need one)
+    PredictionCache(tmp_path / "cache.sqlite", "v2").predict(["burglary"], model)
+    assert model.calls == [["burglary"], ["burglary"]]
+
+
+def test_eviction(tmp_path):
+    model = FakeModel()
+    cache = PredictionCache(tmp_path / "cache.sqlite", "v1", max_entries=10)
+    cache.predict([f"text {i}" for i in range(8)], model)
+    cache.get_many(["text 0"])  # now the most recently used
+    cache.predict([f"other {i}" for i in range(5)], model)
+    assert cache.stats()["entries"] == 9
+    assert cache.stats()["evictions"] == 4
+    assert "text 0" in cache.get_many(["text 0", "text 1"])
+    assert "text 1" not in cache.get_many(["text 1"])
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+    with pytest.raises(ValueError):
+        PredictionCache(tmp_path / "cache.sqlite", "v1", max_entries=0)
+
+
+def test_default_prediction_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv("ROTA_PREDICTION_CACHE", raising=False)
+    monkeypatch.setenv("ROTA_CACHE_DIR", str(tmp_path))
+    cache = default_prediction_cache("v1")
+    assert cache.path == tmp_path / "predictions.sqlite"
+    monkeypatch.setenv("ROTA_PREDICTION_CACHE", "")
+    assert default_prediction_cache("v1") is None
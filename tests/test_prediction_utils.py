@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from prediction_utils import Predictions, unique_codes
+
+LABELS = ["Assault", "Burglary", "Drugs", "Fraud"]
+SCORES = np.array(
+    [
+        [0.1, 0.6, 0.2, 0.1],
+        [0.7, 0.05, 0.05, 0.2],
+        [0.25, 0.25, 0.4, 0.1],
+    ]
+)
+
+
+def test_dict_views():
+    predictions = Predictions(SCORES, LABELS)
+    assert predictions.scores.dtype == np.float32
+    assert len(predictions) == 3
+    assert [d["label"] for d in predictions[0]] == LABELS
+    assert predictions[0][1] == {"label": "Burglary", "score": pytest.approx(0.6)}
+    assert [d["label"] for d in predictions.row(2, sort=True)] == [
+        "Drugs",
+        "Assault",  # ties keep the label order
+        "Burglary",
+        "Fraud",
+    ]
+    assert list(predictions) == predictions.to_dicts()
+    assert isinstance(predictions.to_dicts()[0][0]["score"], float)
+
+
+def test_max():
+    predictions = Predictions(SCORES, LABELS)
+    assert predictions.max_labels().tolist() == ["Burglary", "Assault", "Drugs"]
+    assert predictions.max_scores() == pytest.approx([0.6, 0.7, 0.4])
+    assert predictions.confidence().tolist() == [60, 70, 40]
+    as_dicts = [max(row, key=lambda d: d["score"]) for row in predictions]
+    assert predictions.max_dicts() == as_dicts
+
+
+def test_top_k():
+    rng = np.random.default_rng(0)
+    scores = rng.random((50, 20))
+    columns, top = Predictions(scores, [str(i) for i in range(20)]).top_k(3)
+    assert columns.shape == top.shape == (50, 3)
+    expected = np.argsort(-scores, axis=1)[:, :3]
+    assert (columns == expected).all()
+    assert top == pytest.approx(np.sort(scores, axis=1)[:, ::-1][:, :3])
+
+    columns, _ = Predictions(SCORES, LABELS).top_k(10)
+    assert columns[0].tolist() == [1, 2, 0, 3]
+
+
+def test_slicing_and_concat():
+    predictions = Predictions(SCORES, LABELS)
+    tail = predictions[1:]
+    assert isinstance(tail, Predictions)
+    assert tail.max_labels().tolist() == ["Assault", "Drugs"]
+    assert predictions[np.array([2, 0])].max_labels().tolist() == ["Drugs", "Burglary"]
+    both = Predictions.concat([predictions[:1], tail])
+    assert (both.scores == predictions.scores).all()
+    with pytest.raises(ValueError):
+        Predictions(SCORES, LABELS[:2])
+
+
+@pytest.mark.parametrize("mode", ["max", "top_k", "scores"])
+def test_empty_column(mode):
+    # An upload with a header and no rows: no chunks to predict
+    unique_texts, codes = unique_codes(pd.Series([], dtype=object))
+    assert unique_texts == []
+    with pytest.raises(ValueError):
+        Predictions.concat([])
+    predictions = Predictions.concat([], LABELS)[codes]
+    assert predictions.scores.shape == (0, 4)
+    frame = predictions.output_frame(mode, index=pd.Index([]))
+    assert frame.empty
+    assert "charge_category_pred" in frame.columns
+
+
+def test_top_is_carried():
+    top = (
+        np.array([[1, 2], [0, 3], [2, 0]]),
+        np.array([[0.6, 0.2], [0.7, 0.2]] + [[0.4, 0.25]]),
+    )
+    predictions = Predictions(SCORES, LABELS, top)
+    assert predictions[1:].top[0].tolist() == [[0, 3], [2, 0]]
+    both = Predictions.concat([predictions, Predictions(SCORES, LABELS, top)[:1]])
+    assert both.top[0].shape == (4, 2)
+    assert both.max_labels().tolist() == ["Burglary", "Assault", "Drugs", "Burglary"]
+    # Without top on every part, it is dropped
+    assert Predictions.concat([predictions, Predictions(SCORES, LABELS)]).top is None
+    with pytest.raises(ValueError):
+        Predictions(SCORES, LABELS, (top[0][:2], top[1][:2]))
+
+
+def test_output_frame():
+    predictions = Predictions(SCORES, LABELS)
+    frame = predictions.output_frame(index=pd.Index([10, 20, 30]))
+    assert list(frame.columns) == [
+        "charge_category_pred",
+        "charge_category_pred_confidence",
+    ]
+    assert frame.index.tolist() == [10, 20, 30]
+    assert frame["charge_category_pred"].tolist() == ["Burglary", "Assault", "Drugs"]
+    assert frame["charge_category_pred_confidence"].tolist() == [60, 70, 40]
+    assert frame["charge_category_pred_confidence"].dtype == np.uint8
+
+    top = predictions.output_frame("top_k", k=2, as_percent=False, label_ids=True)
+    assert list(top.columns) == [
+        "charge_category_pred",
+        "charge_category_pred_confidence",
+        "charge_category_pred_2",
+        "charge_category_pred_2_confidence",
+    ]
+    assert top["charge_category_pred_2"].tolist() == [2, 3, 0]
+    assert top["charge_category_pred_2"].dtype == np.int16
+    assert top["charge_category_pred_2_confidence"].dtype == np.float32
+    table = predictions.label_table()
+    assert table.set_index("label_id")["label"][2] == "Drugs"
+
+    scores = predictions.output_frame("scores")
+    assert scores.shape == (3, 2 + len(LABELS))
+    assert scores["charge_category_score_Fraud"].tolist() == [10, 20, 10]
+    assert "Burglary" in scores.to_csv(index=False)
+    with pytest.raises(ValueError):
+        predictions.output_frame("all")
+
+
+def test_unique_codes_fan_out():
+    texts = ["poss cocaine", "theft", "poss cocaine", "a\x00b", "a\x00c", "theft"]
+    uniques, codes = unique_codes(texts)
+    assert uniques == ["poss cocaine", "theft", "a\x00b", "a\x00c"]
+    assert [uniques[code] for code in codes] == texts
+
+    predictions = Predictions(np.vstack([SCORES, SCORES[:1]]), LABELS)[codes]
+    assert len(predictions) == len(texts)
+    assert predictions.max_labels().tolist() == [
+        "Burglary",
+        "Assault",
+        "Burglary",
+        "Drugs",
+        "Burglary",
+        "Assault",
+    ]
+    uniques, codes = unique_codes([])
+    assert uniques == [] and len(Predictions(SCORES, LABELS)[codes]) == 0
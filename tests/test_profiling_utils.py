@@ -0,0 +1,41 @@
+import json
+
+import pandas as pd
+import pytest
+
+from cleaning_utils import cleaner, profile_cleaning, removals, substitutions
+from profiling_utils import REPORT_COLUMNS, RuleProfiler
+
+TEXTS = ["POSS CNTRL SUBST", "DWLS 3RD OFFENSE", None, "AGG ASLT W/DEADLY WPN"]
+
+
+def test_profiled_cleaner_matches_cleaner():
+    profiler = RuleProfiler()
+    for text in TEXTS:
+        assert cleaner(text, profiler) == cleaner(text)
+    assert profiler.texts == 3
+    report = profiler.report()
+    assert list(report.columns) == REPORT_COLUMNS
+    assert len(report) == len(substitutions) + len(removals)
+    assert (report["invocations"] == 3).all()
+    assert report["total_seconds"].is_monotonic_decreasing
+
+
+def test_profile_cleaning_report(tmp_path):
+    profiler = profile_cleaning(TEXTS, path=tmp_path / "report.csv")
+    report = pd.read_csv(tmp_path / "report.csv")
+    assert len(report) == len(substitutions) + len(removals)
+    changed = report.set_index("pattern")["texts_changed"]
+    assert changed[r"\b(?:cntrld|cntrl|contrlld)\b"] == 1
+    assert "controlled" not in profiler.dead_rules()
+    assert "unlawful possession of a controlled substance" in profiler.dead_rules()
+
+    profiler.dump(tmp_path / "report.json", sort_by="texts_changed")
+    payload = json.loads((tmp_path / "report.json").read_text())
+    assert payload["texts"] == 3
+    assert payload["rules"][0]["texts_changed"] == report["texts_changed"].max()
+
+    with pytest.raises(ValueError):
+        profiler.dump(tmp_path / "report.txt")
+    profiler.reset()
+    assert profiler.report()["invocations"].sum() == 0
@@ -0,0 +1,23 @@
+from cleaning_utils import RegexSubstitution, substitutions
+from regex_audit import adversarial_inputs, audit_rule
+
+SIZES = (500, 1000, 2000)
+
+
+def test_adversarial_inputs():
+    rule = RegexSubstitution("with intent", r"\bw\s?in?t?e?n?t?\b", "with intent")
+    inputs = adversarial_inputs(rule, 100)
+    assert all(len(text) >= 100 for text in inputs.values())
+    assert "w + spaces" in inputs
+
+
+def test_audit_flags_backtracking():
+    rule = RegexSubstitution("bad", r"(?: +|\W+)x", "y")
+    assert audit_rule(rule, SIZES)["superlinear"]
+    rule = RegexSubstitution("fine", r"\bcntrl\b", "controlled")
+    assert not audit_rule(rule, SIZES)["superlinear"]
+
+
+def test_distance_within_300_is_linear():
+    (rule,) = [r for r in substitutions if r.description == "distance within 300"]
+    assert not audit_rule(rule, SIZES)["superlinear"]
@@ -0,0 +1,39 @@
+from cleaning_utils import RegexSubstitution, cleaner
+from rule_coverage import ACTIVE, DEAD, SHADOWED, prune_rules, rule_coverage
+
+TEXTS = ["POSS CNTRL SUBST", "SOL CDS", "DWLS", None] * 5
+
+
+def test_rule_coverage_statuses():
+    rules = [
+        RegexSubstitution("sol cds", r"\bsol cds\b", "solicitation", priority=1),
+        RegexSubstitution("cds", r"\bcds\b", "controlled substances"),
+        RegexSubstitution("cntrl", r"\bcntrl\b", "controlled"),
+        RegexSubstitution("upcs", r"\bupcs\b", "unlawful possession"),
+    ]
+    coverage = rule_coverage(TEXTS, rules)
+    assert list(coverage["status"]) == [ACTIVE, SHADOWED, ACTIVE, DEAD]
+    assert list(coverage["changed"]) == [5, 0, 5, 0]
+    assert list(coverage["matched"]) == [5, 5, 5, 0]
+
+
+def test_prune_rules():
+    result = prune_rules(TEXTS, holdout=0, predict=lambda texts: texts)
+    assert 0 < len(result.rules) < len(result.coverage)
+    assert result.pruned_passes < result.full_passes
+    assert result.equivalence == 1.0
+    assert result.label_agreement is None
+    summary = result.summary()
+    assert summary["kept"] + summary["shadowed"] + summary["dead"] == summary["rules"]
+
+
+def test_prune_rules_holdout():
+    # With seed 0, the last text is held out
+    texts = ["POSS CNTRL SUBST"] * 9 + ["AGG ASLT W/DEADLY WPN"]
+    result = prune_rules(texts, holdout=0.2, predict=lambda texts: [0] * len(texts))
+    assert result.texts == 2
+    assert result.equivalence == 0.5
+    (row,) = result.differing
+    assert row["text"] == "AGG ASLT W/DEADLY WPN"
+    assert row["full"] == cleaner(row["text"]) != row["pruned"]
+    assert result.label_agreement == 1.0
@@ -0,0 +1,112 @@
+import json
+import re
+
+import pytest
+
+import cleaning_utils
+from cleaning_utils import (
+    CleanerEngine,
+    cleaner,
+    dump_rules,
+    load_rules,
+    removals,
+    substitutions,
+)
+from rule_pack import PlanCache, flag_names, flag_value
+
+TEXTS = [
+    "POSS CNTRL SUBST W/I 1000 FT OF SCHOOL",
+    "AGG ASLT W/DEADLY WPN",
+    "OBSCIS 12.34.56 MENTALLY ILL PERSON'S PROPERTY",
+    "POſS CNTRL ſUBST",
+    None,
+]
+
+
+def test_rule_pack_round_trip(tmp_path):
+    path = dump_rules(tmp_path / "rules.json")
+    rules, removal_rules = load_rules(path)
+    assert rules == substitutions
+    assert removal_rules == removals
+    engine = CleanerEngine(rules, lowercase=True, removal_rules=removal_rules)
+    for text in TEXTS:
+        assert engine.clean(text) == cleaner(text)
+
+
+def test_rule_pack_version(tmp_path):
+    path = dump_rules(tmp_path / "rules.json")
+    pack = json.loads(path.read_text())
+    pack["version"] = 0
+    path.write_text(json.dumps(pack))
+    with pytest.raises(ValueError):
+        load_rules(path)
+
+
+def test_flag_names():
+    assert flag_names(0) == ()
+    assert flag_names(re.IGNORECASE) == ("IGNORECASE",)
+    assert flag_value(flag_names(re.IGNORECASE | re.ASCII)) == re.IGNORECASE | re.ASCII
+
+
+def test_plan_cache(tmp_path, monkeypatch):
+    plan_cache = PlanCache(tmp_path / "cache")
+    engine = CleanerEngine(lowercase=True, plan_cache=plan_cache)
+    assert len(list((tmp_path / "cache").glob("plan-*.json"))) == 2
+
+    def fail(rules):
+        raise AssertionError("the plan should come from the cache")
+
+    monkeypatch.setattr(cleaning_utils, "_plan_rules", fail)
+    cached = CleanerEngine(lowercase=True, plan_cache=plan_cache)
+    assert list(map(repr, cached.passes)) == list(map(repr, engine.passes))
+    for text in TEXTS:
+        assert cached.clean(text) == cleaner(text)
+
+    # Another ruleset does not reuse the plan
+    with pytest.raises(AssertionError):
+        CleanerEngine(substitutions[:10], plan_cache=plan_cache)
+
+
+def test_plan_cache_unreadable(tmp_path):
+    plan_cache = PlanCache(tmp_path)
+    rules = substitutions[:20]
+    CleanerEngine(rules, plan_cache=plan_cache)
+    for path in tmp_path.glob("plan-*.json"):
+        path.write_text("{not json")
+    engine = CleanerEngine(rules, plan_cache=plan_cache)
+    assert engine.clean("POSS CNTRL SUBST") == CleanerEngine(rules).clean(
+        "POSS CNTRL SUBST"
+    )
+
+
+@pytest.mark.parametrize(
+    "plan",
+    [
+        {},
+        [],
+        {"flags": None, "passes": [{"rules": [999]}]},
+        {"flags": None, "passes": []},
+        {"flags": [0], "passes": None},
+    ],
+)
+def test_plan_cache_not_a_plan(tmp_path, plan):
+    rules = substitutions[:20]
+    for lowercase in (False, True):
+        plan_cache = PlanCache(tmp_path / str(lowercase))
+        reference = CleanerEngine(rules, lowercase=lowercase)
+        CleanerEngine(rules, lowercase=lowercase, plan_cache=plan_cache)
+        for path in plan_cache.directory.glob("plan-*.json"):
+            path.write_text(json.dumps(plan))
+        engine = CleanerEngine(rules, lowercase=lowercase, plan_cache=plan_cache)
+        assert list(map(repr, engine.passes)) == list(map(repr, reference.passes))
+        # The plan was made again and stored over the bad one
+        for path in plan_cache.directory.glob("plan-*.json"):
+            assert json.loads(path.read_text()) != plan
+
+
+def test_plan_cache_planner_digest(tmp_path, monkeypatch):
+    plan_cache = PlanCache(tmp_path)
+    CleanerEngine(substitutions[:20], plan_cache=plan_cache)
+    monkeypatch.setattr(cleaning_utils, "_planner_digest", lambda: "edited")
+    CleanerEngine(substitutions[:20], plan_cache=plan_cache)
+    assert len(list(tmp_path.glob("plan-*.json"))) == 2
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from session_config import SessionProfile, available_cores
+
+
+def test_available_cores():
+    assert 1 <= available_cores() <= available_cores(logical=True)
+
+
+def test_presets():
+    auto = SessionProfile.preset()
+    assert auto.intra_op_num_threads == available_cores()
+    assert not auto.allow_spinning
+    assert auto.omp_wait_policy == "PASSIVE"
+    assert SessionProfile.preset("latency").allow_spinning
+    assert SessionProfile.preset("throughput").enable_mem_pattern
+    with pytest.raises(ValueError):
+        SessionProfile.preset("fastest")
+
+
+def test_load_precedence(tmp_path):
+    config = tmp_path / "ort.json"
+    config.write_text(
+        json.dumps(
+            {
+                "profile": "latency",
+                "intra_op_num_threads": 3,
+                "execution_mode": "parallel",
+            }
+        )
+    )
+    assert SessionProfile.load(env={}) == SessionProfile.preset()
+
+    profile = SessionProfile.load(env={"ROTA_ORT_CONFIG": str(config)})
+    assert profile.allow_spinning
+    assert profile.intra_op_num_threads == 3
+    assert profile.execution_mode == "parallel"
+
+    profile = SessionProfile.load(
+        config,
+        env={
+            "ROTA_ORT_PROFILE": "auto",
+            "ROTA_ORT_INTRA_OP_NUM_THREADS": "2",
+            "ROTA_ORT_ENABLE_CPU_MEM_ARENA": "false",
+            "ROTA_ORT_DISABLE_PREPACKING": "1",
+        },
+    )
+    assert profile.disable_prepacking
+    assert not profile.allow_spinning
+    assert profile.intra_op_num_threads == 2
+    assert not profile.enable_cpu_mem_arena
+    assert profile.execution_mode == "parallel"
+
+
+def test_load_rejects_bad_settings(tmp_path):
+    config = tmp_path / "ort.json"
+    config.write_text(json.dumps({"intra_threads": 3}))
+    with pytest.raises(ValueError, match="intra_threads"):
+        SessionProfile.load(config, env={})
+    with pytest.raises(ValueError):
+        SessionProfile.load(env={"ROTA_ORT_EXECUTION_MODE": "async"})
+    with pytest.raises(ValueError):
+        SessionProfile.load(env={"ROTA_ORT_INTRA_OP_NUM_THREADS": "-1"})
+
+
+def test_set_environment(monkeypatch):
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+    monkeypatch.setenv("OMP_WAIT_POLICY", "ACTIVE")
+    SessionProfile(intra_op_num_threads=3).set_environment()
+    assert os.environ["OMP_NUM_THREADS"] == "3"
+    # Set by hand: left alone
+    assert os.environ["OMP_WAIT_POLICY"] == "ACTIVE"
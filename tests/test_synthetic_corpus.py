@@ -0,0 +1,37 @@
+import random
+
+import pytest
+
+from synthetic_corpus import abbreviate, abbreviation_table, synthetic_corpus
+
+
+def test_abbreviation_table():
+    table = abbreviation_table()
+    assert "cntrl" in table[("controlled",)]
+    assert "w i" in table[("within",)]
+    for key, variants in table.items():
+        assert " ".join(key) not in variants
+
+
+def test_abbreviate():
+    table = {("controlled", "substance"): ["cntrl subst"], ("within",): ["w i"]}
+    rng = random.Random(0)
+    assert abbreviate("poss controlled substance", table, rng, rate=0) == (
+        "poss controlled substance"
+    )
+    text = abbreviate("controlled substance within", table, rng, rate=1)
+    assert text.startswith("cntrl")
+    assert text != "controlled substance within"
+
+
+def test_synthetic_corpus():
+    corpus = synthetic_corpus(2000, seed=3)
+    assert corpus == synthetic_corpus(2000, seed=3)
+    assert len(corpus) == 2000
+    assert 0.25 < 1 - len(set(corpus)) / len(corpus) < 0.35
+    assert len(set(synthetic_corpus(500, duplicate_rate=0))) == 500
+
+    short = synthetic_corpus(500, median_words=3, max_words=5, abbreviation_rate=0)
+    assert max(len(text.split()) for text in short) <= 5
+    with pytest.raises(ValueError):
+        synthetic_corpus(10, duplicate_rate=2)